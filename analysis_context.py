@@ -0,0 +1,87 @@
+# analysis_context.py
+# Derived buffers of one image for the comparison analytics. Each is computed on
+# first use and memoized, so every full-resolution conversion happens once per image.
+from functools import cached_property
+
+import cv2
+import numpy as np
+
+
+class AnalysisContext:
+    """Lazily computed, memoized derivatives of one RGB uint8 image.
+
+    All analyses of a comparison read the grayscale, float32 and Lab
+    versions of an image from its context instead of converting it again.
+    The arrays are shared between analyses, so treat them as read-only.
+    """
+
+    def __init__(self, rgb):
+        # OpenCV wants contiguous buffers, e.g. memory-mapped TIFFs may be strided views
+        self.rgb = np.ascontiguousarray(rgb[:, :, :3])
+        self._ssim = {}
+
+    @property
+    def shape(self):
+        return self.rgb.shape[:2]
+
+    @cached_property
+    def gray(self):
+        return cv2.cvtColor(self.rgb, cv2.COLOR_RGB2GRAY)
+
+    @cached_property
+    def gray_float(self):
+        # [0, 1], the scale skimage converts uint8 input to, but in float32 instead of float64
+        return np.multiply(self.gray, np.float32(1 / 255), dtype=np.float32)
+
+    @cached_property
+    def rgb_float(self):
+        return np.multiply(self.rgb, np.float32(1 / 255), dtype=np.float32)
+
+    @cached_property
+    def lab(self):
+        from skimage.color import rgb2lab
+
+        # float32 input keeps the whole conversion in float32
+        return rgb2lab(self.rgb_float)
+
+    @cached_property
+    def histograms(self):
+        """Exact counts: "channels" (3, 256), "all" (256, every channel together) and "luma" (256)"""
+        channels = np.stack([np.bincount(self.rgb[:, :, i].ravel(), minlength=256) for i in range(3)])
+        return {
+            "channels": channels,
+            "all": channels.sum(axis=0),
+            "luma": np.bincount(self.gray.ravel(), minlength=256),
+        }
+
+    @cached_property
+    def edges(self):
+        from skimage.filters import sobel
+
+        return sobel(self.gray_float)
+
+    @cached_property
+    def fft_magnitude(self):
+        # Centered log-magnitude spectrum; log1p keeps zero coefficients finite
+        return 20 * np.log1p(np.abs(np.fft.fftshift(np.fft.fft2(self.gray_float * 255))))
+
+    @cached_property
+    def sharpness(self):
+        # Variance of the Laplacian
+        return float(np.var(cv2.Laplacian(self.gray, cv2.CV_64F)))
+
+    @cached_property
+    def texture(self):
+        from skimage.feature import local_binary_pattern
+
+        # Uniform local binary patterns, 8 neighbours at radius 3
+        return local_binary_pattern(self.gray, 8, 3, method='uniform')
+
+    def ssim(self, other, win_size=7):
+        """Mean SSIM over the RGB channels against another context, memoized per pair"""
+        from skimage.metrics import structural_similarity
+
+        key = (other, win_size)
+        if key not in self._ssim:
+            self._ssim[key] = float(structural_similarity(self.rgb, other.rgb, win_size=win_size, channel_axis=-1))
+        return self._ssim[key]
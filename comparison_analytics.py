@@ -2,40 +2,19 @@ import streamlit as st
 import numpy as np
 import matplotlib.pyplot as plt
 from PIL import Image
-import cv2
 from skimage.metrics import structural_similarity as ssim
-from skimage.filters import sobel
-from skimage.color import rgb2lab
 from scipy import stats
+from io import BytesIO
+from analysis_context import AnalysisContext
 
-@st.cache_data
-def calculate_ssim(original_array, compressed_array, win_size):
-    return ssim(original_array, compressed_array, win_size=win_size, channel_axis=-1)
+@st.cache_resource(max_entries=4)
+def load_analysis_context(image_bytes):
+    # Keyed by the encoded file, so the memoized buffers survive reruns without hashing decoded arrays
+    return AnalysisContext(np.array(Image.open(BytesIO(image_bytes)).convert("RGB")))
 
-@st.cache_data
-def calculate_edges(image_gray_array):
-    return sobel(image_gray_array)
-
-@st.cache_data
-def calculate_fft_magnitude(image_gray_array):
-    f_transform = np.fft.fft2(image_gray_array)
-    f_shift = np.fft.fftshift(f_transform)
-    magnitude_spectrum = 20 * np.log(np.abs(f_shift))
-    return magnitude_spectrum
-
-@st.cache_data
-def calculate_color_diff(original_lab, compressed_lab):
-    return np.abs(original_lab - compressed_lab)
-
-@st.cache_data
-def calculate_sharpness(image_gray_array):
-     laplacian = cv2.Laplacian(image_gray_array, cv2.CV_64F)
-     return np.var(laplacian)
-
-@st.cache_data
-def calculate_texture(image_gray_array):
-    from skimage.feature import local_binary_pattern
-    return local_binary_pattern(image_gray_array, 8, 3, method='uniform')
+def plot_counts(ax, counts, **style):
+    # Draws precomputed counts as a filled step histogram
+    ax.stairs(counts, np.arange(len(counts) + 1), fill=True, **style)
 
 def comparison_page():
     st.title("🖼️ Compare Images")
@@ -72,21 +51,25 @@ def comparison_page():
         with col2:
             st.image(compressed_image, caption="Compressed Image", use_column_width=True)
 
-        display_metrics(st.session_state['original_image'], st.session_state['compressed_image'])
-        display_histograms(original_image, compressed_image)
-        display_pixel_intensity_comparison(original_image, compressed_image)
-        display_color_channel_comparison(original_image, compressed_image)
-        display_edge_detection_comparison(original_image, compressed_image)
-        display_ssim_map(original_image, compressed_image)
-        display_frequency_domain_analysis(original_image, compressed_image)
-        display_contour_plots(original_image, compressed_image)
-        display_color_difference_maps(original_image, compressed_image)
-        display_sharpness_comparison(original_image, compressed_image)
-        display_texture_analysis(original_image, compressed_image)
+        # Grayscale, float32, Lab and histograms of each image, computed once and shared by every section
+        original = load_analysis_context(st.session_state['original_image'].getvalue())
+        compressed = load_analysis_context(st.session_state['compressed_image'].getvalue())
+
+        display_metrics(st.session_state['original_image'], st.session_state['compressed_image'], original, compressed)
+        display_histograms(original, compressed)
+        display_pixel_intensity_comparison(original, compressed)
+        display_color_channel_comparison(original, compressed)
+        display_edge_detection_comparison(original, compressed)
+        display_ssim_map(original, compressed)
+        display_frequency_domain_analysis(original, compressed)
+        display_contour_plots(original, compressed)
+        display_color_difference_maps(original, compressed)
+        display_sharpness_comparison(original, compressed)
+        display_texture_analysis(original, compressed)
     else:
         st.write("No images stored for comparison. Please compress an image first.")
 
-def display_metrics(original_file, compressed_image):
+def display_metrics(original_file, compressed_image, original, compressed):
     st.markdown("""
     ## 📊 Image Metrics
     These metrics provide a quantitative comparison between the original and compressed images.
@@ -110,10 +93,8 @@ def display_metrics(original_file, compressed_image):
     A higher compression ratio indicates more space saved, but might come at the cost of image quality.
     """)
 
-    original_array = np.array(Image.open(original_file))
-    compressed_array = np.array(Image.open(compressed_image))
-    win_size = min(original_array.shape[0], original_array.shape[1], 7)
-    ssim_index = calculate_ssim(original_array, compressed_array, win_size)
+    win_size = min(*original.shape, 7)
+    ssim_index = original.ssim(compressed, win_size)
 
     st.metric("SSIM (Structural Similarity Index)", f"{ssim_index:.4f}")
     st.markdown("""
@@ -122,7 +103,7 @@ def display_metrics(original_file, compressed_image):
     - Values above 0.9 generally indicate good quality compression.
     """)
 
-def display_histograms(original_image, compressed_image):
+def display_histograms(original, compressed):
     st.markdown("""
     ## 📊 Image Histograms
     Histograms show the distribution of pixel intensities in an image.
@@ -130,12 +111,12 @@ def display_histograms(original_image, compressed_image):
 
     fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(15, 5))
     
-    ax1.hist(np.array(original_image).ravel(), bins=256, color='blue', alpha=0.7)
+    plot_counts(ax1, original.histograms["all"], color='blue', alpha=0.7)
     ax1.set_title("Original Image Histogram")
     ax1.set_xlabel("Pixel Intensity")
     ax1.set_ylabel("Frequency")
 
-    ax2.hist(np.array(compressed_image).ravel(), bins=256, color='red', alpha=0.7)
+    plot_counts(ax2, compressed.histograms["all"], color='red', alpha=0.7)
     ax2.set_title("Compressed Image Histogram")
     ax2.set_xlabel("Pixel Intensity")
     ax2.set_ylabel("Frequency")
@@ -148,18 +129,15 @@ def display_histograms(original_image, compressed_image):
     - A well-preserved histogram suggests that the overall visual characteristics are maintained after compression.
     """)
 
-def display_pixel_intensity_comparison(original_image, compressed_image):
+def display_pixel_intensity_comparison(original, compressed):
     st.markdown("""
     ## 🔍 Pixel Intensity Comparison
     This analysis compares the distribution of pixel intensities between the original and compressed images.
     """)
 
-    original_array = np.array(original_image.convert("L"))
-    compressed_array = np.array(compressed_image.convert("L"))
-
     fig, ax = plt.subplots(figsize=(10, 6))
-    ax.hist(original_array.ravel(), bins=256, color='blue', alpha=0.5, label='Original')
-    ax.hist(compressed_array.ravel(), bins=256, color='red', alpha=0.5, label='Compressed')
+    plot_counts(ax, original.histograms["luma"], color='blue', alpha=0.5, label='Original')
+    plot_counts(ax, compressed.histograms["luma"], color='red', alpha=0.5, label='Compressed')
     ax.set_title('Pixel Intensity Distribution Comparison')
     ax.set_xlabel('Pixel Intensity')
     ax.set_ylabel('Frequency')
@@ -172,22 +150,19 @@ def display_pixel_intensity_comparison(original_image, compressed_image):
     - Ideally, the compressed image should closely follow the original's distribution.
     """)
 
-def display_color_channel_comparison(original_image, compressed_image):
+def display_color_channel_comparison(original, compressed):
     st.markdown("""
     ## 🌈 Color Channel Comparison
     This section breaks down the image into its Red, Green, and Blue components.
     """)
 
-    original_array = np.array(original_image)
-    compressed_array = np.array(compressed_image)
-
     fig, axs = plt.subplots(2, 3, figsize=(15, 10 ))
 
     for i, color in enumerate(['Red', 'Green', 'Blue']):
-        axs[0, i].hist(original_array[:, :, i].ravel(), bins=256, color=color.lower(), alpha=0.5)
+        plot_counts(axs[0, i], original.histograms["channels"][i], color=color.lower(), alpha=0.5)
         axs[0, i].set_title(f'Original {color} Channel Histogram')
 
-        axs[1, i].hist(compressed_array[:, :, i].ravel(), bins=256, color=color.lower(), alpha=0.5)
+        plot_counts(axs[1, i], compressed.histograms["channels"][i], color=color.lower(), alpha=0.5)
         axs[1, i].set_title(f'Compressed {color} Channel Histogram')
 
     st.pyplot(fig)
@@ -198,24 +173,18 @@ def display_color_channel_comparison(original_image, compressed_image):
     - Ideally, the compressed image's color channels should closely match the original's.
     """)
 
-def display_edge_detection_comparison(original_image, compressed_image):
+def display_edge_detection_comparison(original, compressed):
     st.markdown("""
     ## 🔍 Edge Detection Comparison
     This analysis highlights the edges in both images using the Sobel operator.
     """)
 
-    original_gray = np.array(original_image.convert("L"))
-    compressed_gray = np.array(compressed_image.convert("L"))
-
-    original_edges = calculate_edges(original_gray)
-    compressed_edges = calculate_edges(compressed_gray)
-
     fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(12, 6))
 
-    ax1.imshow(original_edges, cmap='gray')
+    ax1.imshow(original.edges, cmap='gray')
     ax1.set_title('Original Image Edges')
 
-    ax2.imshow(compressed_edges, cmap='gray')
+    ax2.imshow(compressed.edges, cmap='gray')
     ax2.set_title('Compressed Image Edges')
 
     st.pyplot(fig)
@@ -226,16 +195,13 @@ def display_edge_detection_comparison(original_image, compressed_image):
     - A well-preserved edge structure in the compressed image is essential for maintaining visual quality.
     """)
 
-def display_ssim_map(original_image, compressed_image):
+def display_ssim_map(original, compressed):
     st.markdown("""
     ## 🗺️ SSIM Map
     This map visualizes the structural similarity between the original and compressed images.
     """)
 
-    original_array = np.array(original_image.convert("L"))
-    compressed_array = np.array(compressed_image.convert("L"))
-
-    ssim_index, ssim_image = ssim(original_array, compressed_array, full=True)
+    ssim_index, ssim_image = ssim(original.gray_float, compressed.gray_float, full=True, data_range=1.0)
 
     fig, ax = plt.subplots(figsize=(8, 8))
     ax.imshow(ssim_image, cmap='gray')
@@ -249,18 +215,14 @@ def display_ssim_map(original_image, compressed_image):
     - This map can help identify regions where compression has affected image quality.
     """)
 
-def display_frequency_domain_analysis(original_image, compressed_image):
+def display_frequency_domain_analysis(original, compressed):
     st.markdown("""
     ## 📊 Frequency Domain Analysis
     This analysis transforms the images into the frequency domain using the FFT.
     """)
 
-    def fft_image(image):
-        image_gray = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2GRAY)
-        return calculate_fft_magnitude(image_gray)
-
-    original_fft = fft_image(original_image)
-    compressed_fft = fft_image(compressed_image)
+    original_fft = original.fft_magnitude
+    compressed_fft = compressed.fft_magnitude
 
     col1, col2 = st.columns(2)
     with col1:
@@ -282,41 +244,37 @@ def display_frequency_domain_analysis(original_image, compressed_image):
     - A well-preserved frequency domain suggests that the compressed image maintains its original characteristics.
     """)
 
-def display_contour_plots(original_image, compressed_image):
+def display_contour_plots(original, compressed):
     st.markdown("""
     ## 📊 Contour Plots
     This analysis visualizes the contours of both images.
     """)
 
-    def contour_plot(image, title):
-        image_gray = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2GRAY)
+    def contour_plot(context, title):
         plt.figure(figsize=(5, 3))
-        plt.contour(image_gray, cmap='viridis')
+        plt.contour(context.gray, cmap='viridis')
         plt.title(title)
         plt.axis('off')
         st.pyplot(plt)
 
     col1, col2 = st.columns(2)
     with col1:
-        contour_plot(original_image, "Original Image Contours")
+        contour_plot(original, "Original Image Contours")
     with col2:
-        contour_plot(compressed_image, "Compressed Image Contours")
+        contour_plot(compressed, "Compressed Image Contours")
 
     st.markdown("""
     - Contours highlight the boundaries and shapes within an image.
     - A well-preserved contour structure in the compressed image is essential for maintaining visual quality.
     """)
 
-def display_color_difference_maps(original_image, compressed_image):
+def display_color_difference_maps(original, compressed):
     st.markdown("""
     ## 🌈 Color Difference Maps
     This analysis calculates the difference in color between the original and compressed images.
     """)
 
-    original_lab = rgb2lab(np.array(original_image))
-    compressed_lab = rgb2lab(np.array(compressed_image))
-    
-    diff_lab = calculate_color_diff(original_lab, compressed_lab)
+    diff_lab = np.abs(original.lab - compressed.lab)
     diff_l = diff_lab[:, :, 0]
     diff_a = diff_lab[:, :, 1]
     diff_b = diff_lab[:, :, 2]
@@ -352,18 +310,14 @@ def display_color_difference_maps(original_image, compressed_image):
     - A lower difference indicates better color preservation.
     """)
 
-def display_sharpness_comparison(original_image, compressed_image):
+def display_sharpness_comparison(original, compressed):
     st.markdown("""
     ## 🔍 Sharpness Comparison
     This analysis compares the sharpness of both images using the Laplacian operator.
     """)
 
-    def image_sharpness(image):
-        gray_image = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2GRAY)
-        return calculate_sharpness(gray_image)
-
-    original_sharpness = image_sharpness(original_image)
-    compressed_sharpness = image_sharpness(compressed_image)
+    original_sharpness = original.sharpness
+    compressed_sharpness = compressed.sharpness
 
     st.write(f"**Original Image Sharpness**: {original_sharpness:.2f}")
     st.write(f"**Compressed Image Sharpness**: {compressed_sharpness:.2f}")
@@ -371,29 +325,24 @@ def display_sharpness_comparison(original_image, compressed_image):
     col1, col2 = st.columns(2)
     with col1:
         st.write("**Original Image**")
-        st.image(original_image, caption=f"Sharpness: {original_sharpness:.2f}", use_column_width=True)
+        st.image(original.rgb, caption=f"Sharpness: {original_sharpness:.2f}", use_column_width=True)
     with col2:
         st.write("**Compressed Image**")
-        st.image(compressed_image, caption=f"Sharpness: {compressed_sharpness:.2f}", use_column_width=True)
+        st.image(compressed.rgb, caption=f"Sharpness: {compressed_sharpness:.2f}", use_column_width=True)
 
     st.markdown("""
     - Sharpness is a measure of the image's clarity and detail.
     - A higher sharpness value indicates a clearer image.
     """)
 
-def display_texture_analysis(original_image, compressed_image):
+def display_texture_analysis(original, compressed):
     st.markdown("""
     ## 🔍 Texture Analysis
     This analysis compares the texture of both images using the Local Binary Patterns (LBP) operator.
     """)
 
-    from skimage.feature import local_binary_pattern
-
-    original_gray = np.array(original_image.convert("L"))
-    compressed_gray = np.array(compressed_image.convert("L"))
-
-    original_lbp = calculate_texture(original_gray)
-    compressed_lbp = calculate_texture(compressed_gray)
+    original_lbp = original.texture
+    compressed_lbp = compressed.texture
 
     fig, (ax1, ax2) = plt.subplots (1, 2, figsize=(12, 6))
 
@@ -0,0 +1,205 @@
+# compress_directory.py
+# Offline PCA compression of a whole directory tree, without the Streamlit page or the HTTP API.
+#
+#   python compress_directory.py photos/ compressed/ -k 50 --workers 4
+#
+# Every finished file is appended to a JSON-lines manifest in the output directory;
+# re-running the same command skips files whose hash and settings are already in it.
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+import pca_engine
+import pca_container
+import pca_encoders
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp")
+MANIFEST_NAME = "manifest.jsonl"
+BLAS_THREAD_VARIABLES = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS")
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _init_worker(blas_threads):
+    # Workers inherit the BLAS_THREAD_VARIABLES set before the pool starts; threadpoolctl,
+    # when installed, also limits libraries that don't read them
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return
+    threadpool_limits(blas_threads)
+
+
+def compress_file(source, target, settings):
+    """Compress one image, returns its manifest entry (without the input hash)"""
+    timings = {}
+    start = time.perf_counter()
+    img_array = np.array(Image.open(source).convert("RGB"))
+    timings["decode"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    dtype = pca_engine.PRECISIONS[settings["precision"]]
+    if settings["format"] == pca_encoders.CONTAINER_FORMAT:
+        channels = pca_engine.split_channels(img_array)
+        decomposition = pca_engine.decompose(channels, settings["components"], solver=settings["engine"], dtype=dtype)
+        timings["compress"] = time.perf_counter() - start
+        start = time.perf_counter()
+        content = pca_encoders.encode_pcaz(decomposition, channels, settings["components"], settings["preset"])
+    else:
+        compressed_img_array, decomposition = pca_engine.compress_image_array(
+            img_array, settings["components"], solver=settings["engine"], dtype=dtype
+        )
+        timings["compress"] = time.perf_counter() - start
+        start = time.perf_counter()
+        content = pca_encoders.encode(compressed_img_array, settings["format"], settings["quality"])
+
+    target.parent.mkdir(parents=True, exist_ok=True)
+    # Write to a temporary name first so an interrupted run never leaves a truncated output
+    partial = target.with_name(target.name + ".part")
+    partial.write_bytes(content)
+    os.replace(partial, target)
+    timings["encode"] = time.perf_counter() - start
+
+    return {
+        "height": img_array.shape[0],
+        "width": img_array.shape[1],
+        "k": decomposition.clamp_components(settings["components"]),
+        "engine": decomposition.solver,
+        "input_bytes": source.stat().st_size,
+        "output_bytes": len(content),
+        "timings": timings,
+    }
+
+
+def load_manifest(path):
+    """Completed entries keyed by input path; later lines win"""
+    done = {}
+    if path.exists():
+        with open(path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # partial last line of an interrupted run
+                done[entry["input"]] = entry
+    return done
+
+
+def find_images(input_dir):
+    return sorted(
+        path for path in input_dir.rglob("*")
+        if path.is_file() and path.suffix.lower() in IMAGE_EXTENSIONS
+    )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Compress every image in a directory tree with PCA.")
+    parser.add_argument("input_dir", type=Path)
+    parser.add_argument("output_dir", type=Path)
+    parser.add_argument("-k", "--components", type=int, default=50, help="principal components per channel")
+    parser.add_argument("--engine", default="auto", choices=("auto",) + pca_engine.SOLVERS)
+    parser.add_argument("--precision", default="float64", choices=list(pca_engine.PRECISIONS))
+    parser.add_argument("--format", default="jpeg-optimized",
+                        choices=pca_encoders.available_formats() + [pca_encoders.CONTAINER_FORMAT])
+    parser.add_argument("--preset", default="int8 + zlib", choices=list(pca_container.PRESETS),
+                        help="container preset for --format pcaz")
+    parser.add_argument("--quality", type=int, default=75, help="JPEG / WebP quality")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--blas-threads", type=int, default=None,
+                        help="BLAS threads per worker (default: cores / workers)")
+    parser.add_argument("--force", action="store_true", help="recompress files already in the manifest")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    settings = {
+        "components": args.components, "engine": args.engine, "precision": args.precision,
+        "format": args.format, "preset": args.preset, "quality": args.quality,
+    }
+
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = args.output_dir / MANIFEST_NAME
+    done = {} if args.force else load_manifest(manifest_path)
+
+    # Output name -> input; a.png and a.jpg map to a.png.jpg and a.jpg, so only odd names can clash
+    outputs = {}
+    for source in find_images(args.input_dir):
+        relative = source.relative_to(args.input_dir).as_posix()
+        output = pca_encoders.output_name(relative, args.format)
+        if output in outputs:
+            print(f"{outputs[output]} and {relative} would both be written to {output}, rename one of them",
+                  file=sys.stderr)
+            return 2
+        outputs[output] = relative
+
+    pending = []
+    for output, relative in outputs.items():
+        source = args.input_dir / relative
+        target = args.output_dir / output
+        digest = file_digest(source)
+        previous = done.get(relative)
+        # Unchanged input, same settings and the output is still there: nothing to do
+        if previous and previous["sha256"] == digest and previous["settings"] == settings and target.exists():
+            continue
+        pending.append((source, relative, target, digest))
+
+    print(f"{len(pending)} to compress, {len(done)} already in the manifest")
+    if not pending:
+        return 0
+
+    # Each worker gets its share of the cores for BLAS, so N workers don't run N x cores threads.
+    # Spawned workers start fresh interpreters, so their BLAS libraries read these when they load.
+    workers = max(1, min(args.workers, len(pending)))
+    blas_threads = args.blas_threads or max(1, (os.cpu_count() or 1) // workers)
+    for name in BLAS_THREAD_VARIABLES:
+        os.environ[name] = str(blas_threads)
+
+    failures = 0
+    start = time.perf_counter()
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                             initargs=(blas_threads,)) as pool, open(manifest_path, "a") as manifest:
+        futures = {
+            pool.submit(compress_file, source, target, settings): (relative, target, digest)
+            for source, relative, target, digest in pending
+        }
+        for count, future in enumerate(as_completed(futures), start=1):
+            relative, target, digest = futures[future]
+            try:
+                entry = future.result()
+            except Exception as e:
+                failures += 1
+                print(f"[{count}/{len(pending)}] {relative}: {type(e).__name__}: {e}", file=sys.stderr)
+                continue
+            entry = {
+                "input": relative, "sha256": digest,
+                "output": target.relative_to(args.output_dir).as_posix(),
+                "settings": settings, **entry,
+            }
+            # One line per file, flushed right away, so a crash loses at most the files in flight
+            manifest.write(json.dumps(entry) + "\n")
+            manifest.flush()
+            print(f"[{count}/{len(pending)}] {relative}: k={entry['k']} "
+                  f"{entry['input_bytes']} -> {entry['output_bytes']} bytes")
+
+    print(f"Done in {time.perf_counter() - start:.1f}s, {failures} failed")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,7 +4,9 @@ import streamlit as st
 from PIL import Image
 from io import BytesIO
 import numpy as np
-from utils import apply_pca, validate_image  # Make sure utils.py is in the same directory
+from utils import apply_pca, apply_pca_container, container_rate_distortion, component_selector, validate_image, load_preview, PREVIEW_SCALES  # Make sure utils.py is in the same directory
+import pca_container
+import pca_encoders
 
 def upload_image():
     st.title("📤 Upload Image for Compression")
@@ -31,15 +33,58 @@ def upload_image():
             max_components = min(img_array.shape[0], img_array.shape[1])  # Total pixels vs channels
             st.session_state['max_components'] = max_components
 
-            # Slider for choosing number of components
-            num_components = st.slider("Number of Principal Components", min_value=1, max_value=max_components, value=10)
+            # Storage settings for the .pcaz download
+            container_preset = st.selectbox(
+                "PCA container quantization",
+                list(pca_container.PRESETS),
+                index=list(pca_container.PRESETS).index("int8 + zlib")
+            )
+
+            # Slider, or a variance / PSNR / size target, for choosing number of components
+            num_components = component_selector(img_array, max_components, default=10, key="compress", preset=container_preset)
+
+            # Decorrelate RGB into luma + chroma and spend fewer components on chroma
+            use_ycbcr = st.checkbox("Compress in YCbCr colour space")
+            chroma_components, subsample_chroma = None, False
+            if use_ycbcr:
+                chroma_components = st.slider(
+                    "Chroma components", 1, max_components, max(1, num_components // 2), key="chroma_components"
+                )
+                subsample_chroma = st.checkbox("Subsample chroma (4:2:0)", value=True)
+
+            # Format of the compressed image download
+            output_format = st.selectbox("Output format", pca_encoders.available_formats())
+            # Encodes the result once per format, so only on request
+            compare_encoders = st.checkbox("Compare encoders after compressing")
+            # Encodes and decodes the container for every preset at three component counts
+            show_rate_distortion = st.checkbox("Rate-distortion report after compressing")
+
+            # Live preview on a reduced decode while the settings change; full resolution only runs on the button
+            preview_label = st.select_slider("Live preview scale", list(PREVIEW_SCALES), value="1/4")
+            preview_scale = PREVIEW_SCALES[preview_label]
+            if preview_scale > 1:
+                preview_array = load_preview(uploaded_image, preview_scale)
+                preview_components = min(num_components, *preview_array.shape[:2])
+                preview_bytes = apply_pca(
+                    preview_array, preview_components, color_space="ycbcr" if use_ycbcr else "rgb",
+                    chroma_components=min(chroma_components, preview_components) if chroma_components else None,
+                    subsample_chroma=subsample_chroma
+                )
+                st.image(
+                    preview_bytes, caption=f"Preview at {preview_label} scale ({preview_components} components)",
+                    use_column_width=True
+                )
 
             if st.button("Compress Image"):
                 with st.spinner('Processing...'):
                     import time  # Import time for measuring compression duration
                     start_time = time.time()  # Start timer
  
-                    compressed_image_bytes = apply_pca(img_array, num_components)
+                    compressed_image_bytes = apply_pca(
+                        img_array, num_components, color_space="ycbcr" if use_ycbcr else "rgb",
+                        chroma_components=chroma_components, subsample_chroma=subsample_chroma,
+                        output_format=output_format
+                    )
                     compressed_image = Image.open(compressed_image_bytes)
 
                     # Calculate time taken
@@ -57,20 +102,40 @@ def upload_image():
                     st.markdown(f"### Compression Time: {time_taken:.2f} seconds")
                     
 
-                    # Save and download compressed image
+                    # Save and download compressed image, already encoded in the chosen format
                     st.markdown("### Save Compressed Image")
-                    img_bytes = BytesIO()
-                    compressed_image.save(img_bytes, format='JPEG')
-                    img_bytes.seek(0)
-
                     download_btn = st.download_button(
                         label="Download Compressed Image",
-                        data=img_bytes,
-                        file_name="compressed_image.jpg",
-                        mime="image/jpeg",
+                        data=compressed_image_bytes.getvalue(),
+                        file_name="compressed_image" + pca_encoders.extension(output_format),
+                        mime=pca_encoders.media_type(output_format),
                         key="download_compressed_img"
                     )
 
+                    if compare_encoders:
+                        with st.expander("Encoder comparison", expanded=True):
+                            # Size and encode time of the compressed image in every available format
+                            report = pca_encoders.benchmark(np.array(compressed_image.convert('RGB')))
+                            st.dataframe(report, use_container_width=True)
+
+                    # The PCA representation itself: per-channel scores, basis and mean
+                    pcaz_bytes = apply_pca_container(img_array, num_components, preset=container_preset)
+                    st.markdown(f"PCA container size: {len(pcaz_bytes) / 1024:.2f} KB (decodes to any number of components up to {num_components})")
+                    st.download_button(
+                        label="Download PCA Container (.pcaz)",
+                        data=pcaz_bytes,
+                        file_name="compressed_image" + pca_container.FILE_EXTENSION,
+                        mime=pca_container.MEDIA_TYPE,
+                        key="download_compressed_pcaz"
+                    )
+
+                    if show_rate_distortion:
+                        with st.expander("Rate-distortion report", expanded=True):
+                            # Bytes against PSNR for every container preset at a few component counts
+                            k_values = sorted({max(1, num_components // 4), max(1, num_components // 2), num_components})
+                            report = container_rate_distortion(img_array, k_values)
+                            st.dataframe(report, use_container_width=True)
+
         else:
             st.error("Unsupported file format. Please upload a jpg, jpeg, or png file.")
             
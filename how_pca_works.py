@@ -6,6 +6,8 @@ from PIL import Image
 from io import BytesIO
 import matplotlib.pyplot as plt
 import time
+import pca_engine
+from utils import component_selector
 
 def set_custom_style():
     st.markdown("""
@@ -84,33 +86,23 @@ def set_custom_style():
         </style>
     """, unsafe_allow_html=True)
 
-def pca_compress(channel, no_of_components, channel_name):
+def pca_compress(decomposition, index, channel, no_of_components, channel_name):
     with st.container():
         st.markdown(f'<div class="step-header">{channel_name} PCA:</div>', unsafe_allow_html=True)
-        mean = np.mean(channel, axis=0)
-        centered_data = channel - mean
 
-        cov_matrix = np.cov(centered_data, rowvar=False)
+        # The covariance and eigen decomposition come from the shared batched engine
+        cov_matrix = decomposition.cov_matrices[index]
         st.text(f'Step in {channel_name}: Covariance Matrix\n{cov_matrix}')
 
-        eig_vals, eig_vecs = np.linalg.eigh(cov_matrix)
-
-        sorted_indices = np.argsort(eig_vals)[::-1]
-        sorted_eig_vals = eig_vals[sorted_indices]
-        sorted_eig_vecs = eig_vecs[:, sorted_indices]
+        sorted_eig_vals = decomposition.eig_vals[index]
+        sorted_eig_vecs = decomposition.eig_vecs[index]
 
         st.text(f'Step in {channel_name}: Sorted Eigenvalues\n{sorted_eig_vals}')
         st.text(f'Step in {channel_name}: Sorted Eigenvectors\n{sorted_eig_vecs}')
 
-        if no_of_components > len(sorted_eig_vals):
-            no_of_components = len(sorted_eig_vals)
-        elif no_of_components < 1:
-            no_of_components = 1
-
-        projection_matrix = sorted_eig_vecs[:, :no_of_components]
-        compressed_data = np.dot(centered_data, projection_matrix)
+        no_of_components = decomposition.clamp_components(no_of_components)
 
-        reconstructed_data = np.dot(compressed_data, projection_matrix.T) + mean
+        reconstructed_data = decomposition.channel(index).reconstruct_float(channel, no_of_components)[0]
 
         reconstructed_display_data = (reconstructed_data - np.min(reconstructed_data)) / (np.max(reconstructed_data) - np.min(reconstructed_data))
         st.image(reconstructed_display_data, caption=f'Step in {channel_name}: Reconstructed Data', use_column_width=True)
@@ -168,9 +160,12 @@ def apply_pca_to_image(original_image, no_of_components):
         st.markdown('</div>', unsafe_allow_html=True)
 
     with st.spinner('Applying PCA to each channel...'):
-        red_compressed = pca_compress(red_channel, no_of_components, 'Red Channel')
-        green_compressed = pca_compress(green_channel, no_of_components, 'Green Channel')
-        blue_compressed = pca_compress(blue_channel, no_of_components, 'Blue Channel')
+        # Decompose all three channels in one batched call
+        decomposition = pca_engine.decompose(pca_engine.split_channels(img_array[:, :, :3]), keep_covariance=True)
+
+        red_compressed = pca_compress(decomposition, 0, red_channel, no_of_components, 'Red Channel')
+        green_compressed = pca_compress(decomposition, 1, green_channel, no_of_components, 'Green Channel')
+        blue_compressed = pca_compress(decomposition, 2, blue_channel, no_of_components, 'Blue Channel')
 
     compressed_img_array = np.stack((red_compressed, green_compressed, blue_compressed), axis=2)
     compressed_img = Image.fromarray(np.uint8(compressed_img_array))
@@ -312,35 +307,36 @@ def how_pca_works_page():
     st.markdown("""
         <div class="explanation-box">
             <h4>Step 2: PCA Compression Function</h4>
-            <p>The core PCA implementation for each color channel:</p>
+            <p>The core PCA implementation, applied to all color channels at once
+            (the three covariance matrices are stacked and decomposed in a single batched call):</p>
         </div>
     """, unsafe_allow_html=True)
 
     st.code("""
-    def pca_compress(channel, num_components):
+    def pca_compress(channels, num_components):
+        # channels has shape (3, height, width)
         # Calculate mean and center the data
-        mean = np.mean(channel, axis=0)
-        centered_data = channel - mean
+        mean = np.mean(channels, axis=1, keepdims=True)
+        centered_data = channels - mean
 
-        # Compute covariance matrix
-        cov_matrix = np.cov(centered_data, rowvar=False)
+        # Compute the stacked covariance matrices, shape (3, width, width)
+        cov_matrices = centered_data.transpose(0, 2, 1) @ centered_data / (channels.shape[1] - 1)
 
-        # Compute eigenvalues and eigenvectors
-        eig_vals, eig_vecs = np.linalg.eigh(cov_matrix)
+        # Compute eigenvalues and eigenvectors of all channels in one call
+        eig_vals, eig_vecs = np.linalg.eigh(cov_matrices)
 
         # Sort eigenvalues and eigenvectors in descending order
-        sorted_indices = np.argsort(eig_vals)[::-1]
-        sorted_eig_vals = eig_vals[sorted_indices]
-        sorted_eig_vecs = eig_vecs[:, sorted_indices]
+        sorted_eig_vals = eig_vals[:, ::-1]
+        sorted_eig_vecs = eig_vecs[:, :, ::-1]
 
         # Select top k eigenvectors
-        projection_matrix = sorted_eig_vecs[:, :num_components]
+        projection_matrix = sorted_eig_vecs[:, :, :num_components]
 
         # Project data onto new basis
-        compressed_data = np.dot(centered_data, projection_matrix)
+        compressed_data = centered_data @ projection_matrix
 
         # Reconstruct the data
-        reconstructed_data = np.dot(compressed_data, projection_matrix.T) + mean
+        reconstructed_data = compressed_data @ projection_matrix.transpose(0, 2, 1) + mean
 
         return np.clip(reconstructed_data, 0, 255).astype(np.uint8)
     """, language='python')
@@ -348,15 +344,14 @@ def how_pca_works_page():
     st.markdown("""
         <div class="explanation-box">
             <h4>Step 3: Combining Channels</h4>
-            <p>After compressing each channel, we combine them back into an RGB image:</p>
+            <p>After compressing the channels, we combine them back into an RGB image:</p>
         </div>
     """, unsafe_allow_html=True)
 
     st.code("""
-    # Compress each channel
-    red_compressed = pca_compress(red_channel, num_components)
-    green_compressed = pca_compress(green_channel, num_components)
-    blue_compressed = pca_compress(blue_channel, num_components)
+    # Compress all channels together
+    channels = np.stack((red_channel, green_channel, blue_channel))
+    red_compressed, green_compressed, blue_compressed = pca_compress(channels, num_components)
 
     # Stack channels back together
     compressed_img_array = np.stack(
@@ -391,13 +386,8 @@ def how_pca_works_page():
         img_array = np.array(original_image)
         max_components = min(img_array.shape[0], img_array.shape[1])
 
-        # Slider for choosing number of components
-        num_components = st.slider(
-            "Number of Principal Components", 
-            min_value=1, 
-            max_value=max_components, 
-            value=min(10, max_components)
-        )
+        # Slider, or a variance / PSNR / size target, for choosing number of components
+        num_components = component_selector(img_array, max_components, default=10, key="how_pca")
 
         # Slider for choosing number of components
         #num_components = st.slider("Number of Principal Components", min_value=1, max_value=500, value=10)
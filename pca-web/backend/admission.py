@@ -0,0 +1,163 @@
+# admission.py
+# Pre-flight for compression requests: decide from the image header alone, before anything is
+# decoded, whether a request runs now, runs on a downscaled image, goes to the job queue or is refused.
+import io
+import os
+from PIL import Image
+import pca_engine
+
+# Decompression bomb guard: images with more pixels are refused outright
+MAX_PIXELS = int(os.environ.get("PCA_MAX_PIXELS", 40_000_000))
+# Peak memory one worker may spend on a single image
+WORKER_MEMORY_BYTES = int(os.environ.get("PCA_WORKER_MEMORY_BYTES", 1024 * 1024 * 1024))
+# Sustained throughput of one worker, converts the flop estimate into seconds
+FLOPS_PER_SECOND = float(os.environ.get("PCA_FLOPS_PER_SECOND", 10e9))
+# Requests estimated to take longer go to the job queue when the client allows it
+SYNC_MAX_SECONDS = float(os.environ.get("PCA_SYNC_MAX_SECONDS", 10))
+
+# What to do with an image over the memory budget
+OVERSIZE_POLICIES = ("reject", "downscale")
+DEFAULT_OVERSIZE_POLICY = os.environ.get("PCA_OVERSIZE_POLICY", "downscale")
+
+# Preview requests run the whole pipeline at 1/2, 1/4 or 1/8 of the original size
+PREVIEW_SCALES = (1, 2, 4, 8)
+
+# Peak bytes per pixel of /compare/analytics for both images together, measured with tracemalloc.
+# Rendering ("png") adds matplotlib's float64 image copies to the raw data mode.
+COMPARE_BYTES_PER_PIXEL = {"png": 384, "data": 96}
+
+# PIL itself warns above this and raises DecompressionBombError above twice this,
+# which also protects every other place that opens an image in this process
+Image.MAX_IMAGE_PIXELS = MAX_PIXELS
+
+
+class AdmissionError(Exception):
+    """Request refused before decoding; carries the HTTP status to answer with"""
+
+    def __init__(self, status_code, detail):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def read_header(source):
+    """(width, height) from the header of an image given as bytes or a path; the pixel data is not decoded"""
+    try:
+        with Image.open(io.BytesIO(source) if isinstance(source, bytes) else source) as img:
+            return img.size
+    except Image.DecompressionBombError as e:
+        raise AdmissionError(413, str(e))
+    except Exception:
+        raise AdmissionError(400, "Cannot read the image header")
+
+
+def check_pixels(width, height):
+    if width * height > MAX_PIXELS:
+        raise AdmissionError(413, f"Image has {width * height} pixels, the limit is {MAX_PIXELS}")
+
+
+def estimate(width, height, num_components, engine="auto", precision="float64"):
+    cost = pca_engine.estimate_cost(height, width, num_components, engine, pca_engine.PRECISIONS[precision])
+    cost["seconds"] = cost["flops"] / FLOPS_PER_SECOND
+    return cost
+
+
+def fit_size(width, height, num_components, engine, precision):
+    """Largest size with the original aspect ratio whose estimate fits WORKER_MEMORY_BYTES"""
+    scale = 1.0
+    for _ in range(20):
+        size = (max(1, int(width * scale)), max(1, int(height * scale)))
+        cost = estimate(*size, num_components, engine, precision)
+        if cost["peak_bytes"] <= WORKER_MEMORY_BYTES:
+            return size, cost
+        # Memory grows roughly with the square of the scale
+        scale *= min(0.9, 0.98 * (WORKER_MEMORY_BYTES / cost["peak_bytes"]) ** 0.5)
+    raise AdmissionError(413, "Image cannot be downscaled to fit the memory budget")
+
+
+def check_budget(width, height, cost, oversize):
+    # Refuse (reject policy) or report whether the request has to be downscaled
+    if cost["peak_bytes"] <= WORKER_MEMORY_BYTES:
+        return False
+    if oversize == "reject":
+        raise AdmissionError(
+            413, f"Processing a {width}x{height} image needs about {cost['peak_bytes'] >> 20} MB, "
+                 f"the per-worker budget is {WORKER_MEMORY_BYTES >> 20} MB"
+        )
+    return True
+
+
+def preview_size(width, height, preview):
+    return max(1, width // preview), max(1, height // preview)
+
+
+def admit(source, num_components, engine="auto", precision="float64", oversize=DEFAULT_OVERSIZE_POLICY,
+          allow_async=False, preview=1):
+    """Decide how to run a compression request from its header.
+
+    preview > 1 runs the request on the image reduced by that factor.
+    Returns {"action": "run" or "queue", "size": target (width, height) or None,
+    "original_size", "cost", "preview", "downscaled"}, where downscaled says
+    the memory budget forced a smaller size; raises AdmissionError when the
+    request is refused.
+    """
+    if oversize not in OVERSIZE_POLICIES:
+        raise AdmissionError(400, f"Unknown oversize policy: {oversize}")
+    if preview not in PREVIEW_SCALES:
+        raise AdmissionError(400, f"preview must be one of {', '.join(map(str, PREVIEW_SCALES))}")
+    width, height = read_header(source)
+    check_pixels(width, height)
+
+    size = preview_size(width, height, preview) if preview > 1 else None
+    cost = estimate(*(size or (width, height)), num_components, engine, precision)
+    downscaled = check_budget(width, height, cost, oversize)
+    if downscaled:
+        size, cost = fit_size(*(size or (width, height)), num_components, engine, precision)
+
+    action = "queue" if allow_async and cost["seconds"] > SYNC_MAX_SECONDS else "run"
+    return {
+        "action": action, "size": size, "original_size": (width, height), "cost": cost,
+        "preview": preview, "downscaled": downscaled,
+    }
+
+
+def admit_comparison(original, compressed, bytes_per_pixel, oversize=DEFAULT_OVERSIZE_POLICY):
+    """Pre-flight for comparing two images, sized by the original (the other is resized to it).
+
+    Same result shape as admit(); size is where both images get decoded to
+    when the analytics would not fit WORKER_MEMORY_BYTES at full size.
+    """
+    if oversize not in OVERSIZE_POLICIES:
+        raise AdmissionError(400, f"Unknown oversize policy: {oversize}")
+    check_pixels(*read_header(compressed))
+    width, height = read_header(original)
+    check_pixels(width, height)
+
+    size = None
+    cost = {"peak_bytes": width * height * bytes_per_pixel}
+    downscaled = check_budget(width, height, cost, oversize)
+    if downscaled:
+        # Memory is linear in the pixel count
+        scale = 0.98 * (WORKER_MEMORY_BYTES / cost["peak_bytes"]) ** 0.5
+        size = (max(1, int(width * scale)), max(1, int(height * scale)))
+        cost = {"peak_bytes": size[0] * size[1] * bytes_per_pixel}
+    return {
+        "action": "run", "size": size, "original_size": (width, height), "cost": cost,
+        "preview": 1, "downscaled": downscaled,
+    }
+
+
+def describe(admitted):
+    """X-PCA-Admission value: "accepted", "preview 1/4 WxH", "downscaled WxH" or both.
+
+    A requested preview and a downscale forced by the memory budget are
+    reported separately, so clients can tell them apart.
+    """
+    parts = []
+    if admitted["preview"] > 1:
+        parts.append("preview 1/{}".format(admitted["preview"]))
+    if admitted["downscaled"]:
+        parts.append("downscaled")
+    if not parts:
+        return "accepted"
+    return "{} {}x{}".format(", ".join(parts), *admitted["size"])
@@ -4,11 +4,9 @@ import matplotlib
 matplotlib.use('Agg') # Non-interactive backend
 import matplotlib.pyplot as plt
 from skimage.metrics import structural_similarity as ssim
-from skimage.filters import sobel
-from skimage.color import rgb2lab
-from skimage.feature import local_binary_pattern
 import io
 import base64
+from analysis_context import AnalysisContext
 
 def array_to_base64_plot(plot_func, *args, **kwargs):
     """Helper to run a plotting function and return base64 string"""
@@ -20,71 +18,63 @@ def array_to_base64_plot(plot_func, *args, **kwargs):
     buf.seek(0)
     return base64.b64encode(buf.getvalue()).decode('utf-8')
 
-def get_ssim(img1, img2):
-    # img1, img2 are numpy arrays (RGB)
-    # Convert to grayscale for SSIM
-    g1 = cv2.cvtColor(img1, cv2.COLOR_RGB2GRAY)
-    g2 = cv2.cvtColor(img2, cv2.COLOR_RGB2GRAY)
-    
+def get_ssim(original, compressed):
+    # original, compressed are AnalysisContexts; SSIM runs on the float32 grayscale versions
     # win_size must be odd and <= min dim
-    min_dim = min(g1.shape[0], g1.shape[1])
+    min_dim = min(original.shape)
     win_size = min(7, min_dim)
     if win_size % 2 == 0: win_size -= 1
     
-    score, diff = ssim(g1, g2, full=True, win_size=win_size)
+    score, diff = ssim(original.gray_float, compressed.gray_float, full=True, win_size=win_size, data_range=1.0)
     return score, diff
 
-def get_sharpness(img):
-    gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
-    laplacian = cv2.Laplacian(gray, cv2.CV_64F)
-    return np.var(laplacian)
+def get_sharpness(context):
+    return context.sharpness
+
+def plot_counts(ax, counts, **style):
+    # One filled step outline per histogram instead of 256 bar patches
+    ax.stairs(counts, np.arange(len(counts) + 1), fill=True, **style)
 
-def generate_histograms(img1, img2):
+def generate_histograms(original, compressed):
     # Returns base64 image of side-by-side histograms
     def plot():
         fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(10, 4))
-        ax1.hist(img1.ravel(), bins=256, color='blue', alpha=0.7)
+        plot_counts(ax1, original.histograms["all"], color='blue', alpha=0.7)
         ax1.set_title("Original Histogram")
-        ax2.hist(img2.ravel(), bins=256, color='red', alpha=0.7)
+        plot_counts(ax2, compressed.histograms["all"], color='red', alpha=0.7)
         ax2.set_title("Compressed Histogram")
         plt.tight_layout()
     
     return array_to_base64_plot(plot)
 
-def generate_channel_histograms(img1, img2):
+def generate_channel_histograms(original, compressed):
     def plot():
         fig, axs = plt.subplots(2, 3, figsize=(12, 6))
         colors = ['red', 'green', 'blue']
         for i, color in enumerate(colors):
-            axs[0, i].hist(img1[:, :, i].ravel(), bins=256, color=color, alpha=0.5)
+            plot_counts(axs[0, i], original.histograms["channels"][i], color=color, alpha=0.5)
             axs[0, i].set_title(f'Original {color.title()}')
-            axs[1, i].hist(img2[:, :, i].ravel(), bins=256, color=color, alpha=0.5)
+            plot_counts(axs[1, i], compressed.histograms["channels"][i], color=color, alpha=0.5)
             axs[1, i].set_title(f'Compressed {color.title()}')
         plt.tight_layout()
     return array_to_base64_plot(plot)
 
-def generate_pixel_intensity(img1, img2):
+def generate_pixel_intensity(original, compressed):
     def plot():
-        g1 = cv2.cvtColor(img1, cv2.COLOR_RGB2GRAY)
-        g2 = cv2.cvtColor(img2, cv2.COLOR_RGB2GRAY)
         plt.figure(figsize=(8, 4))
-        plt.hist(g1.ravel(), bins=256, color='blue', alpha=0.5, label='Original')
-        plt.hist(g2.ravel(), bins=256, color='red', alpha=0.5, label='Compressed')
+        plot_counts(plt.gca(), original.histograms["luma"], color='blue', alpha=0.5, label='Original')
+        plot_counts(plt.gca(), compressed.histograms["luma"], color='red', alpha=0.5, label='Compressed')
         plt.legend()
         plt.title('Pixel Intensity Overlay')
     return array_to_base64_plot(plot)
 
-def generate_edges(img1, img2):
+def generate_edges(original, compressed):
     def plot():
-        g1 = cv2.cvtColor(img1, cv2.COLOR_RGB2GRAY)
-        g2 = cv2.cvtColor(img2, cv2.COLOR_RGB2GRAY)
-        e1 = sobel(g1)
-        e2 = sobel(g2)
         fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(10, 5))
-        ax1.imshow(e1, cmap='gray')
+        ax1.imshow(original.edges, cmap='gray')
         ax1.set_title("Original Edges")
         ax1.axis('off')
-        ax2.imshow(e2, cmap='gray')
+        ax2.imshow(compressed.edges, cmap='gray')
         ax2.set_title("Compressed Edges")
         ax2.axis('off')
     return array_to_base64_plot(plot)
@@ -97,45 +87,34 @@ def generate_ssim_map(diff):
         plt.axis('off')
     return array_to_base64_plot(plot)
 
-def generate_fft(img1, img2):
-    def get_fft(img):
-        g = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
-        f = np.fft.fft2(g)
-        fshift = np.fft.fftshift(f)
-        return 20 * np.log(np.abs(fshift))
-    
+def generate_fft(original, compressed):
     def plot():
-        f1 = get_fft(img1)
-        f2 = get_fft(img2)
         fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(10, 5))
-        ax1.imshow(f1, cmap='gray')
+        ax1.imshow(original.fft_magnitude, cmap='gray')
         ax1.set_title("Original FFT")
         ax1.axis('off')
-        ax2.imshow(f2, cmap='gray')
+        ax2.imshow(compressed.fft_magnitude, cmap='gray')
         ax2.set_title("Compressed FFT")
         ax2.axis('off')
     return array_to_base64_plot(plot)
 
-def generate_contours(img1, img2):
-    def plot_cnt(img, ax, title):
-        g = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
-        ax.contour(g, cmap='viridis')
+def generate_contours(original, compressed):
+    def plot_cnt(context, ax, title):
+        ax.contour(context.gray, cmap='viridis')
         ax.set_title(title)
         ax.invert_yaxis() # Contours often flip
         ax.axis('off')
 
     def plot():
         fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(10, 5))
-        plot_cnt(img1, ax1, "Original Contours")
-        plot_cnt(img2, ax2, "Compressed Contours")
+        plot_cnt(original, ax1, "Original Contours")
+        plot_cnt(compressed, ax2, "Compressed Contours")
     return array_to_base64_plot(plot)
 
-def generate_color_diff(img1, img2):
+def generate_color_diff(original, compressed):
     # This is heavy
     def plot():
-        lab1 = rgb2lab(img1)
-        lab2 = rgb2lab(img2)
-        diff = np.abs(lab1 - lab2)
+        diff = np.abs(original.lab - compressed.lab)
         fig, (ax1, ax2, ax3) = plt.subplots(1, 3, figsize=(12, 4))
         ax1.imshow(diff[:,:,0], cmap='gray'); ax1.set_title("L* Diff"); ax1.axis('off')
         ax2.imshow(diff[:,:,1], cmap='gray'); ax2.set_title("a* Diff"); ax2.axis('off')
@@ -143,15 +122,42 @@ def generate_color_diff(img1, img2):
     
     return array_to_base64_plot(plot)
 
-def generate_texture(img1, img2):
-    def get_lbp(img):
-        g = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
-        return local_binary_pattern(g, 8, 3, method='uniform')
-    
+def generate_texture(original, compressed):
     def plot():
-        l1 = get_lbp(img1)
-        l2 = get_lbp(img2)
         fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(10, 5))
-        ax1.imshow(l1, cmap='gray'); ax1.set_title("Original Texture"); ax1.axis('off')
-        ax2.imshow(l2, cmap='gray'); ax2.set_title("Compressed Texture"); ax2.axis('off')
+        ax1.imshow(original.texture, cmap='gray'); ax1.set_title("Original Texture"); ax1.axis('off')
+        ax2.imshow(compressed.texture, cmap='gray'); ax2.set_title("Compressed Texture"); ax2.axis('off')
     return array_to_base64_plot(plot)
+
+# Raw data for clients that draw the comparison themselves, instead of the PNGs above
+
+def downsample_map(values, max_size):
+    """Area-average a 2D map so its longer side is at most max_size"""
+    height, width = values.shape
+    scale = max_size / max(height, width)
+    if scale >= 1:
+        return values
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return cv2.resize(values.astype(np.float32), size, interpolation=cv2.INTER_AREA)
+
+def quantize_map(values, low=None, high=None):
+    """Scale a map linearly to uint8; returns (map, [low, high]) so clients can recover the values"""
+    low = float(values.min()) if low is None else low
+    high = float(values.max()) if high is None else high
+    scaled = (values - low) * (255.0 / (high - low)) if high > low else np.zeros(values.shape)
+    return np.clip(np.rint(scaled), 0, 255).astype(np.uint8), np.array([low, high], dtype=np.float32)
+
+def comparison_data(original, compressed, diff_map, map_size=256):
+    """Histogram counts and uint8 maps (longer side <= map_size) for both images, as a dict of arrays"""
+    data = {}
+    for name, context in (("original", original), ("compressed", compressed)):
+        data[f"histogram_{name}"] = context.histograms["all"].astype(np.uint32)
+        data[f"channel_histograms_{name}"] = context.histograms["channels"].astype(np.uint32)
+        data[f"intensity_{name}"] = context.histograms["luma"].astype(np.uint32)
+        data[f"edges_{name}"], data[f"edges_{name}_range"] = quantize_map(downsample_map(context.edges, map_size))
+        data[f"fft_{name}"], data[f"fft_{name}_range"] = quantize_map(
+            downsample_map(context.fft_magnitude, map_size)
+        )
+    # SSIM values are in [-1, 1]; a fixed range keeps maps of different requests comparable
+    data["ssim_map"], data["ssim_map_range"] = quantize_map(downsample_map(diff_map, map_size), -1.0, 1.0)
+    return data
@@ -1,8 +1,10 @@
 # database.py
 import sqlite3
 import json
-import os
 import datetime
+import shutil
+import time
+import uuid
 from pathlib import Path
 
 class FeedbackStorage:
@@ -143,4 +145,243 @@ class FeedbackStorage:
             ]
             
             with open(self.json_path, 'w') as f:
-                json.dump(current_feedback, f, indent=4)
\ No newline at end of file
+                json.dump(current_feedback, f, indent=4)
+
+class JobStorage:
+    """SQLite-backed queue of compression jobs, stored next to the feedback database.
+
+    Uploads and results live as files in the jobs directory; the table holds
+    the parameters, status and progress. Rows survive restarts, and jobs
+    whose worker died are put back in the queue.
+
+    Every worker run registers a random instance id and heartbeats it while
+    alive. A claim records that id, so a running job whose worker stopped
+    heartbeating is orphaned even when its old PID now belongs to another
+    process (common after a container restart).
+    """
+
+    STATUSES = ("queued", "running", "done", "failed")
+    # A worker that has not heartbeated for this long is considered dead
+    WORKER_TIMEOUT = 30.0
+
+    def __init__(self, data_dir='backend/feedback_data'):
+        self.data_dir = Path(data_dir)
+        self.jobs_dir = self.data_dir / 'jobs'
+        self.jobs_dir.mkdir(exist_ok=True, parents=True)
+        self.db_path = self.data_dir / 'jobs.db'
+        self._init_db()
+
+    def _connect(self):
+        conn = sqlite3.connect(str(self.db_path), timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _init_db(self):
+        """Initialize the jobs table"""
+        conn = self._connect()
+        try:
+            # WAL lets the API read status while the worker writes progress
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute('''CREATE TABLE IF NOT EXISTS jobs
+                        (id TEXT PRIMARY KEY,
+                        kind TEXT NOT NULL,
+                        params TEXT NOT NULL,
+                        status TEXT NOT NULL,
+                        stage TEXT,
+                        progress REAL NOT NULL DEFAULT 0,
+                        error TEXT,
+                        media_type TEXT,
+                        result_meta TEXT,
+                        worker_pid INTEGER,
+                        attempts INTEGER NOT NULL DEFAULT 0,
+                        created_at TEXT NOT NULL,
+                        updated_at TEXT NOT NULL,
+                        worker_id TEXT)''')
+            # Databases created before worker ids existed
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if "worker_id" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN worker_id TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+            conn.execute('''CREATE TABLE IF NOT EXISTS workers
+                        (id TEXT PRIMARY KEY,
+                        pid INTEGER,
+                        heartbeat_at REAL NOT NULL)''')
+            conn.commit()
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _now():
+        return datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")
+
+    def input_path(self, job_id):
+        return self.jobs_dir / f'{job_id}.input'
+
+    def result_path(self, job_id):
+        return self.jobs_dir / f'{job_id}.result'
+
+    def submit(self, kind, source, params):
+        """Store the upload (bytes, or a spooled file which is moved) and queue a job, returns its id"""
+        job_id = uuid.uuid4().hex
+        if isinstance(source, bytes):
+            self.input_path(job_id).write_bytes(source)
+        else:
+            shutil.move(source, self.input_path(job_id))
+        now = self._now()
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, params, status, created_at, updated_at) VALUES (?, ?, ?, 'queued', ?, ?)",
+                (job_id, kind, json.dumps(params), now, now)
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        return job_id
+
+    def get(self, job_id):
+        """Job status as a dict, or None for an unknown id"""
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        job["result_meta"] = json.loads(job["result_meta"]) if job["result_meta"] else None
+        return job
+
+    def register_worker(self, worker_pid):
+        """Register a new worker instance, returns its id for claim() and heartbeat()"""
+        worker_id = uuid.uuid4().hex
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT INTO workers (id, pid, heartbeat_at) VALUES (?, ?, ?)", (worker_id, worker_pid, time.time())
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        return worker_id
+
+    def heartbeat(self, worker_id):
+        conn = self._connect()
+        try:
+            conn.execute("UPDATE workers SET heartbeat_at = ? WHERE id = ?", (time.time(), worker_id))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def unregister_worker(self, worker_id):
+        # Its running jobs, if any, become orphans right away instead of after WORKER_TIMEOUT
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM workers WHERE id = ?", (worker_id,))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def claim(self, worker_id, worker_pid=None):
+        """Atomically move the oldest queued job to running, returns it or None"""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                conn.commit()
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', stage = 'started', progress = 0, worker_id = ?, worker_pid = ?, "
+                "attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                (worker_id, worker_pid, self._now(), row["id"])
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        return self.get(row["id"])
+
+    def update_progress(self, job_id, stage, progress):
+        conn = self._connect()
+        try:
+            conn.execute(
+                "UPDATE jobs SET stage = ?, progress = ?, updated_at = ? WHERE id = ?",
+                (stage, float(progress), self._now(), job_id)
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def complete(self, job_id, content, media_type, result_meta=None):
+        # Write the file first so a 'done' row always has its result on disk
+        self.result_path(job_id).write_bytes(content)
+        conn = self._connect()
+        try:
+            conn.execute(
+                "UPDATE jobs SET status = 'done', stage = 'done', progress = 1, media_type = ?, result_meta = ?, "
+                "updated_at = ? WHERE id = ?",
+                (media_type, json.dumps(result_meta), self._now(), job_id)
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        self.input_path(job_id).unlink(missing_ok=True)
+
+    def fail(self, job_id, error):
+        conn = self._connect()
+        try:
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, updated_at = ? WHERE id = ?",
+                (str(error), self._now(), job_id)
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        self.input_path(job_id).unlink(missing_ok=True)
+
+    def requeue_orphaned(self, max_attempts=3):
+        """Put running jobs whose worker stopped heartbeating back in the queue.
+
+        Jobs that already took down max_attempts workers are failed instead.
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM workers WHERE heartbeat_at < ?", (time.time() - self.WORKER_TIMEOUT,))
+            rows = conn.execute(
+                "SELECT id, attempts FROM jobs WHERE status = 'running' "
+                "AND (worker_id IS NULL OR worker_id NOT IN (SELECT id FROM workers))"
+            ).fetchall()
+            for row in rows:
+                if row["attempts"] >= max_attempts:
+                    conn.execute(
+                        "UPDATE jobs SET status = 'failed', error = 'worker died repeatedly', updated_at = ? "
+                        "WHERE id = ?", (self._now(), row["id"])
+                    )
+                else:
+                    conn.execute(
+                        "UPDATE jobs SET status = 'queued', stage = NULL, progress = 0, worker_id = NULL, worker_pid = NULL, "
+                        "updated_at = ? WHERE id = ?", (self._now(), row["id"])
+                    )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def cleanup_old_jobs(self, days=7):
+        """Remove finished jobs and their result files"""
+        cutoff = (datetime.datetime.now() - datetime.timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT id FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?", (cutoff,)
+            ).fetchall()
+            for row in rows:
+                self.result_path(row["id"]).unlink(missing_ok=True)
+            conn.execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?", (cutoff,))
+            conn.commit()
+        finally:
+            conn.close()
+
@@ -0,0 +1,243 @@
+# decomposition_store.py
+import json
+import os
+import shutil
+import sqlite3
+import time
+import uuid
+from pathlib import Path
+
+import numpy as np
+import pca_engine
+
+# Next to the feedback and job databases, so bundles survive restarts and deploys with a persistent disk
+DEFAULT_STORE_DIR = os.path.join("backend", "feedback_data", "decompositions")
+DEFAULT_STORE_BYTES = 1024 * 1024 * 1024
+
+# Arrays of a PCADecomposition kept in a bundle; the covariance matrices are never stored
+BUNDLE_ARRAYS = ("means", "eig_vals", "eig_vecs", "total_variance", "error_estimate")
+
+
+class DecompositionStore:
+    """Decompositions shared by every process on the machine, as memory-mapped .npy bundles.
+
+    Each entry is a directory of .npy files written once and renamed into
+    place, so readers never see a partial bundle. Readers map the arrays
+    read-only, so all workers share one copy in the page cache. A small
+    SQLite index holds sizes and last use times for LRU eviction by bytes.
+
+    Bundles persist across restarts. Every bundle also carries a meta.json,
+    so recover() can rebuild the index from the directory alone.
+    """
+
+    def __init__(self, directory=DEFAULT_STORE_DIR, max_bytes=DEFAULT_STORE_BYTES):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.index_path = self.directory / "index.db"
+        self._init_db()
+
+    def _connect(self):
+        return sqlite3.connect(str(self.index_path), timeout=30)
+
+    def _init_db(self):
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute('''CREATE TABLE IF NOT EXISTS bundles
+                        (key TEXT PRIMARY KEY,
+                        path TEXT NOT NULL,
+                        nbytes INTEGER NOT NULL,
+                        solver TEXT NOT NULL,
+                        rank INTEGER NOT NULL,
+                        n_rows INTEGER NOT NULL,
+                        gram INTEGER NOT NULL,
+                        last_used REAL NOT NULL)''')
+            conn.commit()
+        finally:
+            conn.close()
+
+    @staticmethod
+    def key(digest, dtype, solver="auto", **randomized_options):
+        # Exact and randomized decompositions never serve each other, so they get separate bundles
+        key = f"{digest}-{np.dtype(dtype).name}"
+        if solver == "randomized":
+            settings = pca_engine.randomized_settings(**randomized_options)
+            key += "-randomized-p{oversampling}-q{power_iterations}-s{seed}".format(**settings)
+        return key
+
+    def get(self, digest, num_components=None, solver="auto", dtype=np.float64, **randomized_options):
+        """Memory-mapped decomposition covering the request, or None.
+
+        solver should be resolved (see pca_engine.choose_solver): "auto" only
+        matches exact decompositions.
+        """
+        key = self.key(digest, dtype, solver, **randomized_options)
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT path, solver, n_rows, gram FROM bundles WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            try:
+                decomposition = self._load(self.directory / row[0], row[1], row[2], bool(row[3]))
+            except (OSError, ValueError):
+                # Bundle removed by another process's eviction, or damaged
+                conn.execute("DELETE FROM bundles WHERE key = ?", (key,))
+                conn.commit()
+                return None
+            if not decomposition.covers(num_components, solver, dtype, **randomized_options):
+                return None
+            conn.execute("UPDATE bundles SET last_used = ? WHERE key = ?", (time.time(), key))
+            conn.commit()
+            return decomposition
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _load(path, solver, n_rows, gram):
+        arrays = {}
+        for name in BUNDLE_ARRAYS:
+            file = path / f"{name}.npy"
+            arrays[name] = np.load(file, mmap_mode="r") if file.exists() else None
+        randomized_options = None
+        if solver == "randomized":
+            randomized_options = json.loads((path / "meta.json").read_text()).get("randomized_options")
+        return pca_engine.PCADecomposition(
+            arrays["means"], arrays["eig_vals"], arrays["eig_vecs"], solver=solver,
+            error_estimate=arrays["error_estimate"], n_rows=n_rows, gram=gram,
+            total_variance=arrays["total_variance"], randomized_options=randomized_options,
+        )
+
+    def put(self, digest, decomposition):
+        """Write a bundle unless the stored one already covers at least as much"""
+        size = sum(
+            getattr(decomposition, name).nbytes for name in BUNDLE_ARRAYS if getattr(decomposition, name) is not None
+        )
+        if size > self.max_bytes:
+            return
+        randomized_options = decomposition.randomized_options or {}
+        key = self.key(digest, decomposition.dtype, decomposition.solver, **randomized_options)
+        existing = self.get(digest, decomposition.rank, decomposition.solver, decomposition.dtype, **randomized_options)
+        if existing is not None:
+            return
+
+        # Write under a unique temporary name, then rename so the bundle appears complete
+        name = f"{key}-{uuid.uuid4().hex[:8]}"
+        staging = self.directory / f".{name}"
+        staging.mkdir()
+        for array_name in BUNDLE_ARRAYS:
+            array = getattr(decomposition, array_name)
+            if array is not None:
+                np.save(staging / f"{array_name}.npy", np.ascontiguousarray(array))
+        meta = {
+            "key": key, "nbytes": size, "solver": decomposition.solver, "rank": decomposition.rank,
+            "n_rows": decomposition.n_rows, "gram": bool(decomposition.gram),
+            "randomized_options": decomposition.randomized_options,
+        }
+        (staging / "meta.json").write_text(json.dumps(meta))
+        os.rename(staging, self.directory / name)
+
+        conn = self._connect()
+        try:
+            previous = conn.execute("SELECT path FROM bundles WHERE key = ?", (key,)).fetchone()
+            conn.execute(
+                "INSERT OR REPLACE INTO bundles (key, path, nbytes, solver, rank, n_rows, gram, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, name, size, decomposition.solver, decomposition.rank, decomposition.n_rows,
+                 int(decomposition.gram), time.time())
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        if previous is not None:
+            # Processes that still map the old files keep them until they let go (POSIX unlink semantics)
+            shutil.rmtree(self.directory / previous[0], ignore_errors=True)
+        self.evict()
+
+    def evict(self):
+        """Drop least recently used bundles until the store fits max_bytes"""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            total = conn.execute("SELECT COALESCE(SUM(nbytes), 0) FROM bundles").fetchone()[0]
+            doomed = []
+            if total > self.max_bytes:
+                for key, path, nbytes in conn.execute("SELECT key, path, nbytes FROM bundles ORDER BY last_used"):
+                    if total <= self.max_bytes:
+                        break
+                    doomed.append((key, path))
+                    total -= nbytes
+                conn.executemany("DELETE FROM bundles WHERE key = ?", [(key,) for key, _ in doomed])
+            conn.commit()
+        finally:
+            conn.close()
+        for _, path in doomed:
+            shutil.rmtree(self.directory / path, ignore_errors=True)
+
+    def recover(self, staging_age=3600):
+        """Reconcile the index with the bundles on disk, then garbage collect to max_bytes.
+
+        Drops index rows whose bundle is gone, indexes complete bundles the
+        index doesn't know about (e.g. after the index was lost), removes
+        staging directories older than staging_age seconds left by crashed
+        writers and duplicate bundles of a key. Arrays are not read; they
+        are mapped lazily on first use.
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            indexed = dict(conn.execute("SELECT path, key FROM bundles").fetchall())
+            for path, key in indexed.items():
+                if not (self.directory / path / "meta.json").exists():
+                    conn.execute("DELETE FROM bundles WHERE key = ?", (key,))
+
+            indexed_keys = set(conn.execute("SELECT key FROM bundles").fetchall())
+            orphans = []
+            for entry in self.directory.iterdir():
+                if not entry.is_dir() or entry.name in indexed:
+                    continue
+                if entry.name.startswith("."):
+                    if now - entry.stat().st_mtime > staging_age:
+                        orphans.append(entry)
+                    continue
+                try:
+                    meta = json.loads((entry / "meta.json").read_text())
+                except (OSError, ValueError):
+                    orphans.append(entry)
+                    continue
+                if (meta["key"],) in indexed_keys:
+                    # An older bundle replaced before its removal finished
+                    orphans.append(entry)
+                    continue
+                conn.execute(
+                    "INSERT INTO bundles (key, path, nbytes, solver, rank, n_rows, gram, last_used) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (meta["key"], entry.name, meta["nbytes"], meta["solver"], meta["rank"], meta["n_rows"],
+                     int(meta["gram"]), entry.stat().st_mtime)
+                )
+                indexed_keys.add((meta["key"],))
+            conn.commit()
+        finally:
+            conn.close()
+
+        for entry in orphans:
+            shutil.rmtree(entry, ignore_errors=True)
+        self.evict()
+
+    def get_or_decompose(self, channels, num_components=None, solver="auto", digest=None, dtype=np.float64,
+                         **randomized_options):
+        """Return a stored decomposition covering the request, decomposing and storing on a miss"""
+        channels = pca_engine.as_channel_stack(channels)
+        if digest is None:
+            digest = pca_engine.image_digest(channels)
+
+        decomposition = self.get(digest, num_components, solver, dtype, **randomized_options)
+        if decomposition is None:
+            decomposition = pca_engine.decompose(
+                channels, num_components, solver=solver, dtype=dtype, **randomized_options
+            )
+            self.put(digest, decomposition)
+        return decomposition
@@ -0,0 +1,83 @@
+# job_worker.py
+# Local worker for the /jobs API: claims queued jobs from JobStorage and runs them.
+# Started by the app on startup, or on its own with `python job_worker.py`.
+import os
+import threading
+import time
+import traceback
+import tasks
+from database import JobStorage
+from workers import BLAS_THREADS, limit_blas_threads
+
+POLL_INTERVAL = float(os.environ.get("PCA_JOB_POLL_INTERVAL", 0.5))
+# Well below JobStorage.WORKER_TIMEOUT, so a busy worker never looks dead
+HEARTBEAT_INTERVAL = 5.0
+# Finished jobs and their result files are deleted after this many days, checked hourly
+RETENTION_DAYS = float(os.environ.get("PCA_JOB_RETENTION_DAYS", 7))
+CLEANUP_INTERVAL = 3600.0
+
+# Job kind -> function in tasks.py; it must accept progress= and return
+# (content, media_type, solver, error_estimate, timings)
+JOB_TASKS = {
+    "compress": tasks.compress,
+}
+
+
+def run_job(storage, job):
+    job_id = job["id"]
+
+    def progress(stage, fraction):
+        storage.update_progress(job_id, stage, fraction)
+
+    content, media_type, solver, error_estimate, timings = JOB_TASKS[job["kind"]](
+        str(storage.input_path(job_id)), **job["params"], progress=progress
+    )
+    storage.complete(
+        job_id, content, media_type, {"engine": solver, "error_estimate": error_estimate, "timings": timings}
+    )
+
+
+def heartbeat(storage, worker_id, stopped):
+    # A thread of its own, so long jobs keep the worker alive between progress updates
+    while not stopped.wait(HEARTBEAT_INTERVAL):
+        try:
+            storage.heartbeat(worker_id)
+        except Exception:
+            traceback.print_exc()
+
+
+def run(data_dir=None, stop_event=None):
+    """Process jobs until stop_event is set (forever without one)"""
+    # Same share of the cores as each pool worker, so jobs and requests don't oversubscribe them
+    limit_blas_threads(BLAS_THREADS)
+    storage = JobStorage(data_dir) if data_dir else JobStorage()
+    pid = os.getpid()
+    worker_id = storage.register_worker(pid)
+    stopped = threading.Event()
+    threading.Thread(target=heartbeat, args=(storage, worker_id, stopped), name="job-heartbeat", daemon=True).start()
+    # Jobs left running by a worker that crashed or was restarted go back in the queue
+    storage.requeue_orphaned()
+    last_cleanup = None
+
+    try:
+        while stop_event is None or not stop_event.is_set():
+            if last_cleanup is None or time.monotonic() - last_cleanup > CLEANUP_INTERVAL:
+                storage.cleanup_old_jobs(RETENTION_DAYS)
+                last_cleanup = time.monotonic()
+            job = storage.claim(worker_id, pid)
+            if job is None:
+                time.sleep(POLL_INTERVAL)
+                storage.requeue_orphaned()
+                continue
+            try:
+                run_job(storage, job)
+            except Exception as e:
+                traceback.print_exc()
+                storage.fail(job["id"], f"{type(e).__name__}: {e}")
+    finally:
+        stopped.set()
+        storage.unregister_worker(worker_id)
+
+
+if __name__ == "__main__":
+    run()
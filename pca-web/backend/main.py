@@ -1,14 +1,67 @@
-from fastapi import FastAPI, UploadFile, File, Form
+from fastapi import FastAPI, UploadFile, File, Form, Header, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import Response, JSONResponse
+from fastapi.concurrency import run_in_threadpool
 import numpy as np
-from PIL import Image
+import asyncio
 import io
+import json
+import math
+import os
+import threading
+import zipfile
+import zlib
+from typing import List
 import pydantic
-import base64
+import pca_engine
+import pca_container
+import pca_encoders
+import admission
+import result_cache
+import tasks
+import uploads
+from workers import WorkerPool, PoolSaturated
 
 app = FastAPI()
 
+# Size and rate limits on request bodies, enforced while they stream in
+app.add_middleware(uploads.UploadLimitMiddleware)
+
+# Heavy request stages run here instead of on the event loop
+pool = WorkerPool()
+
+# Encoded /compress results; PCA_RESULT_CACHE_DIR adds a disk tier that survives restarts
+results = result_cache.ResultCache(
+    max_bytes=int(os.environ.get("PCA_RESULT_CACHE_BYTES", result_cache.DEFAULT_MEMORY_BYTES)),
+    disk_dir=os.environ.get("PCA_RESULT_CACHE_DIR"),
+    disk_max_bytes=int(os.environ.get("PCA_RESULT_CACHE_DISK_BYTES", result_cache.DEFAULT_DISK_BYTES)),
+)
+
+@app.exception_handler(PoolSaturated)
+async def pool_saturated_handler(request, exc):
+    # Fail fast so queueing delay stays bounded; clients retry after a short pause
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+@app.exception_handler(admission.AdmissionError)
+async def admission_error_handler(request, exc):
+    return JSONResponse(status_code=exc.status_code, content={"detail": exc.detail})
+
+@app.on_event("shutdown")
+def shutdown_pool():
+    pool.shutdown()
+
+@app.on_event("startup")
+def recover_decomposition_store():
+    # Bundles from the previous run stay on disk and are mapped lazily by the workers on first use;
+    # only reconcile the index and trim the store to its budget, off the startup path
+    store = tasks.get_decomposition_store()
+    if store is not None:
+        threading.Thread(target=store.recover, name="decomposition-store-recover", daemon=True).start()
+
 # Configure CORS for Next.js (Port 3000)
 app.add_middleware(
     CORSMiddleware,
@@ -16,12 +69,64 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
-    expose_headers=["X-Processing-Time"],
+    expose_headers=[
+        "X-Processing-Time", "X-PCA-Engine", "X-PCA-Error-Estimate",
+        "Retry-After", "Content-Disposition", "ETag", "X-Cache", "X-PCA-Admission", "X-PCA-Preview",
+        "Server-Timing",
+    ],
 )
 
 # Initialize Database
-from database import FeedbackStorage
+from database import FeedbackStorage, JobStorage
 db = FeedbackStorage()
+jobs = JobStorage()
+
+# Local worker process for /jobs; set PCA_JOB_WORKER=0 when running job_worker.py separately
+RUN_JOB_WORKER = os.environ.get("PCA_JOB_WORKER", "1") != "0"
+# How often the app checks that the worker is still running
+JOB_WORKER_CHECK_INTERVAL = 2.0
+job_worker_process = None
+job_worker_stop = None
+job_worker_supervisor = None
+
+def spawn_job_worker():
+    global job_worker_process
+    import multiprocessing
+    import job_worker
+    context = multiprocessing.get_context("spawn")
+    job_worker_process = context.Process(
+        target=job_worker.run, args=(str(jobs.data_dir), job_worker_stop), daemon=True
+    )
+    job_worker_process.start()
+
+def supervise_job_worker():
+    # Respawn the worker whenever it dies; the new one requeues the job it was running
+    while not job_worker_stop.wait(JOB_WORKER_CHECK_INTERVAL):
+        if not job_worker_process.is_alive():
+            print(f"Job worker exited with code {job_worker_process.exitcode}, restarting")
+            spawn_job_worker()
+
+@app.on_event("startup")
+def start_job_worker():
+    global job_worker_stop, job_worker_supervisor
+    if not RUN_JOB_WORKER:
+        return
+    import multiprocessing
+    job_worker_stop = multiprocessing.get_context("spawn").Event()
+    spawn_job_worker()
+    job_worker_supervisor = threading.Thread(target=supervise_job_worker, name="job-worker-supervisor", daemon=True)
+    job_worker_supervisor.start()
+
+@app.on_event("shutdown")
+def stop_job_worker():
+    if job_worker_process is None:
+        return
+    # Let the current job finish; an unfinished one is requeued on the next start
+    job_worker_stop.set()
+    job_worker_supervisor.join()
+    job_worker_process.join(timeout=10)
+    if job_worker_process.is_alive():
+        job_worker_process.terminate()
 
 @app.get("/feedback")
 def get_feedback():
@@ -37,74 +142,401 @@ def submit_feedback(feedback: FeedbackModel):
     db.save_feedback(feedback.name, feedback.rating, feedback.comment)
     return {"message": "Feedback saved"}
 
-def pca_compress_channel(channel, no_of_components):
-    # Calculate mean and center the data
-    mean = np.mean(channel, axis=0)
-    centered_data = channel - mean
+def validate_compress_options(engine, precision, output_format, container_preset, color_space):
+    # engine is a pca_engine solver: auto, full, subset, lanczos or randomized
+    if engine not in ("auto",) + pca_engine.SOLVERS:
+        raise HTTPException(status_code=400, detail=f"Unknown engine: {engine}")
+    # float32 is opt-in and roughly halves peak memory per request
+    if precision not in pca_engine.PRECISIONS:
+        raise HTTPException(status_code=400, detail=f"Unknown precision: {precision}")
+    # jpeg, jpeg-optimized, jpeg-progressive, webp (when Pillow has it), png, or the pcaz container
+    if output_format not in pca_encoders.available_formats() + [pca_encoders.CONTAINER_FORMAT]:
+        raise HTTPException(status_code=400, detail=f"Unknown output format: {output_format}")
+    if container_preset not in pca_container.PRESETS:
+        raise HTTPException(status_code=400, detail=f"Unknown container preset: {container_preset}")
+    if color_space not in pca_engine.COLOR_SPACES:
+        raise HTTPException(status_code=400, detail=f"Unknown color space: {color_space}")
+    if color_space == "ycbcr" and output_format == pca_encoders.CONTAINER_FORMAT:
+        # The container stores one basis per RGB channel
+        raise HTTPException(status_code=400, detail="The pcaz output format only supports the rgb color space")
 
-    # Compute covariance matrix
-    cov_matrix = np.cov(centered_data, rowvar=False)
+def server_timing(timings):
+    # Worker stage durations in the Server-Timing format, which browser dev tools display
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items())
 
-    # Compute eigenvalues and eigenvectors
-    eig_vals, eig_vecs = np.linalg.eigh(cov_matrix)
+@app.post("/compress")
+async def compress_image(
+    image: UploadFile = File(...),
+    num_components: int = Form(...),
+    engine: str = Form("auto"),
+    oversampling: int = Form(10),
+    power_iterations: int = Form(2),
+    precision: str = Form("float64"),
+    # None: picked from the Accept header, jpeg for */*
+    output_format: str = Form(None),
+    container_preset: str = Form("float16"),
+    color_space: str = Form("rgb"),
+    chroma_components: int = Form(None),
+    subsample_chroma: bool = Form(False),
+    oversize: str = Form(admission.DEFAULT_OVERSIZE_POLICY),
+    allow_async: bool = Form(False),
+    # 2, 4 or 8: run on the image reduced by that factor, for live previews while a slider moves
+    preview: int = Form(1),
+    if_none_match: str = Header(None),
+    accept: str = Header(None),
+):
+    import time
+    start_time = time.perf_counter()
 
-    # Sort eigenvalues and eigenvectors in descending order
-    sorted_indices = np.argsort(eig_vals)[::-1]
-    sorted_eig_vals = eig_vals[sorted_indices]
-    sorted_eig_vecs = eig_vecs[:, sorted_indices]
+    negotiated = output_format is None
+    if negotiated:
+        output_format = pca_encoders.negotiate(accept)
+    validate_compress_options(engine, precision, output_format, container_preset, color_space)
+    
+    # Spooled to disk in chunks; admission, the cache key and the worker all read the file
+    path = await uploads.spool_upload(image)
+    try:
+        params = {
+            "num_components": num_components, "engine": engine, "oversampling": oversampling,
+            "power_iterations": power_iterations, "precision": precision, "output_format": output_format,
+            "container_preset": container_preset, "color_space": color_space,
+            "chroma_components": chroma_components, "subsample_chroma": subsample_chroma,
+        }
 
-    # Analysis data (for How It Works)
-    # Convert simple types for JSON
-    analysis = {
-        "cov_matrix": cov_matrix.tolist(), # Warning: Large!
-        "eigenvalues": sorted_eig_vals.tolist(),
-        "eigenvectors": sorted_eig_vecs.tolist() # Warning: Large!
-    }
+        # Header-only pre-flight: refuse, downscale or hand slow requests to the job queue before decoding
+        admitted = admission.admit(path, num_components, engine, precision, oversize, allow_async, preview)
+        params["size"] = admitted["size"]
+        if admitted["action"] == "queue":
+            job_id = jobs.submit("compress", path, params)
+            return JSONResponse(
+                status_code=202,
+                content={
+                    "id": job_id, "status": "queued", "status_url": f"/jobs/{job_id}",
+                    "estimated_seconds": round(admitted["cost"]["seconds"], 1),
+                },
+                headers={"Location": f"/jobs/{job_id}"}
+            )
 
-    # Select top k eigenvectors
-    k = min(no_of_components, len(sorted_eig_vals))
-    projection_matrix = sorted_eig_vecs[:, :k]
+        # Same upload and parameters give an equivalent result, so the key doubles as a weak ETag.
+        # Hashing up to the upload limit and the disk tier's file I/O run in threads, off the event loop.
+        key = await run_in_threadpool(result_cache.result_key, path, params)
+        etag = result_cache.etag_for(key)
+        if result_cache.etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers={"ETag": etag})
 
-    # Project data onto new basis
-    compressed_data = np.dot(centered_data, projection_matrix)
+        cached = await run_in_threadpool(results.get, key)
+        if cached is not None:
+            content, result = cached
+        else:
+            # Decoding, eigh and encoding all run in a worker process, off the event loop
+            content, media_type, solver, error_estimate, timings = await pool.run(tasks.compress, path, **params)
+            result = {"media_type": media_type, "engine": solver, "error_estimate": error_estimate}
+            await run_in_threadpool(results.put, key, content, result)
+    
+        process_time = time.perf_counter() - start_time
 
-    # Reconstruct the data
-    reconstructed_data = np.dot(compressed_data, projection_matrix.T) + mean
+        headers = {
+            "X-Processing-Time": f"{process_time:.4f}",
+            "X-PCA-Engine": result["engine"],
+            "X-Cache": "HIT" if cached is not None else "MISS",
+            "X-PCA-Admission": admission.describe(admitted),
+            "ETag": etag,
+            # Let browsers keep the result but always revalidate, which is cheap with the ETag
+            "Cache-Control": "private, no-cache",
+        }
+        if cached is None:
+            headers["Server-Timing"] = server_timing(timings)
+        if negotiated:
+            headers["Vary"] = "Accept"
+        if preview > 1:
+            headers["X-PCA-Preview"] = f"1/{preview}"
+        if result["error_estimate"] is not None:
+            # Relative reconstruction error per channel (R, G, B, or Y for ycbcr)
+            headers["X-PCA-Error-Estimate"] = ",".join(f"{e:.6f}" for e in result["error_estimate"])
     
-    return np.clip(reconstructed_data, 0, 255).astype(np.uint8), analysis
+        return Response(
+            content=content, 
+            media_type=result["media_type"],
+            headers=headers
+        )
+    finally:
+        uploads.remove_spooled(path)
 
-@app.post("/compress")
-async def compress_image(image: UploadFile = File(...), num_components: int = Form(...)):
+# Limits for /compress/batch
+BATCH_MAX_IMAGES = int(os.environ.get("PCA_BATCH_MAX_IMAGES", 1000))
+# Total upload size, or total uncompressed size of a zip archive
+BATCH_MAX_BYTES = int(os.environ.get("PCA_BATCH_MAX_BYTES", 512 * 1024 * 1024))
+# Covariance memory of one stacked decomposition; larger same-shape groups are split into chunks
+BATCH_CHUNK_BYTES = int(os.environ.get("PCA_BATCH_CHUNK_BYTES", 256 * 1024 * 1024))
+
+def extract_batch_archive(path):
+    # Spools the files of a zip archive to temp files, returns [(name, path, size)] in name order.
+    # Blocking; the caller runs it in a thread and removes the files.
+    try:
+        archive = zipfile.ZipFile(path)
+    except zipfile.BadZipFile:
+        raise HTTPException(status_code=400, detail="archive is not a zip file")
+    files = []
+    with archive:
+        members = sorted((info for info in archive.infolist() if not info.is_dir()), key=lambda info: info.filename)
+        # Checked before extracting anything, so a zip bomb is rejected up front
+        if sum(info.file_size for info in members) > BATCH_MAX_BYTES:
+            raise HTTPException(status_code=413, detail="archive is too large")
+        try:
+            for info in members:
+                try:
+                    with archive.open(info) as member:
+                        files.append((info.filename, uploads.spool_file(member), info.file_size))
+                except (zipfile.BadZipFile, zlib.error, EOFError) as e:
+                    # Damaged member, e.g. a CRC mismatch
+                    raise HTTPException(status_code=400, detail=f"archive member {info.filename} is corrupt: {e}")
+                except (NotImplementedError, RuntimeError) as e:
+                    # Unsupported compression method or an encrypted member
+                    raise HTTPException(status_code=400, detail=f"archive member {info.filename} can't be read: {e}")
+        except BaseException:
+            for _, member_path, _ in files:
+                uploads.remove_spooled(member_path)
+            raise
+    return files
+
+def batch_chunks(items, engine, precision):
+    # Group same-shape images so their channels share one eigh call, then split groups to fit
+    # BATCH_CHUNK_BYTES and to give every worker something to do
+    itemsize = np.dtype(pca_engine.PRECISIONS[precision]).itemsize
+    groups, errors = {}, []
+    for name, path, k in items:
+        try:
+            size = admission.read_header(path)  # header only, no decode
+            admission.check_pixels(*size)
+            # Batch members are never downscaled, the ones that don't fit a worker go to the manifest
+            admission.check_budget(*size, admission.estimate(*size, k, engine, precision), "reject")
+        except admission.AdmissionError as e:
+            errors.append({"name": name, "error": e.detail})
+            continue
+        groups.setdefault(size, []).append((name, path, k))
+
+    chunks = []
+    for (width, height), group in groups.items():
+        per_image = 3 * min(width, height) ** 2 * itemsize
+        chunk_size = max(1, min(BATCH_CHUNK_BYTES // per_image, math.ceil(len(group) / pool.max_workers)))
+        chunks.extend(group[start:start + chunk_size] for start in range(0, len(group), chunk_size))
+    return chunks, errors
+
+@app.post("/compress/batch")
+async def compress_batch(
+    images: List[UploadFile] = File(None),
+    archive: UploadFile = File(None),
+    num_components: str = Form(...),
+    engine: str = Form("auto"),
+    precision: str = Form("float64"),
+    output_format: str = Form("jpeg"),
+    container_preset: str = Form("float16"),
+):
     import time
     start_time = time.perf_counter()
-    
-    contents = await image.read()
-    img = Image.open(io.BytesIO(contents)).convert('RGB')
-    img_array = np.array(img)
 
-    red_channel = img_array[:, :, 0]
-    green_channel = img_array[:, :, 1]
-    blue_channel = img_array[:, :, 2]
+    validate_compress_options(engine, precision, output_format, container_preset, "rgb")
+
+    # Images as repeated multipart files and/or one zip archive. Every image is spooled to disk
+    # and workers decode it from its path, so the batch is never held in memory or pickled.
+    inputs = []
+    try:
+        for image in images or []:
+            path = await uploads.spool_upload(image)
+            inputs.append((image.filename, path, os.path.getsize(path)))
+        if archive is not None:
+            archive_path = await uploads.spool_upload(archive)
+            try:
+                inputs.extend(await run_in_threadpool(extract_batch_archive, archive_path))
+            finally:
+                uploads.remove_spooled(archive_path)
+        if not inputs:
+            raise HTTPException(status_code=400, detail="No images given")
+        if len(inputs) > BATCH_MAX_IMAGES:
+            raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_IMAGES} images per batch")
+        if sum(size for _, _, size in inputs) > BATCH_MAX_BYTES:
+            raise HTTPException(status_code=413, detail="Batch is too large")
+
+        # One shared num_components, or a comma separated list with one count per image
+        try:
+            k_values = [int(k) for k in num_components.split(",") if k.strip()]
+        except ValueError:
+            raise HTTPException(status_code=400, detail="num_components must be an integer or a comma separated list")
+        if len(k_values) == 1:
+            k_values = k_values * len(inputs)
+        if len(k_values) != len(inputs):
+            raise HTTPException(status_code=400, detail=f"Expected 1 or {len(inputs)} num_components values")
+
+        # Names must be unique inside the output zip
+        items, seen = [], set()
+        for index, ((name, path, _), k) in enumerate(zip(inputs, k_values)):
+            name = name or f"image_{index}"
+            if name in seen:
+                name = f"{index}_{name}"
+            seen.add(name)
+            items.append((name, path, k))
+
+        chunks, errors = batch_chunks(items, engine, precision)
+
+        # At most one chunk per worker in flight, so a batch doesn't take every queue slot
+        limit = asyncio.Semaphore(pool.max_workers)
+
+        async def run_chunk(chunk):
+            async with limit:
+                while True:
+                    try:
+                        return await pool.run(tasks.compress_batch, chunk, engine, precision, output_format, container_preset)
+                    except PoolSaturated as e:
+                        # Other requests hold the workers; wait for a slot instead of failing half way through
+                        await asyncio.sleep(e.retry_after)
+                    except Exception as e:
+                        return e
+
+        extension = pca_encoders.extension(output_format)
+        manifest = []
+        written = set()
+        zip_buffer = io.BytesIO()
+        with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_STORED) as output:
+            # JPEG and .pcaz payloads are already compressed, so entries are stored as is
+            for chunk, results in zip(chunks, await asyncio.gather(*(run_chunk(chunk) for chunk in chunks))):
+                if isinstance(results, Exception):
+                    errors.extend({"name": name, "error": f"{type(results).__name__}: {results}"} for name, _, _ in chunk)
+                    continue
+                for (name, _, k), (_, content, solver) in zip(chunk, results):
+                    output_name = pca_encoders.output_name(name, output_format)
+                    # Input names are unique, but e.g. "a" and "a.jpg" both give "a.jpg"; number the later ones
+                    stem, counter = output_name[:-len(extension)], 2
+                    while output_name in written:
+                        output_name = f"{stem}-{counter}{extension}"
+                        counter += 1
+                    written.add(output_name)
+                    output.writestr(output_name, content)
+                    manifest.append({
+                        "name": name, "output": output_name, "num_components": k,
+                        "bytes": len(content), "engine": solver, "group_size": len(chunk)
+                    })
+            output.writestr("manifest.json", json.dumps({"results": manifest, "errors": errors}, indent=2))
+
+        process_time = time.perf_counter() - start_time
 
-    red_compressed, _ = pca_compress_channel(red_channel, num_components)
-    green_compressed, _ = pca_compress_channel(green_channel, num_components)
-    blue_compressed, _ = pca_compress_channel(blue_channel, num_components)
+        return Response(
+            content=zip_buffer.getvalue(),
+            media_type="application/zip",
+            headers={
+                "X-Processing-Time": f"{process_time:.4f}",
+                "Content-Disposition": 'attachment; filename="compressed.zip"'
+            }
+        )
+    finally:
+        for _, path, _ in inputs:
+            uploads.remove_spooled(path)
 
-    compressed_img_array = np.stack(
-        (red_compressed, green_compressed, blue_compressed), 
-        axis=2
+@app.post("/jobs/compress", status_code=202)
+async def submit_compress_job(
+    image: UploadFile = File(...),
+    num_components: int = Form(...),
+    engine: str = Form("auto"),
+    oversampling: int = Form(10),
+    power_iterations: int = Form(2),
+    precision: str = Form("float64"),
+    output_format: str = Form("jpeg"),
+    container_preset: str = Form("float16"),
+    color_space: str = Form("rgb"),
+    chroma_components: int = Form(None),
+    subsample_chroma: bool = Form(False),
+    oversize: str = Form(admission.DEFAULT_OVERSIZE_POLICY),
+):
+    # Same parameters as /compress, but the upload is stored and processed by the job worker
+    validate_compress_options(engine, precision, output_format, container_preset, color_space)
+
+    path = await uploads.spool_upload(image)
+    try:
+        params = {
+            "num_components": num_components, "engine": engine, "oversampling": oversampling,
+            "power_iterations": power_iterations, "precision": precision, "output_format": output_format,
+            "container_preset": container_preset, "color_space": color_space,
+            "chroma_components": chroma_components, "subsample_chroma": subsample_chroma,
+        }
+        # No time limit for jobs, but the worker has the same memory budget
+        params["size"] = admission.admit(path, num_components, engine, precision, oversize)["size"]
+        # The spooled file is moved into the job directory, not copied
+        job_id = jobs.submit("compress", path, params)
+    finally:
+        uploads.remove_spooled(path)
+    return {"id": job_id, "status": "queued", "status_url": f"/jobs/{job_id}"}
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+
+    status = {key: job[key] for key in ("id", "kind", "status", "stage", "progress", "error", "created_at", "updated_at")}
+    if job["status"] == "done":
+        status["result_url"] = f"/jobs/{job_id}/result"
+        status["result"] = job["result_meta"]
+    return status
+
+@app.get("/jobs/{job_id}/result")
+def get_job_result(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    if job["status"] != "done":
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+
+    headers = {"X-PCA-Engine": job["result_meta"]["engine"]}
+    if job["result_meta"].get("timings"):
+        headers["Server-Timing"] = server_timing(job["result_meta"]["timings"])
+    if job["result_meta"]["error_estimate"] is not None:
+        headers["X-PCA-Error-Estimate"] = ",".join(f"{e:.6f}" for e in job["result_meta"]["error_estimate"])
+    return Response(content=jobs.result_path(job_id).read_bytes(), media_type=job["media_type"], headers=headers)
+
+@app.post("/compress/rate-distortion")
+async def rate_distortion(
+    image: UploadFile = File(...),
+    num_components: str = Form("10,25,50"),
+    oversize: str = Form(admission.DEFAULT_OVERSIZE_POLICY),
+):
+    import time
+    start_time = time.perf_counter()
+
+    try:
+        k_values = [int(k) for k in num_components.split(",") if k.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="num_components must be a comma separated list of integers")
+    if not k_values:
+        raise HTTPException(status_code=400, detail="num_components is empty")
+
+    path = await uploads.spool_upload(image)
+    try:
+        # Sized for the largest k, the full spectrum is decomposed once for all of them
+        admitted = admission.admit(path, max(k_values), "auto", "float64", oversize)
+        report = await pool.run(tasks.rate_distortion, path, k_values, admitted["size"])
+    finally:
+        uploads.remove_spooled(path)
+
+    return JSONResponse(
+        {"time": time.perf_counter() - start_time, "report": report},
+        headers={"X-PCA-Admission": admission.describe(admitted)}
     )
 
-    compressed_pil = Image.fromarray(compressed_img_array)
-    img_byte_arr = io.BytesIO()
-    # Quality 60 to ensure we actually see file size reduction vs original
-    compressed_pil.save(img_byte_arr, format='JPEG', quality=60, optimize=True)
-    
+@app.post("/decompress")
+async def decompress_image(container: UploadFile = File(...), num_components: int = Form(None)):
+    import time
+    start_time = time.perf_counter()
+
+    contents = await container.read()
+    try:
+        png_bytes = await pool.run(tasks.decompress, contents, num_components)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
     process_time = time.perf_counter() - start_time
-    
+
     return Response(
-        content=img_byte_arr.getvalue(), 
-        media_type="image/jpeg",
+        content=png_bytes,
+        media_type="image/png",
         headers={"X-Processing-Time": f"{process_time:.4f}"}
     )
 
@@ -114,100 +546,133 @@ async def analyze_image(image: UploadFile = File(...)):
     start_time = time.perf_counter()
     
     # Limit size for analysis to avoid crashing browser with massive JSON
-    contents = await image.read()
-    img = Image.open(io.BytesIO(contents)).convert('RGB')
-    
-    # Resize for analysis speed (similar to what user wanted, but now in Python)
-    # Python is fast, but sending 1000x1000 matrix over JSON is slow.
-    # We will resize to small dimension for "Instructional" analysis.
-    img.thumbnail((32, 32)) 
-    img_array = np.array(img)
-
-    red_channel = img_array[:, :, 0]
-    green_channel = img_array[:, :, 1]
-    blue_channel = img_array[:, :, 2]
-
-    # We just need analysis from one channel or all? Let's do all.
-    # Num components doesn't matter for analysis of full matrix, but the function needs it.
-    # We pass full width to get full decomposition.
-    k = img_array.shape[1] 
-    
-    _, r_analysis = pca_compress_channel(red_channel, k)
-    _, g_analysis = pca_compress_channel(green_channel, k)
-    _, b_analysis = pca_compress_channel(blue_channel, k)
-
-    def sample_matrix(m):
-        # Return top 5x5 subset for display
-        return [row[:5] for row in m[:5]]
+    path = await uploads.spool_upload(image)
+    try:
+        summaries = await pool.run(tasks.analyze, path)
+    finally:
+        uploads.remove_spooled(path)
 
     process_time = time.perf_counter() - start_time
 
-    return JSONResponse({
-        "time": process_time,
-        "red": {
-            "cov": sample_matrix(r_analysis["cov_matrix"]),
-            "eigVals": r_analysis["eigenvalues"][:10],
-            "eigVecs": sample_matrix(r_analysis["eigenvectors"])
-        },
-        "green": {
-             "cov": sample_matrix(g_analysis["cov_matrix"]),
-             "eigVals": g_analysis["eigenvalues"][:10],
-             "eigVecs": sample_matrix(g_analysis["eigenvectors"])
-        },
-        "blue": {
-             "cov": sample_matrix(b_analysis["cov_matrix"]),
-             "eigVals": b_analysis["eigenvalues"][:10],
-             "eigVecs": sample_matrix(b_analysis["eigenvectors"])
+    return JSONResponse({"time": process_time, **summaries})
+
+# Media types of tasks.encode_arrays' encodings, for /analyze/summary and the /compare/analytics data mode
+ARRAY_FORMATS = {"npz": "application/x-npz", "json": "application/json"}
+SUMMARY_MAX_VECTOR_LENGTH = 4096
+
+@app.post("/analyze/summary")
+async def analyze_summary(
+    image: UploadFile = File(...),
+    # Comma separated subset of tasks.SUMMARIES
+    summaries: str = Form(",".join(tasks.SUMMARIES)),
+    top: int = Form(10),
+    vector_length: int = Form(256),
+    precision: str = Form("float64"),
+    format: str = Form("npz"),
+    oversize: str = Form(admission.DEFAULT_OVERSIZE_POLICY),
+    if_none_match: str = Header(None),
+):
+    import time
+    start_time = time.perf_counter()
+
+    requested = sorted({name.strip() for name in summaries.split(",") if name.strip()})
+    unknown = [name for name in requested if name not in tasks.SUMMARIES]
+    if unknown or not requested:
+        raise HTTPException(status_code=400, detail=f"summaries must be a subset of {', '.join(tasks.SUMMARIES)}")
+    if format not in ARRAY_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown format: {format}")
+    if precision not in pca_engine.PRECISIONS:
+        raise HTTPException(status_code=400, detail=f"Unknown precision: {precision}")
+    if top < 1 or not 1 <= vector_length <= SUMMARY_MAX_VECTOR_LENGTH:
+        raise HTTPException(status_code=400, detail="top and vector_length must be positive")
+
+    path = await uploads.spool_upload(image)
+    try:
+        # Full resolution, unless the full spectrum would not fit a worker's memory budget
+        admitted = admission.admit(path, None, "full", precision, oversize)
+        params = {
+            "summaries": requested, "top": top, "vector_length": vector_length, "precision": precision,
+            "size": admitted["size"],
         }
-    })
+        # Shares the result cache with /compress; the endpoint name keeps the keys apart
+        key = await run_in_threadpool(
+            result_cache.result_key, path, {"endpoint": "analyze/summary", "format": format, **params}
+        )
+        etag = result_cache.etag_for(key)
+        if result_cache.etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+
+        cached = await run_in_threadpool(results.get, key)
+        if cached is not None:
+            content = cached[0]
+        else:
+            content = await pool.run(tasks.analyze_summary, path, format, **params)
+            await run_in_threadpool(results.put, key, content, {"media_type": ARRAY_FORMATS[format]})
+    finally:
+        uploads.remove_spooled(path)
+
+    headers = {
+        "X-Processing-Time": f"{time.perf_counter() - start_time:.4f}",
+        "X-Cache": "HIT" if cached is not None else "MISS",
+        "X-PCA-Admission": admission.describe(admitted),
+        "ETag": etag,
+        "Cache-Control": "private, no-cache",
+    }
+    return Response(content=content, media_type=ARRAY_FORMATS[format], headers=headers)
+
+COMPARE_MAX_MAP_SIZE = 2048
 
 @app.post("/compare/analytics")
-async def compare_analytics(original: UploadFile = File(...), compressed: UploadFile = File(...)):
-    import analytics as ana
+async def compare_analytics(
+    original: UploadFile = File(...),
+    compressed: UploadFile = File(...),
+    # png: matplotlib plots as base64 PNGs in JSON; npz or json: the raw data for client-side drawing
+    format: str = Form("png"),
+    # Longer side of the edge, SSIM and FFT maps in the data formats
+    map_size: int = Form(256),
+    oversize: str = Form(admission.DEFAULT_OVERSIZE_POLICY),
+):
     import time
     
     start_time = time.perf_counter()
+
+    if format != "png" and format not in ARRAY_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown format: {format}")
+    if not 1 <= map_size <= COMPARE_MAX_MAP_SIZE:
+        raise HTTPException(status_code=400, detail=f"map_size must be between 1 and {COMPARE_MAX_MAP_SIZE}")
     
-    # Read Images
-    org_bytes = await original.read()
-    comp_bytes = await compressed.read()
-    
-    img1 = np.array(Image.open(io.BytesIO(org_bytes)).convert('RGB'))
-    img2 = np.array(Image.open(io.BytesIO(comp_bytes)).convert('RGB'))
-
-    # Ensure same size for pixel-wise comparison (resize compressed to original if needed)
-    if img1.shape != img2.shape:
-        # Resize img2 to match img1
-        img2 = cv2.resize(img2, (img1.shape[1], img1.shape[0]))
-
-    # Analysis
-    ssim_score, diff_map = ana.get_ssim(img1, img2)
-    sharp1 = ana.get_sharpness(img1)
-    sharp2 = ana.get_sharpness(img2)
-    
-    plots = {
-        "histograms": ana.generate_histograms(img1, img2),
-        "channels": ana.generate_channel_histograms(img1, img2),
-        "intensity": ana.generate_pixel_intensity(img1, img2),
-        "edges": ana.generate_edges(img1, img2),
-        "ssim_map": ana.generate_ssim_map(diff_map),
-        "fft": ana.generate_fft(img1, img2),
-        "contours": ana.generate_contours(img1, img2), # Can be slow
-        "color_diff": ana.generate_color_diff(img1, img2),
-        "texture": ana.generate_texture(img1, img2),
-    }
+    # Spool both images to disk; the worker decodes them from there
+    org_path = await uploads.spool_upload(original)
+    try:
+        comp_path = await uploads.spool_upload(compressed)
+        try:
+            admitted = admission.admit_comparison(
+                org_path, comp_path, admission.COMPARE_BYTES_PER_PIXEL["png" if format == "png" else "data"], oversize
+            )
+            if format == "png":
+                # SSIM, sharpness and the matplotlib plots are rendered in a worker process
+                metrics, plots = await pool.run(tasks.compare_analytics, org_path, comp_path, admitted["size"])
+            else:
+                # No rendering at all: histogram counts, uint8 maps and the metrics
+                content = await pool.run(
+                    tasks.compare_analytics_data, org_path, comp_path, format, map_size, admitted["size"]
+                )
+        finally:
+            uploads.remove_spooled(comp_path)
+    finally:
+        uploads.remove_spooled(org_path)
 
     process_time = time.perf_counter() - start_time
+    if format != "png":
+        return Response(
+            content=content, media_type=ARRAY_FORMATS[format],
+            headers={"X-Processing-Time": f"{process_time:.4f}", "X-PCA-Admission": admission.describe(admitted)}
+        )
 
     return JSONResponse({
-        "metrics": {
-            "ssim": float(ssim_score),
-            "sharpness_original": float(sharp1),
-            "sharpness_compressed": float(sharp2),
-            "time": process_time
-        },
+        "metrics": {**metrics, "time": process_time},
         "plots": plots
-    })
+    }, headers={"X-PCA-Admission": admission.describe(admitted)})
 
 if __name__ == "__main__":
     import uvicorn
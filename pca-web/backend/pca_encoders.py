@@ -0,0 +1,127 @@
+# pca_encoders.py
+# Output encoders for reconstructed images. Pixel encoders take a uint8 RGB array;
+# "pcaz" stores the PCA representation itself and takes a decomposition instead.
+import time
+from io import BytesIO
+
+from PIL import Image, features
+
+import pca_container
+
+DEFAULT_QUALITY = 75
+
+# Format name -> PIL format, save options, media type and file extension.
+# Plain "jpeg" skips the second Huffman pass of optimize=True, which costs
+# more time than the few percent of bytes it saves on these images.
+ENCODERS = {
+    "jpeg": {"pil_format": "JPEG", "options": {}, "media_type": "image/jpeg", "extension": ".jpg"},
+    "jpeg-optimized": {
+        "pil_format": "JPEG", "options": {"optimize": True}, "media_type": "image/jpeg", "extension": ".jpg",
+    },
+    "jpeg-progressive": {
+        "pil_format": "JPEG", "options": {"optimize": True, "progressive": True},
+        "media_type": "image/jpeg", "extension": ".jpg",
+    },
+    # method 4 is libwebp's default speed / size trade-off (0 fastest, 6 smallest)
+    "webp": {"pil_format": "WEBP", "options": {"method": 4}, "media_type": "image/webp", "extension": ".webp"},
+    # Lossless, quality is ignored
+    "png": {"pil_format": "PNG", "options": {}, "media_type": "image/png", "extension": ".png"},
+}
+
+CONTAINER_FORMAT = "pcaz"
+
+
+def available_formats():
+    """Pixel encoders this Pillow build can write (WebP support is optional)"""
+    return [name for name, encoder in ENCODERS.items()
+            if encoder["pil_format"] != "WEBP" or features.check("webp")]
+
+
+def media_type(output_format):
+    if output_format == CONTAINER_FORMAT:
+        return pca_container.MEDIA_TYPE
+    return ENCODERS[output_format]["media_type"]
+
+
+def extension(output_format):
+    if output_format == CONTAINER_FORMAT:
+        return pca_container.FILE_EXTENSION
+    return ENCODERS[output_format]["extension"]
+
+
+def output_name(name, output_format):
+    """File name for the encoded version of the file name.
+
+    The format's extension replaces a matching one and is appended to any
+    other (a.jpg -> a.jpg, a.png -> a.png.jpg), so inputs that only differ
+    in their extension keep separate outputs.
+    """
+    suffix = extension(output_format)
+    if name.lower().endswith(suffix):
+        name = name[:-len(suffix)]
+    return name + suffix
+
+
+def encode(img_array, output_format="jpeg", quality=DEFAULT_QUALITY):
+    """Encode a uint8 RGB array, returns bytes"""
+    encoder = ENCODERS[output_format]
+    buffer = BytesIO()
+    options = dict(encoder["options"])
+    if encoder["pil_format"] != "PNG":
+        options["quality"] = quality
+    Image.fromarray(img_array).save(buffer, format=encoder["pil_format"], **options)
+    return buffer.getvalue()
+
+
+def encode_pcaz(decomposition, channels, num_components, preset="float16"):
+    # preset picks the quantization and lossless codec, see pca_container.PRESETS
+    settings = pca_container.PRESETS[preset]
+    return pca_container.encode_pcaz(
+        decomposition, channels, num_components, settings["quantization"], settings["codec"]
+    )
+
+
+def negotiate(accept, default="jpeg", formats=None):
+    """Output format for an Accept header.
+
+    Picks the acceptable media type with the highest q value that one of
+    formats (default: all available ones plus pcaz) produces. The first
+    format listed for a media type wins, so image/jpeg means plain "jpeg".
+    Wildcards, a missing header and headers naming nothing we produce give
+    default.
+    """
+    if formats is None:
+        formats = available_formats() + [CONTAINER_FORMAT]
+    if not accept:
+        return default
+    by_media_type = {}
+    for name in formats:
+        by_media_type.setdefault(media_type(name), name)
+
+    best, best_q = None, 0.0
+    for part in accept.split(","):
+        kind, _, params = part.partition(";")
+        kind = kind.strip().lower()
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        candidate = default if kind in ("*/*", "image/*") else by_media_type.get(kind)
+        # Strictly greater, so ties go to the type listed first
+        if candidate is not None and q > best_q:
+            best, best_q = candidate, q
+    return best or default
+
+
+def benchmark(img_array, formats=None, quality=DEFAULT_QUALITY):
+    """Encode img_array with every format, returns [{"format", "bytes", "seconds"}]"""
+    report = []
+    for name in formats or available_formats():
+        start = time.perf_counter()
+        content = encode(img_array, name, quality)
+        report.append({"format": name, "bytes": len(content), "seconds": time.perf_counter() - start})
+    return report
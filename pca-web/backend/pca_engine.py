@@ -0,0 +1,713 @@
+# pca_engine.py
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class PCADecomposition:
+    """Per-channel PCA decomposition of a stack of image channels.
+
+    Holds the column means and the eigenvalues / eigenvectors of every
+    channel's covariance matrix, sorted in descending order, so the same
+    decomposition can be reused to reconstruct with any number of components
+    up to its rank (the full width, or fewer for the truncated solvers).
+    """
+
+    def __init__(self, means, eig_vals, eig_vecs, cov_matrices=None, solver="full", error_estimate=None,
+                 n_rows=None, gram=False, total_variance=None, randomized_options=None):
+        self.means = means              # (channels, width)
+        self.eig_vals = eig_vals        # (channels, rank)
+        self.eig_vecs = eig_vecs        # (channels, width, rank)
+        self.cov_matrices = cov_matrices
+        self.solver = solver
+        self.n_rows = n_rows if n_rows is not None else means.shape[-1]
+        # True when the rows x rows Gram matrix was decomposed instead of the covariance
+        self.gram = gram
+        # Trace of each covariance matrix, the sum of all eigenvalues even when only some were computed
+        self.total_variance = total_variance if total_variance is not None else eig_vals.sum(axis=-1)
+        # Relative Frobenius error of the rank-k reconstruction, per channel (randomized solver only)
+        self.error_estimate = error_estimate
+        # Sketch settings a randomized decomposition was computed with, see randomized_settings
+        self.randomized_options = randomized_options
+
+    @property
+    def num_channels(self):
+        return self.means.shape[0]
+
+    @property
+    def width(self):
+        return self.means.shape[-1]
+
+    @property
+    def rank(self):
+        return self.eig_vals.shape[-1]
+
+    @property
+    def max_rank(self):
+        # At most min(height, width) components carry any variance
+        return min(self.width, self.n_rows)
+
+    @property
+    def nbytes(self):
+        arrays = (self.means, self.eig_vals, self.eig_vecs, self.cov_matrices, self.error_estimate, self.total_variance)
+        return sum(a.nbytes for a in arrays if a is not None)
+
+    def covers(self, num_components=None, solver="auto", dtype=None, **randomized_options):
+        """Whether this decomposition can serve a request without recomputing"""
+        # Exact decompositions are interchangeable. Randomized ones are approximate and carry an
+        # error estimate, so they only serve randomized requests with the same sketch settings.
+        if (self.solver == "randomized") != (solver == "randomized"):
+            return False
+        if solver == "randomized" and self.randomized_options != randomized_settings(**randomized_options):
+            return False
+        if dtype is not None and np.dtype(dtype) != self.dtype:
+            return False
+        needed = self.max_rank if num_components is None else min(max(num_components, 1), self.max_rank)
+        return self.rank >= needed
+
+    def channel(self, index):
+        """Decomposition of a single channel of the stack"""
+        return self.slice_channels(index, index + 1)
+
+    def slice_channels(self, start, stop):
+        """Decomposition of channels start:stop of the stack (views, no copies)"""
+        return PCADecomposition(
+            self.means[start:stop],
+            self.eig_vals[start:stop],
+            self.eig_vecs[start:stop],
+            cov_matrices=self.cov_matrices[start:stop] if self.cov_matrices is not None else None,
+            solver=self.solver,
+            error_estimate=self.error_estimate[start:stop] if self.error_estimate is not None else None,
+            n_rows=self.n_rows,
+            gram=self.gram,
+            total_variance=self.total_variance[start:stop],
+            randomized_options=self.randomized_options,
+        )
+
+    def clamp_components(self, num_components):
+        """Clamp a requested component count to [1, rank]"""
+        return int(min(max(num_components, 1), self.rank))
+
+    @property
+    def dtype(self):
+        return self.means.dtype
+
+    def reconstruct_centered(self, centered_data, num_components):
+        """Reconstruct from already centered data, overwriting centered_data in place"""
+        k = self.clamp_components(num_components)
+
+        # Project data onto the selected principal components
+        projection_matrix = self.eig_vecs[:, :, :k]
+        compressed_data = np.matmul(centered_data, projection_matrix)
+
+        # Reconstruct the data into the centered buffer
+        np.matmul(compressed_data, projection_matrix.transpose(0, 2, 1), out=centered_data)
+        centered_data += self.means[:, None, :]
+        return centered_data
+
+    def reconstruct_float(self, channels, num_components):
+        """Project channels onto the top components and reconstruct them, unclipped"""
+        channels = as_channel_stack(channels)
+        centered_data = np.empty(channels.shape, dtype=self.dtype)
+        np.subtract(channels, self.means[:, None, :], out=centered_data)
+        return self.reconstruct_centered(centered_data, num_components)
+
+    def reconstruct(self, channels, num_components):
+        """Reconstruct channels with the top components as uint8"""
+        return clip_to_uint8(self.reconstruct_float(channels, num_components))
+
+
+def clip_to_uint8(reconstructed_data):
+    """Clip the values to [0, 255] in place and convert to uint8"""
+    np.clip(reconstructed_data, 0, 255, out=reconstructed_data)
+    return reconstructed_data.astype(np.uint8)
+
+
+def as_channel_stack(channels):
+    """Return channels as a (channels, height, width) array"""
+    channels = np.asarray(channels)
+    if channels.ndim == 2:
+        channels = channels[np.newaxis]
+    return channels
+
+
+def split_channels(image_array):
+    """View an (height, width, channels) image as a (channels, height, width) stack"""
+    return np.moveaxis(np.asarray(image_array), -1, 0)
+
+
+def merge_channels(channels):
+    """Inverse of split_channels"""
+    return np.ascontiguousarray(np.moveaxis(channels, 0, -1))
+
+
+# Solver selection for decompose(solver="auto"): the truncated solvers only
+# pay off when a small fraction of the spectrum is kept
+LANCZOS_MAX_RATIO = 0.05
+SUBSET_MAX_RATIO = 0.2
+TRUNCATED_MIN_WIDTH = 128
+# When even the smaller side is this large, no covariance or Gram matrix is formed at all
+RANDOMIZED_MIN_WIDTH = 8192
+
+SOLVERS = ("full", "subset", "lanczos", "randomized")
+
+# Compute precisions, float32 is opt-in
+PRECISIONS = {"float64": np.float64, "float32": np.float32}
+
+
+def choose_solver(width, num_components):
+    """Pick the cheapest eigensolver for keeping num_components of a width x width matrix"""
+    if num_components is None or width < TRUNCATED_MIN_WIDTH or num_components >= width:
+        return "full"
+    if width >= RANDOMIZED_MIN_WIDTH:
+        return "randomized"
+    ratio = num_components / width
+    if ratio <= LANCZOS_MAX_RATIO:
+        return "lanczos"
+    if ratio <= SUBSET_MAX_RATIO:
+        return "subset"
+    return "full"
+
+
+def center_channels(channels, dtype=np.float64):
+    """Return (means, centered_data) with the centered data in a single new dtype buffer"""
+    means = channels.mean(axis=1, dtype=dtype)
+    centered_data = np.empty(channels.shape, dtype=dtype)
+    np.subtract(channels, means[:, None, :], out=centered_data)
+    return means, centered_data
+
+
+def _syrk_stack(centered_data, gram):
+    """Symmetric rank-k products of every channel, only the lower triangles are filled"""
+    from scipy.linalg.blas import get_blas_funcs
+
+    n_channels, n_rows, width = centered_data.shape
+    size = n_rows if gram else width
+    syrk = get_blas_funcs("syrk", dtype=centered_data.dtype)
+    matrices = np.zeros((n_channels, size, size), dtype=centered_data.dtype)
+
+    # Same normalisation as np.cov
+    alpha = 1.0 / max(n_rows - 1, 1)
+    for index in range(n_channels):
+        # Transposed views are Fortran ordered, so BLAS reads and writes them without copying.
+        # Filling the upper triangle of out.T fills the lower triangle of out.
+        syrk(alpha, centered_data[index].T, trans=1 if gram else 0,
+             c=matrices[index].T, beta=0.0, overwrite_c=1)
+    return matrices
+
+
+def covariance_stack(centered_data):
+    """Stack of width x width covariance matrices (lower triangles only)"""
+    return _syrk_stack(centered_data, gram=False)
+
+
+def gram_stack(centered_data):
+    """Stack of rows x rows Gram matrices (lower triangles only).
+
+    X X^T shares its non-zero eigenvalues with X^T X.
+    """
+    return _syrk_stack(centered_data, gram=True)
+
+
+def symmetrize(matrices):
+    """Mirror the lower triangles of a stack of matrices into the upper triangles, in place"""
+    for matrix in matrices:
+        matrix += np.tril(matrix, -1).T
+    return matrices
+
+
+def _gram_to_eigenvectors(centered_data, eig_vals, gram_vecs):
+    """Map Gram eigenvectors u_i to covariance eigenvectors v_i = X^T u_i / sigma_i"""
+    n_rows = centered_data.shape[1]
+    eig_vecs = np.matmul(centered_data.transpose(0, 2, 1), gram_vecs)
+
+    # Components without variance have no defined direction, leave them as zero vectors
+    singular_vals = np.sqrt(np.clip(eig_vals, 0, None) * max(n_rows - 1, 1))
+    tolerance = singular_vals[:, :1] * max(centered_data.shape[1:]) * np.finfo(eig_vecs.dtype).eps
+    scale = np.divide(1.0, singular_vals, out=np.zeros_like(singular_vals), where=singular_vals > tolerance)
+    eig_vecs *= scale[:, None, :]
+    return eig_vecs
+
+
+def _eigh_full(matrices):
+    # One LAPACK call for all channels
+    eig_vals, eig_vecs = np.linalg.eigh(matrices, UPLO="L")
+
+    # eigh returns ascending order, flip to descending
+    return eig_vals[:, ::-1], eig_vecs[:, :, ::-1]
+
+
+def _eigh_subset(matrices, k):
+    from scipy.linalg import eigh
+
+    # LAPACK syevr only computes the eigenpairs in the requested index range
+    size = matrices.shape[-1]
+    results = [eigh(matrix, lower=True, subset_by_index=[size - k, size - 1], driver="evr") for matrix in matrices]
+    eig_vals = np.stack([vals[::-1] for vals, _ in results])
+    eig_vecs = np.stack([vecs[:, ::-1] for _, vecs in results])
+    return eig_vals, eig_vecs
+
+
+def _eigh_lanczos(matrices, k):
+    from scipy.sparse.linalg import eigsh
+
+    # Implicitly restarted Lanczos (ARPACK) needs the full symmetric matrices.
+    # A fixed start vector keeps the output reproducible.
+    symmetrize(matrices)
+    size = matrices.shape[-1]
+    v0 = np.random.default_rng(0).standard_normal(size).astype(matrices.dtype)
+    eig_vals = np.empty((len(matrices), k), dtype=matrices.dtype)
+    eig_vecs = np.empty((len(matrices), size, k), dtype=matrices.dtype)
+    for index, matrix in enumerate(matrices):
+        if not matrix.any():
+            # Constant channel: ARPACK fails on a zero operator ("starting vector is zero").
+            # Every direction has zero variance, so any orthonormal basis is exact.
+            eig_vals[index] = 0
+            eig_vecs[index] = np.eye(size, k, dtype=matrices.dtype)
+            continue
+        vals, vecs = eigsh(matrix, k=k, which="LA", v0=v0)
+        order = np.argsort(vals)[::-1]
+        eig_vals[index] = vals[order]
+        eig_vecs[index] = vecs[:, order]
+    return eig_vals, eig_vecs
+
+
+def randomized_settings(oversampling=10, power_iterations=2, seed=0):
+    """Randomized solver options with the defaults filled in, for comparing decompositions"""
+    return {"oversampling": int(oversampling), "power_iterations": int(power_iterations), "seed": int(seed)}
+
+
+def randomized_decompose(channels, num_components, oversampling=10, power_iterations=2, seed=0,
+                         dtype=np.float64):
+    """Randomized range-finder PCA (Halko, Martinsson & Tropp).
+
+    Works on the centered data directly, so the width x width covariance is
+    never formed. A Gaussian sketch of num_components + oversampling columns is
+    refined with power_iterations subspace iterations; more oversampling or
+    iterations trade time for accuracy.
+    """
+    channels = as_channel_stack(channels)
+    means, centered_data = center_channels(channels, dtype)
+    return _randomized_from_centered(means, centered_data, num_components, oversampling, power_iterations, seed)
+
+
+def _randomized_from_centered(means, centered_data, num_components, oversampling=10, power_iterations=2, seed=0):
+    n_channels, n_rows, width = centered_data.shape
+    k = int(min(max(num_components, 1), width, n_rows))
+    sketch_size = min(k + max(oversampling, 0), width, n_rows)
+    centered_t = centered_data.transpose(0, 2, 1)
+
+    # Orthonormal basis for the range of the sketch
+    omega = np.random.default_rng(seed).standard_normal((width, sketch_size)).astype(centered_data.dtype)
+    q, _ = np.linalg.qr(np.matmul(centered_data, omega))
+    for _ in range(power_iterations):
+        z, _ = np.linalg.qr(np.matmul(centered_t, q))
+        q, _ = np.linalg.qr(np.matmul(centered_data, z))
+
+    # Small SVD of the projected data, shape (channels, sketch_size, width)
+    _, singular_vals, vt = np.linalg.svd(np.matmul(q.transpose(0, 2, 1), centered_data), full_matrices=False)
+    eig_vecs = vt[:, :k].transpose(0, 2, 1)
+    eig_vals = singular_vals[:, :k] ** 2 / max(n_rows - 1, 1)
+
+    # ||X - X V V^T||^2 = ||X||^2 - ||X V||^2 for orthonormal V
+    total = np.einsum("chw,chw->c", centered_data, centered_data)
+    scores = np.matmul(centered_data, eig_vecs)
+    captured = np.einsum("chk,chk->c", scores, scores)
+    residual = np.maximum(total - captured, 0)
+    error_estimate = np.sqrt(np.divide(residual, total, out=np.zeros_like(total), where=total > 0))
+
+    return PCADecomposition(
+        means, eig_vals, eig_vecs, solver="randomized", error_estimate=error_estimate, n_rows=n_rows,
+        total_variance=total / max(n_rows - 1, 1),
+        randomized_options=randomized_settings(oversampling, power_iterations, seed),
+    )
+
+
+def decompose(channels, num_components=None, solver="auto", keep_covariance=False, dtype=np.float64,
+              **randomized_options):
+    """Decompose every channel of a stack.
+
+    With num_components=None the full spectrum is computed in a single batched
+    eigh call. Otherwise only the leading num_components eigenpairs are needed
+    and solver may be "full", "subset" (LAPACK index range), "lanczos" (ARPACK),
+    "randomized" (see randomized_decompose, which takes randomized_options) or
+    "auto", which picks one from the decomposed size and the ratio of
+    num_components to it.
+
+    Images wider than they are tall decompose the smaller rows x rows Gram
+    matrix and map its eigenvectors back, which gives the same reconstruction.
+
+    dtype=np.float32 runs the whole computation in single precision, halving
+    the memory of every intermediate buffer.
+    """
+    decomposition, _ = _decompose(channels, num_components, solver, keep_covariance, dtype, randomized_options)
+    return decomposition
+
+
+def _decompose(channels, num_components, solver, keep_covariance, dtype, randomized_options):
+    """decompose() that also returns the centered data buffer for reuse"""
+    channels = as_channel_stack(channels)
+    n_rows, width = channels.shape[1:]
+
+    # Decompose whichever side is smaller: the width x width covariance, or the
+    # rows x rows Gram matrix for wide images (the analysis views need the covariance)
+    gram = n_rows < width and not keep_covariance
+    dim = n_rows if gram else width
+    k = None if num_components is None else int(min(max(num_components, 1), dim))
+
+    if solver == "auto":
+        solver = choose_solver(dim, k)
+    if solver not in SOLVERS:
+        raise ValueError(f"Unknown solver: {solver}")
+    if solver in ("lanczos", "randomized") and (k is None or k >= dim):
+        solver = "full"
+    if solver == "subset" and k is None:
+        solver = "full"
+
+    # Every later stage reads from this one centered buffer
+    means, centered_data = center_channels(channels, dtype)
+
+    if solver == "randomized":
+        decomposition = _randomized_from_centered(means, centered_data, k, **randomized_options)
+        return decomposition, centered_data
+
+    matrices = gram_stack(centered_data) if gram else covariance_stack(centered_data)
+
+    if solver == "lanczos":
+        eig_vals, eig_vecs = _eigh_lanczos(matrices, k)
+    elif solver == "subset":
+        eig_vals, eig_vecs = _eigh_subset(matrices, k)
+    else:
+        eig_vals, eig_vecs = _eigh_full(matrices)
+
+    if gram:
+        eig_vecs = _gram_to_eigenvectors(centered_data, eig_vals, eig_vecs)
+
+    total_variance = np.einsum("chw,chw->c", centered_data, centered_data) / max(n_rows - 1, 1)
+
+    decomposition = PCADecomposition(
+        means,
+        eig_vals,
+        eig_vecs,
+        cov_matrices=symmetrize(matrices) if keep_covariance else None,
+        solver=solver,
+        n_rows=n_rows,
+        gram=gram,
+        total_variance=total_variance,
+    )
+    return decomposition, centered_data
+
+
+def spectrum(channels, dtype=np.float64):
+    """Eigenvalues of every channel's covariance, descending, without any eigenvectors.
+
+    eigvalsh skips the eigenvector back-transformation, which is most of the
+    cost of a full eigh. Like decompose, wide images use the Gram matrix,
+    which has the same non-zero eigenvalues. Returns (eig_vals of shape
+    (channels, min(rows, width)), total_variance per channel).
+    """
+    channels = as_channel_stack(channels)
+    n_rows, width = channels.shape[1:]
+    _, centered_data = center_channels(channels, dtype)
+    matrices = gram_stack(centered_data) if n_rows < width else covariance_stack(centered_data)
+    eig_vals = np.linalg.eigvalsh(matrices, UPLO="L")[:, ::-1]
+    total_variance = np.einsum("chw,chw->c", centered_data, centered_data) / max(n_rows - 1, 1)
+    return eig_vals, total_variance
+
+
+def compress_channels(channels, num_components, solver="auto", dtype=np.float64, **randomized_options):
+    """Decompose and reconstruct a channel stack, returns (reconstructed, decomposition)"""
+    decomposition, centered_data = _decompose(channels, num_components, solver, False, dtype, randomized_options)
+    # The reconstruction overwrites the centered buffer instead of allocating new ones
+    reconstructed = decomposition.reconstruct_centered(centered_data, num_components)
+    return clip_to_uint8(reconstructed), decomposition
+
+
+def compress_image_array(image_array, num_components, solver="auto", dtype=np.float64, **randomized_options):
+    """Compress an (height, width, 3) uint8 image, returns (reconstructed image array, decomposition)"""
+    channels = split_channels(np.asarray(image_array)[:, :, :3])
+    reconstructed, decomposition = compress_channels(
+        channels, num_components, solver=solver, dtype=dtype, **randomized_options
+    )
+    return merge_channels(reconstructed), decomposition
+
+
+def decompose_image_batch(image_arrays, num_components=None, solver="auto", dtype=np.float64, **randomized_options):
+    """Decompose same-shape RGB images in one stacked call, returns (channels, decomposition).
+
+    channels is the (3 * n_images, height, width) stack, image i owns
+    channels 3i:3i+3 of it (see decomposition.slice_channels).
+    """
+    channels = np.concatenate([split_channels(np.asarray(image)[:, :, :3]) for image in image_arrays])
+    decomposition = decompose(channels, num_components, solver=solver, dtype=dtype, **randomized_options)
+    return channels, decomposition
+
+
+def compress_image_batch(image_arrays, num_components, solver="auto", dtype=np.float64, **randomized_options):
+    """Compress same-shape RGB images with one batched eigh.
+
+    num_components is shared or a list with one count per image. Returns a
+    list of (reconstructed image array, decomposition) pairs.
+    """
+    if np.ndim(num_components) == 0:
+        num_components = [num_components] * len(image_arrays)
+    channels, decomposition = decompose_image_batch(
+        image_arrays, max(num_components), solver=solver, dtype=dtype, **randomized_options
+    )
+    results = []
+    for index, k in enumerate(num_components):
+        single = decomposition.slice_channels(3 * index, 3 * index + 3)
+        results.append((merge_channels(single.reconstruct(channels[3 * index:3 * index + 3], k)), single))
+    return results
+
+
+def estimate_cost(height, width, num_components=None, solver="auto", dtype=np.float64, num_channels=3,
+                  oversampling=10, power_iterations=2):
+    """Rough peak memory and work of compressing a height x width image, before decoding it.
+
+    Returns {"solver", "peak_bytes", "flops"}. The constants are coarse (LAPACK
+    and ARPACK internals vary); what matters for admission control is how the
+    numbers scale with image size, component count and solver.
+    """
+    itemsize = np.dtype(dtype).itemsize
+    # The smaller side is decomposed (Gram matrix for wide images), the larger one is the sample count
+    rows, dim = max(height, width), min(height, width)
+    k = dim if num_components is None else min(max(num_components, 1), dim)
+    if solver == "auto":
+        solver = choose_solver(dim, k)
+    pixels = num_channels * height * width
+
+    # uint8 input and output plus the centered float buffer, reconstructed in place
+    peak_bytes = 2 * pixels + pixels * itemsize
+    flops = 2 * 2 * pixels * k  # projection and reconstruction matmuls
+
+    if solver == "randomized":
+        sketch = k + oversampling
+        peak_bytes += 2 * num_channels * rows * sketch * itemsize
+        flops += num_channels * 2 * rows * dim * sketch * (2 * power_iterations + 2)
+    else:
+        rank = dim if solver == "full" else k
+        # Covariance (or Gram) matrix, eigh workspace and the eigenvectors it returns
+        peak_bytes += num_channels * (2 * dim * dim + dim * rank) * itemsize
+        flops += num_channels * rows * dim * dim  # syrk
+        if solver == "full":
+            flops += num_channels * 9 * dim ** 3
+        elif solver == "subset":
+            # Still a full tridiagonal reduction, only the eigenvector stage is cheaper
+            flops += num_channels * 6 * dim ** 3
+        else:
+            flops += num_channels * 40 * dim * dim * k
+
+    return {"solver": solver, "peak_bytes": int(peak_bytes), "flops": int(flops)}
+
+
+# JPEG (JFIF) full-range YCbCr, every plane stays within 0-255
+RGB_TO_YCBCR = np.array([
+    [0.299, 0.587, 0.114],
+    [-0.168736, -0.331264, 0.5],
+    [0.5, -0.418688, -0.081312],
+])
+YCBCR_TO_RGB = np.array([
+    [1.0, 0.0, 1.402],
+    [1.0, -0.344136, -0.714136],
+    [1.0, 1.772, 0.0],
+])
+YCBCR_OFFSET = np.array([0.0, 128.0, 128.0])
+
+COLOR_SPACES = ("rgb", "ycbcr")
+
+
+def ycbcr_planes(image_array, subsample_chroma=False, dtype=np.float64):
+    """Split an RGB image into a (1, h, w) luma stack and a (2, h', w') chroma stack.
+
+    With subsample_chroma the chroma planes are averaged over 2x2 blocks.
+    """
+    rgb = np.asarray(image_array)[:, :, :3].astype(dtype)
+    ycbcr = np.matmul(rgb, RGB_TO_YCBCR.T.astype(dtype))
+    ycbcr += YCBCR_OFFSET.astype(dtype)
+    planes = np.moveaxis(ycbcr, -1, 0)
+    luma = np.ascontiguousarray(planes[:1])
+    chroma = np.ascontiguousarray(planes[1:])
+
+    if subsample_chroma:
+        n_planes, height, width = chroma.shape
+        padded = np.pad(chroma, ((0, 0), (0, height % 2), (0, width % 2)), mode="edge")
+        chroma = padded.reshape(n_planes, padded.shape[1] // 2, 2, padded.shape[2] // 2, 2).mean(axis=(2, 4))
+    return luma, chroma
+
+
+def merge_ycbcr_planes(luma, chroma):
+    """Inverse of ycbcr_planes, upsamples subsampled chroma and returns a uint8 RGB image"""
+    height, width = luma.shape[1:]
+    if chroma.shape[1:] != (height, width):
+        chroma = np.repeat(np.repeat(chroma, 2, axis=1), 2, axis=2)[:, :height, :width]
+
+    ycbcr = np.concatenate([luma, chroma]).astype(luma.dtype, copy=False)
+    ycbcr -= YCBCR_OFFSET.astype(luma.dtype)[:, None, None]
+    rgb = np.matmul(np.moveaxis(ycbcr, 0, -1), YCBCR_TO_RGB.T.astype(luma.dtype))
+    return clip_to_uint8(rgb)
+
+
+def compress_image_ycbcr(image_array, luma_components, chroma_components=None, subsample_chroma=False,
+                         solver="auto", dtype=np.float64, **randomized_options):
+    """Compress an RGB image in YCbCr space with separate luma and chroma component counts.
+
+    RGB channels are strongly correlated; after the transform most of the
+    detail sits in luma, so chroma gets fewer components (half of luma by
+    default) and optionally half resolution, which makes its eigh ~8x cheaper.
+    Returns (reconstructed RGB image, (luma decomposition, chroma decomposition)).
+    """
+    if chroma_components is None:
+        chroma_components = max(1, luma_components // 2)
+    luma, chroma = ycbcr_planes(image_array, subsample_chroma, dtype)
+
+    # Luma alone, both chroma planes together in one batched call
+    reconstructed = []
+    decompositions = []
+    for planes, k in ((luma, luma_components), (chroma, chroma_components)):
+        decomposition, centered_data = _decompose(planes, k, solver, False, dtype, randomized_options)
+        reconstructed.append(decomposition.reconstruct_centered(centered_data, k))
+        decompositions.append(decomposition)
+
+    return merge_ycbcr_planes(*reconstructed), tuple(decompositions)
+
+
+# Converting the reconstruction to uint8 truncates, which adds about 1/3 to the MSE
+TRUNCATION_MSE = 1.0 / 3.0
+
+
+def error_curve(decomposition):
+    """Reconstruction quality for every k = 1..rank, straight from the eigenvalues.
+
+    ||X - X V_k V_k^T||^2 = (n - 1) * sum of the eigenvalues after k, so the
+    whole curve is a cumulative sum, no reconstruction needed. Returns a dict
+    of arrays for all channels combined: components, retained_variance
+    (fraction), mse (per pixel, 0-255 scale) and psnr (dB).
+    """
+    return spectrum_curve(
+        decomposition.eig_vals, decomposition.total_variance, decomposition.n_rows, decomposition.width
+    )
+
+
+def spectrum_curve(eig_vals, total_variance, n_rows, width):
+    """error_curve from a (channels, rank) spectrum, e.g. from spectrum(), without a decomposition"""
+    eig_vals = np.clip(eig_vals, 0, None)
+    total = total_variance
+    captured = np.cumsum(eig_vals, axis=1)
+    n_values = n_rows * width * eig_vals.shape[0]
+
+    residual = np.clip(total[:, None] - captured, 0, None).sum(axis=0)
+    mse = residual * max(n_rows - 1, 1) / n_values + TRUNCATION_MSE
+    total_sum = total.sum()
+    retained = captured.sum(axis=0) / total_sum if total_sum > 0 else np.ones(eig_vals.shape[1])
+
+    return {
+        "components": np.arange(1, eig_vals.shape[1] + 1),
+        "retained_variance": retained,
+        "mse": mse,
+        "psnr": 10 * np.log10(255.0 ** 2 / mse),
+    }
+
+
+def select_components(decomposition, target_variance=None, target_psnr=None, max_bytes=None,
+                      bytes_per_component=None, fixed_bytes=0):
+    """Smallest k meeting every given target, from the spectrum alone.
+
+    target_variance is a retained-variance fraction (0-1), target_psnr is in dB.
+    max_bytes caps k with the linear size model fixed_bytes + k * bytes_per_component
+    (see pca_container.size_model). Unreachable targets give the full rank.
+    """
+    curve = error_curve(decomposition)
+    k = 1
+
+    # The curves are monotonic in k, so each target is a binary search
+    if target_variance is not None:
+        index = np.searchsorted(curve["retained_variance"], target_variance - 1e-12)
+        k = max(k, int(index) + 1)
+    if target_psnr is not None:
+        index = np.searchsorted(curve["psnr"], target_psnr)
+        k = max(k, int(index) + 1)
+    if max_bytes is not None:
+        if bytes_per_component is None:
+            raise ValueError("max_bytes needs bytes_per_component")
+        budget_k = int((max_bytes - fixed_bytes) // bytes_per_component)
+        # Without a quality target use the whole budget, otherwise the budget caps k
+        k = budget_k if target_variance is None and target_psnr is None else min(k, budget_k)
+
+    return int(min(max(k, 1), decomposition.rank))
+
+
+def image_digest(array):
+    """Content digest of an array, used as the decomposition cache key"""
+    array = np.ascontiguousarray(array)
+    digest = hashlib.sha256(f"{array.shape}{array.dtype}".encode())
+    digest.update(memoryview(array).cast("B"))
+    return digest.hexdigest()
+
+
+DEFAULT_CACHE_BYTES = 512 * 1024 * 1024
+
+
+class DecompositionCache:
+    """Byte-budgeted LRU of decompositions keyed by image content digest.
+
+    A cached decomposition is reused for any component count up to its rank,
+    so moving a slider only costs the projection matmul, not a new eigh.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, digest, num_components=None, solver="auto", dtype=None, **randomized_options):
+        with self._lock:
+            decomposition = self._entries.get(digest)
+            if decomposition is None or not decomposition.covers(num_components, solver, dtype, **randomized_options):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(digest)
+            self.hits += 1
+            return decomposition
+
+    def put(self, digest, decomposition):
+        size = decomposition.nbytes
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(digest, None)
+            if previous is not None:
+                self.current_bytes -= previous.nbytes
+            self._entries[digest] = decomposition
+            self.current_bytes += size
+
+            # Evict least recently used entries until we are back under budget
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= evicted.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def get_or_decompose(self, channels, num_components=None, solver="auto", digest=None, dtype=np.float64,
+                         **randomized_options):
+        """Return a cached decomposition covering the request, decomposing on a miss"""
+        channels = as_channel_stack(channels)
+        if digest is None:
+            digest = image_digest(channels)
+
+        decomposition = self.get(digest, num_components, solver, dtype, **randomized_options)
+        if decomposition is None:
+            decomposition = decompose(channels, num_components, solver=solver, dtype=dtype, **randomized_options)
+            self.put(digest, decomposition)
+        return decomposition
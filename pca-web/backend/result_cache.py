@@ -0,0 +1,153 @@
+# result_cache.py
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+DEFAULT_MEMORY_BYTES = 128 * 1024 * 1024
+DEFAULT_DISK_BYTES = 2 * 1024 * 1024 * 1024
+
+
+def result_key(source, params):
+    """Content address of a result: sha256 of the upload (bytes or a path) plus the canonical parameters"""
+    if isinstance(source, bytes):
+        digest = hashlib.sha256(source)
+    else:
+        digest = hashlib.sha256()
+        with open(source, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    digest.update(json.dumps(params, sort_keys=True, separators=(",", ":")).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def etag_for(key):
+    # Weak validator: equal keys give equivalent images, but not always equal bytes, since the
+    # decomposition behind them may come from a different solver (see the decomposition store)
+    return f'W/"{key}"'
+
+
+def etag_matches(if_none_match, etag):
+    """If-None-Match uses the weak comparison, so W/ prefixes are ignored"""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or any(tag.removeprefix("W/") == etag.removeprefix("W/") for tag in candidates)
+
+
+class ResultCache:
+    """Byte-budgeted LRU of encoded /compress results with an optional disk tier.
+
+    Entries are (content, metadata) pairs keyed by result_key. Memory misses
+    fall through to disk_dir (when set), and disk hits are promoted back
+    into memory. Both tiers evict the least recently used entries first.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MEMORY_BYTES, disk_dir=None, disk_max_bytes=DEFAULT_DISK_BYTES):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self.disk_max_bytes = disk_max_bytes
+        self.disk_bytes = 0
+        if self.disk_dir is not None:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+            self.disk_bytes = sum(path.stat().st_size for path in self.disk_dir.glob("*.bin"))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Returns (content, metadata) or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+
+        entry = self._read_disk(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        self._put_memory(key, entry)
+        return entry
+
+    def put(self, key, content, metadata):
+        entry = (content, metadata)
+        self._put_memory(key, entry)
+        self._write_disk(key, entry)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def _put_memory(self, key, entry):
+        size = len(entry[0])
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.current_bytes -= len(previous[0])
+            self._entries[key] = entry
+            self.current_bytes += size
+
+            # Evict least recently used entries until we are back under budget
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= len(evicted[0])
+
+    def _paths(self, key):
+        return self.disk_dir / f"{key}.bin", self.disk_dir / f"{key}.json"
+
+    def _read_disk(self, key):
+        if self.disk_dir is None:
+            return None
+        content_path, meta_path = self._paths(key)
+        try:
+            content = content_path.read_bytes()
+            metadata = json.loads(meta_path.read_text())
+        except (OSError, ValueError):
+            return None
+        # Bump the mtime so disk eviction is least recently used too
+        os.utime(content_path)
+        return content, metadata
+
+    def _write_disk(self, key, entry):
+        if self.disk_dir is None or len(entry[0]) > self.disk_max_bytes:
+            return
+        content_path, meta_path = self._paths(key)
+        if content_path.exists():
+            return
+        # Metadata first and the content renamed into place last, so a .bin always has its .json
+        meta_path.write_text(json.dumps(entry[1]))
+        partial = content_path.with_suffix(".part")
+        partial.write_bytes(entry[0])
+        os.replace(partial, content_path)
+        with self._lock:
+            self.disk_bytes += len(entry[0])
+            over_budget = self.disk_bytes > self.disk_max_bytes
+        if over_budget:
+            self._evict_disk()
+
+    def _evict_disk(self):
+        files = sorted(self.disk_dir.glob("*.bin"), key=lambda path: path.stat().st_mtime)
+        total = sum(path.stat().st_size for path in files)
+        for path in files:
+            if total <= self.disk_max_bytes:
+                break
+            total -= path.stat().st_size
+            path.unlink(missing_ok=True)
+            path.with_suffix(".json").unlink(missing_ok=True)
+        with self._lock:
+            self.disk_bytes = total
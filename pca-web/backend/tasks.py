@@ -0,0 +1,368 @@
+# tasks.py
+# CPU-bound stages of the API handlers. They run in worker processes (see workers.py),
+# so they only take and return plain picklable values: bytes, numbers, dicts.
+import io
+import json
+import os
+import tempfile
+import time
+import numpy as np
+from PIL import Image
+import pca_engine
+import pca_container
+import pca_encoders
+from decomposition_store import DecompositionStore, DEFAULT_STORE_DIR, DEFAULT_STORE_BYTES
+from admission import MAX_PIXELS
+
+try:
+    import tifffile
+except ImportError:  # optional, TIFFs are decoded by PIL without it
+    tifffile = None
+
+# Same decompression bomb limit in the worker processes as in the API process
+Image.MAX_IMAGE_PIXELS = MAX_PIXELS
+
+TIFF_MAGIC = (b"II*\x00", b"MM\x00*")
+
+# Decompositions shared by all workers on this machine; PCA_DECOMPOSITION_STORE=0 turns it off
+USE_DECOMPOSITION_STORE = os.environ.get("PCA_DECOMPOSITION_STORE", "1") != "0"
+_store = None
+
+
+def get_decomposition_store():
+    # One per worker process, opened on first use
+    global _store
+    if _store is None and USE_DECOMPOSITION_STORE:
+        _store = DecompositionStore(
+            os.environ.get("PCA_DECOMPOSITION_STORE_DIR", DEFAULT_STORE_DIR),
+            int(os.environ.get("PCA_DECOMPOSITION_STORE_BYTES", DEFAULT_STORE_BYTES)),
+        )
+    return _store
+
+
+def decompose_image(img_array, num_components, engine="auto", dtype=np.float64, **randomized_options):
+    """Returns (channels, decomposition), reusing a stored decomposition of the same pixels.
+
+    decomposition.solver is the engine that actually produced it, which may be
+    an exact solver other than the requested one (exact solvers are interchangeable).
+    """
+    channels = pca_engine.split_channels(img_array)
+    # Resolve "auto" first, the store only matches concrete solvers
+    if engine == "auto":
+        engine = pca_engine.choose_solver(min(channels.shape[1:]), num_components)
+    store = get_decomposition_store()
+    if store is None:
+        decomposition = pca_engine.decompose(channels, num_components, solver=engine, dtype=dtype, **randomized_options)
+    else:
+        decomposition = store.get_or_decompose(
+            channels, num_components, solver=engine, digest=pca_engine.image_digest(img_array), dtype=dtype,
+            **randomized_options
+        )
+    return channels, decomposition
+
+
+def open_image(source):
+    # Uploads arrive as bytes or as the path of a spooled file
+    return Image.open(io.BytesIO(source) if isinstance(source, bytes) else source)
+
+
+def decode_tiff_memmap(path):
+    """Decode an 8-bit RGB(A) or grayscale TIFF straight into a memory-mapped array.
+
+    Returns None when tifffile is missing or the file is not such a TIFF.
+    The backing file is unlinked right away and lives as long as the mapping.
+    """
+    if tifffile is None:
+        return None
+    with open(path, "rb") as f:
+        if f.read(4) not in TIFF_MAGIC:
+            return None
+    with tifffile.TiffFile(path) as tif:
+        page = tif.pages[0]
+        if page.dtype != np.uint8 or not (len(page.shape) == 2 or (len(page.shape) == 3 and page.shape[2] in (3, 4))):
+            return None
+        # PIL's MAX_IMAGE_PIXELS guard doesn't apply to this path, so enforce the same limit here
+        if page.shape[0] * page.shape[1] > MAX_PIXELS:
+            raise Image.DecompressionBombError(
+                f"Image has {page.shape[0] * page.shape[1]} pixels, the limit is {MAX_PIXELS}"
+            )
+
+    fd, out = tempfile.mkstemp(prefix="pca-decode-", suffix=".bin", dir=os.path.dirname(path))
+    os.close(fd)
+    try:
+        array = tifffile.imread(path, key=0, out=out)
+    finally:
+        os.unlink(out)
+    if array.ndim == 2:
+        # Grayscale: three read-only views of the same plane, no copies
+        return np.broadcast_to(array[:, :, np.newaxis], array.shape + (3,))
+    return array[:, :, :3]
+
+
+def decode_rgb(source, size=None):
+    """Decode bytes or a file to an RGB array, fitted into size=(width, height) when given"""
+    if size is None and not isinstance(source, bytes):
+        array = decode_tiff_memmap(source)
+        if array is not None:
+            return array
+    img = open_image(source)
+    if size is not None:
+        # JPEG draft mode decodes straight at 1/2, 1/4 or 1/8 scale, so the full image is never in memory
+        size = tuple(size)
+        img.draft('RGB', size)
+        img = img.convert('RGB')
+        img.thumbnail(size)
+    return np.array(img.convert('RGB'))
+
+
+# Quality 60 to ensure we actually see file size reduction vs original
+JPEG_QUALITY = 60
+
+
+def encode_image(img_array, output_format="jpeg"):
+    return pca_encoders.encode(img_array, output_format, JPEG_QUALITY)
+
+
+def compress(source, num_components, engine="auto", oversampling=10, power_iterations=2, precision="float64",
+             output_format="jpeg", container_preset="float16", color_space="rgb", chroma_components=None,
+             subsample_chroma=False, size=None, progress=None):
+    """Returns (content, media_type, solver, error_estimate or None, timings).
+
+    output_format is any pca_encoders format or "pcaz". size=(width, height)
+    downscales the image first (set by admission control). progress, if
+    given, is called as progress(stage, fraction) between stages. timings
+    holds the seconds spent decoding, decomposing and encoding.
+    """
+    report = progress or (lambda stage, fraction: None)
+    timings = {}
+    report("decoding", 0.05)
+    start = time.perf_counter()
+    img_array = decode_rgb(source, size)
+    dtype = pca_engine.PRECISIONS[precision]
+    timings["decode"] = time.perf_counter() - start
+    report("decomposing", 0.2)
+    start = time.perf_counter()
+
+    if output_format == pca_encoders.CONTAINER_FORMAT:
+        # Ship the PCA representation itself, the client decodes it with a matmul
+        channels, decomposition = decompose_image(
+            img_array, num_components, engine, dtype, oversampling=oversampling, power_iterations=power_iterations
+        )
+        timings["decompose"] = time.perf_counter() - start
+        report("encoding", 0.8)
+        start = time.perf_counter()
+        content = pca_encoders.encode_pcaz(decomposition, channels, num_components, container_preset)
+    else:
+        if color_space == "ycbcr":
+            # Luma gets num_components, chroma a smaller budget and optionally half resolution
+            compressed_img_array, (decomposition, _) = pca_engine.compress_image_ycbcr(
+                img_array, num_components, chroma_components, subsample_chroma, solver=engine, dtype=dtype,
+                oversampling=oversampling, power_iterations=power_iterations
+            )
+        else:
+            # All three channels are decomposed in one batched call
+            channels, decomposition = decompose_image(
+                img_array, num_components, engine, dtype, oversampling=oversampling, power_iterations=power_iterations
+            )
+            compressed_img_array = pca_engine.merge_channels(decomposition.reconstruct(channels, num_components))
+        timings["decompose"] = time.perf_counter() - start
+        report("encoding", 0.8)
+        start = time.perf_counter()
+        content = encode_image(compressed_img_array, output_format)
+    timings["encode"] = time.perf_counter() - start
+
+    error_estimate = None
+    if decomposition.error_estimate is not None:
+        error_estimate = [float(e) for e in decomposition.error_estimate]
+    return content, pca_encoders.media_type(output_format), decomposition.solver, error_estimate, timings
+
+
+def compress_batch(items, engine="auto", precision="float64", output_format="jpeg", container_preset="float16"):
+    """Compress same-shape images with one stacked decomposition.
+
+    items is a list of (name, source, num_components), source being a path
+    or the encoded bytes. Returns a list of (name, content, solver) in the
+    same order.
+    """
+    names = [name for name, _, _ in items]
+    k_values = [k for _, _, k in items]
+    images = [decode_rgb(source) for _, source, _ in items]
+    dtype = pca_engine.PRECISIONS[precision]
+
+    if output_format == pca_encoders.CONTAINER_FORMAT:
+        channels, decomposition = pca_engine.decompose_image_batch(images, max(k_values), solver=engine, dtype=dtype)
+        contents = [
+            pca_encoders.encode_pcaz(
+                decomposition.slice_channels(3 * index, 3 * index + 3), channels[3 * index:3 * index + 3], k,
+                container_preset
+            )
+            for index, k in enumerate(k_values)
+        ]
+        solver = decomposition.solver
+    else:
+        results = pca_engine.compress_image_batch(images, k_values, solver=engine, dtype=dtype)
+        contents = [encode_image(image, output_format) for image, _ in results]
+        solver = results[0][1].solver
+
+    return [(name, content, solver) for name, content in zip(names, contents)]
+
+
+def rate_distortion(source, k_values, size=None):
+    # Bytes against PSNR of the .pcaz container for every preset; size is set by admission control
+    report = pca_container.rate_distortion(decode_rgb(source, size), k_values)
+    for row in report:
+        # A lossless reconstruction has infinite PSNR, which JSON cannot carry
+        if row["psnr"] == float("inf"):
+            row["psnr"] = None
+    return report
+
+
+def decompress(contents, num_components=None):
+    # Progressive: any number of components up to the stored rank
+    img_array = pca_container.decode_pcaz(contents, num_components, MAX_PIXELS)
+    img_byte_arr = io.BytesIO()
+    Image.fromarray(img_array.squeeze()).save(img_byte_arr, format='PNG')
+    return img_byte_arr.getvalue()
+
+
+def analyze(source):
+    img = open_image(source).convert('RGB')
+
+    # Resize for analysis speed (similar to what user wanted, but now in Python)
+    # Python is fast, but sending 1000x1000 matrix over JSON is slow.
+    # We will resize to small dimension for "Instructional" analysis.
+    img.thumbnail((32, 32))
+    img_array = np.array(img)
+
+    # Full decomposition of all channels in one batched call
+    decomposition = pca_engine.decompose(pca_engine.split_channels(img_array), keep_covariance=True)
+
+    def channel_summary(index):
+        # Return top 5x5 subset for display
+        return {
+            "cov": decomposition.cov_matrices[index][:5, :5].tolist(),
+            "eigVals": decomposition.eig_vals[index][:10].tolist(),
+            "eigVecs": decomposition.eig_vecs[index][:5, :5].tolist()
+        }
+
+    return {"red": channel_summary(0), "green": channel_summary(1), "blue": channel_summary(2)}
+
+
+# Summaries /analyze/summary can compute; each is only computed when requested
+SUMMARIES = ("spectrum", "explained_variance", "eigenvectors")
+CHANNEL_NAMES = np.array(["red", "green", "blue"])
+
+
+def downsample_vectors(eig_vecs, length):
+    """Block-average (channels, width, k) eigenvectors along the width to at most length samples"""
+    width = eig_vecs.shape[1]
+    if width <= length:
+        return np.asarray(eig_vecs)
+    edges = np.linspace(0, width, length + 1).astype(np.intp)
+    sums = np.add.reduceat(eig_vecs, edges[:-1], axis=1)
+    return sums / np.diff(edges)[None, :, None]
+
+
+def summarize(source, summaries=SUMMARIES, top=10, vector_length=256, precision="float64", size=None):
+    """Summaries of the PCA of the image at its real resolution, as a dict of numpy arrays.
+
+    The spectrum comes from eigvalsh alone; eigenvectors (only the top ones,
+    block-averaged to vector_length) come from the decomposition store, so a
+    decomposition left by /compress is reused and one computed here serves it.
+    """
+    img_array = decode_rgb(source, size)
+    dtype = pca_engine.PRECISIONS[precision]
+    height, width = img_array.shape[:2]
+    result = {"shape": np.array([height, width]), "channels": CHANNEL_NAMES}
+
+    if "spectrum" in summaries or "explained_variance" in summaries:
+        eig_vals, total_variance = pca_engine.spectrum(pca_engine.split_channels(img_array), dtype)
+        if "spectrum" in summaries:
+            result["spectrum"] = eig_vals.astype(np.float32)
+            result["total_variance"] = total_variance.astype(np.float32)
+        if "explained_variance" in summaries:
+            curve = pca_engine.spectrum_curve(eig_vals, total_variance, height, width)
+            total = np.where(total_variance > 0, total_variance, 1)[:, None]
+            result["explained_variance"] = (np.cumsum(np.clip(eig_vals, 0, None), axis=1) / total).astype(np.float32)
+            result["retained_variance"] = curve["retained_variance"].astype(np.float32)
+            result["psnr"] = curve["psnr"].astype(np.float32)
+
+    if "eigenvectors" in summaries:
+        _, decomposition = decompose_image(img_array, top, "auto", dtype)
+        k = decomposition.clamp_components(top)
+        result["eigenvectors"] = downsample_vectors(decomposition.eig_vecs[:, :, :k], vector_length).astype(np.float32)
+        result["eigenvalues"] = np.asarray(decomposition.eig_vals[:, :k], dtype=np.float32)
+    return result
+
+
+def encode_arrays(arrays, output_format="npz"):
+    """npz (a zip of .npy files, loadable with allow_pickle=False) or JSON lists"""
+    if output_format == "json":
+        return json.dumps({name: np.asarray(array).tolist() for name, array in arrays.items()}).encode("utf-8")
+    buffer = io.BytesIO()
+    np.savez(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def analyze_summary(source, output_format="npz", **options):
+    return encode_arrays(summarize(source, **options), output_format)
+
+
+def decode_pair(original, compressed, size=None):
+    import cv2
+
+    # OpenCV wants contiguous buffers, memory-mapped TIFFs may be strided views.
+    # size (set by admission control) downscales both while decoding.
+    img1 = np.ascontiguousarray(decode_rgb(original, size))
+    img2 = np.ascontiguousarray(decode_rgb(compressed, size))
+
+    # Ensure same size for pixel-wise comparison (resize compressed to original if needed)
+    if img1.shape != img2.shape:
+        # Resize img2 to match img1
+        img2 = cv2.resize(img2, (img1.shape[1], img1.shape[0]))
+    return img1, img2
+
+
+def compare_analytics(original, compressed, size=None):
+    import analytics as ana
+
+    # Every analysis reads the grayscale, float32 and Lab versions from these, each computed once
+    img1, img2 = (ana.AnalysisContext(img) for img in decode_pair(original, compressed, size))
+
+    # Analysis
+    ssim_score, diff_map = ana.get_ssim(img1, img2)
+    sharp1 = ana.get_sharpness(img1)
+    sharp2 = ana.get_sharpness(img2)
+
+    plots = {
+        "histograms": ana.generate_histograms(img1, img2),
+        "channels": ana.generate_channel_histograms(img1, img2),
+        "intensity": ana.generate_pixel_intensity(img1, img2),
+        "edges": ana.generate_edges(img1, img2),
+        "ssim_map": ana.generate_ssim_map(diff_map),
+        "fft": ana.generate_fft(img1, img2),
+        "contours": ana.generate_contours(img1, img2), # Can be slow
+        "color_diff": ana.generate_color_diff(img1, img2),
+        "texture": ana.generate_texture(img1, img2),
+    }
+
+    metrics = {
+        "ssim": float(ssim_score),
+        "sharpness_original": float(sharp1),
+        "sharpness_compressed": float(sharp2),
+    }
+    return metrics, plots
+
+
+def compare_analytics_data(original, compressed, output_format="npz", map_size=256, size=None):
+    """The data behind compare_analytics' plots, without rendering: histogram counts,
+    uint8 edge / SSIM / FFT maps and the scalar metrics, encoded with encode_arrays"""
+    import analytics as ana
+
+    img1, img2 = (ana.AnalysisContext(img) for img in decode_pair(original, compressed, size))
+    ssim_score, diff_map = ana.get_ssim(img1, img2)
+    data = ana.comparison_data(img1, img2, diff_map, map_size)
+    data["ssim"] = np.float32(ssim_score)
+    data["sharpness_original"] = np.float32(ana.get_sharpness(img1))
+    data["sharpness_compressed"] = np.float32(ana.get_sharpness(img2))
+    return encode_arrays(data, output_format)
@@ -0,0 +1,132 @@
+# uploads.py
+# Upload limits and spooling: request bodies are size- and rate-limited while they stream in, and
+# uploads are copied to a named temp file in chunks so handlers and workers pass a path, not bytes.
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+from fastapi import HTTPException
+
+MAX_UPLOAD_BYTES = int(os.environ.get("PCA_MAX_UPLOAD_BYTES", 100 * 1024 * 1024))
+# Uploads slower than this on average (after the grace period) are cut off, so slow clients can't pin memory
+MIN_UPLOAD_RATE = int(os.environ.get("PCA_MIN_UPLOAD_RATE", 32 * 1024))
+UPLOAD_GRACE_SECONDS = float(os.environ.get("PCA_UPLOAD_GRACE_SECONDS", 10))
+# Longest wait for the next chunk of a request body
+UPLOAD_IDLE_SECONDS = float(os.environ.get("PCA_UPLOAD_IDLE_SECONDS", 30))
+SPOOL_DIR = os.environ.get("PCA_SPOOL_DIR") or None  # None: the system temp directory
+CHUNK_SIZE = 1024 * 1024
+
+
+class UploadRejected(HTTPException):
+    # An HTTPException, so FastAPI's body parsing passes it through instead of turning it into a 400
+    pass
+
+
+class UploadLimitMiddleware:
+    """ASGI middleware enforcing MAX_UPLOAD_BYTES and MIN_UPLOAD_RATE on request bodies as they arrive"""
+
+    def __init__(self, app, max_bytes=MAX_UPLOAD_BYTES, min_rate=MIN_UPLOAD_RATE,
+                 grace_seconds=UPLOAD_GRACE_SECONDS, idle_seconds=UPLOAD_IDLE_SECONDS):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.min_rate = min_rate
+        self.grace_seconds = grace_seconds
+        self.idle_seconds = idle_seconds
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("POST", "PUT"):
+            await self.app(scope, receive, send)
+            return
+
+        # Refuse up front when the client declares a body that is too large
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > self.max_bytes:
+            await self._reject(send, 413, "Upload is too large")
+            return
+
+        received = 0
+        start = time.monotonic()
+
+        async def limited_receive():
+            nonlocal received
+            try:
+                message = await asyncio.wait_for(receive(), timeout=self.idle_seconds)
+            except asyncio.TimeoutError:
+                raise UploadRejected(status_code=408, detail="Upload stalled")
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise UploadRejected(status_code=413, detail="Upload is too large")
+                elapsed = time.monotonic() - start
+                if message.get("more_body") and elapsed > self.grace_seconds and received / elapsed < self.min_rate:
+                    raise UploadRejected(status_code=408, detail="Upload is too slow")
+            return message
+
+        response_started = False
+
+        async def tracking_send(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracking_send)
+        except UploadRejected as e:
+            # Raised outside a route (e.g. while a middleware reads the body)
+            if not response_started:
+                await self._reject(send, e.status_code, e.detail)
+
+    @staticmethod
+    async def _reject(send, status_code, detail):
+        body = f'{{"detail": "{detail}"}}'.encode()
+        await send({
+            "type": "http.response.start",
+            "status": status_code,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+                        (b"connection", b"close")],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+async def spool_upload(upload, max_bytes=MAX_UPLOAD_BYTES):
+    """Copy an UploadFile to a named temp file chunk by chunk, returns its path.
+
+    The caller owns the file and must remove it (or hand it over, e.g. to the job queue).
+    """
+    fd, path = tempfile.mkstemp(prefix="pca-upload-", dir=SPOOL_DIR)
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while chunk := await upload.read(CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadRejected(status_code=413, detail="Upload is too large")
+                f.write(chunk)
+    except BaseException:
+        os.unlink(path)
+        raise
+    return path
+
+
+def spool_file(source):
+    """Copy a readable binary file object to a named temp file chunk by chunk, returns its path.
+
+    The blocking counterpart of spool_upload, e.g. for zip members; run it off the event loop.
+    """
+    fd, path = tempfile.mkstemp(prefix="pca-upload-", dir=SPOOL_DIR)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            shutil.copyfileobj(source, f, CHUNK_SIZE)
+    except BaseException:
+        os.unlink(path)
+        raise
+    return path
+
+
+def remove_spooled(path):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass  # handed over to the job queue
@@ -0,0 +1,104 @@
+# workers.py
+import asyncio
+import functools
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Pool sizing, all overridable from the environment
+MAX_WORKERS = int(os.environ.get("PCA_WORKERS", min(4, os.cpu_count() or 1)))
+# Requests allowed to wait for a worker on top of the ones being processed
+MAX_QUEUE_DEPTH = int(os.environ.get("PCA_QUEUE_DEPTH", 2 * MAX_WORKERS))
+RETRY_AFTER_SECONDS = int(os.environ.get("PCA_RETRY_AFTER", 2))
+# Each worker gets an equal share of the cores for BLAS so workers don't oversubscribe them
+BLAS_THREADS = int(os.environ.get("PCA_BLAS_THREADS", max(1, (os.cpu_count() or 1) // MAX_WORKERS)))
+
+BLAS_THREAD_VARIABLES = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS")
+
+
+class PoolSaturated(Exception):
+    """Raised when every worker is busy and the wait queue is full"""
+
+    def __init__(self, retry_after=RETRY_AFTER_SECONDS):
+        super().__init__("All PCA workers are busy, retry later")
+        self.retry_after = retry_after
+
+
+def limit_blas_threads(blas_threads):
+    """Cap the BLAS / OpenMP threads of this process.
+
+    The environment variables only take effect if numpy is not loaded yet,
+    which a spawned child can't rely on (it re-imports the parent's main
+    module, e.g. main.py and with it numpy). threadpoolctl, when installed,
+    also limits the libraries that are already loaded.
+    """
+    for name in BLAS_THREAD_VARIABLES:
+        os.environ[name] = str(blas_threads)
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return
+    threadpool_limits(blas_threads)
+
+
+def _init_worker(blas_threads):
+    limit_blas_threads(blas_threads)
+
+
+class WorkerPool:
+    """Bounded process pool for CPU-bound request stages.
+
+    At most max_workers calls run at once and max_queue_depth more may wait;
+    anything beyond that fails immediately with PoolSaturated instead of
+    piling up behind the event loop.
+    """
+
+    def __init__(self, max_workers=MAX_WORKERS, max_queue_depth=MAX_QUEUE_DEPTH, blas_threads=BLAS_THREADS):
+        self.max_workers = max_workers
+        self.max_queue_depth = max_queue_depth
+        self.blas_threads = blas_threads
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue_depth)
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _get_executor(self):
+        # Created lazily so importing the app never forks; spawn avoids inheriting event loop threads
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(self.blas_threads,),
+                )
+            return self._executor
+
+    def _reset(self, executor):
+        # A worker died (e.g. out of memory); start a fresh pool for the next request
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False)
+
+    async def run(self, func, *args, **kwargs):
+        """Run func(*args, **kwargs) in a worker process and await its result"""
+        if not self._slots.acquire(blocking=False):
+            raise PoolSaturated()
+        try:
+            executor = self._get_executor()
+            loop = asyncio.get_running_loop()
+            try:
+                return await loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+            except BrokenProcessPool:
+                self._reset(executor)
+                raise
+        finally:
+            self._slots.release()
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,374 @@
+# pca_container.py
+import json
+import lzma
+import math
+import struct
+import zlib
+
+import numpy as np
+
+import pca_engine
+
+# .pcaz layout:
+#   magic (4 bytes) | version (uint8) | header length (uint32, little endian) | JSON header | payload
+# The header describes every channel (size, stored rank) and where each of its
+# arrays lives in the payload. Per channel we store the column mean, the basis
+# (rank x width) and the scores (rank x height), component-major, so decoding
+# with fewer components only needs a prefix of every array.
+#
+# Since version 2 every array is split into segments of consecutive components.
+# Each segment has its own storage dtype and codec. Integer segments carry one
+# float32 scale per component.
+MAGIC = b"PCAZ"
+VERSION = 2
+MEDIA_TYPE = "application/x-pcaz"
+FILE_EXTENSION = ".pcaz"
+
+_PREAMBLE = struct.Struct("<4sBI")
+# Upper bounds on the JSON header size, used by size_model
+HEADER_BASE_BYTES = 128
+HEADER_SEGMENT_BYTES = 256
+
+QUANTIZATION_DTYPES = ("float32", "float16", "int16", "int8")
+CODECS = ("none", "zlib", "lzma")
+
+# Storage dtype of each array. A value may also be a list of (dtype, count)
+# tiers, e.g. [("int16", 8), ("int8", None)] keeps the first 8 components at
+# 16 bits and the rest at 8 bits (None means "all remaining components").
+DEFAULT_QUANTIZATION = {"mean": "float32", "basis": "float16", "scores": "float16"}
+
+# Named settings for the UIs and the rate-distortion report
+PRESETS = {
+    "float16": {"quantization": DEFAULT_QUANTIZATION, "codec": "none"},
+    "float16 + zlib": {"quantization": DEFAULT_QUANTIZATION, "codec": "zlib"},
+    "int16 + zlib": {"quantization": {"mean": "float16", "basis": "int16", "scores": "int16"}, "codec": "zlib"},
+    "int8 + zlib": {"quantization": {"mean": "float16", "basis": "int8", "scores": "int8"}, "codec": "zlib"},
+    "int8 + lzma": {"quantization": {"mean": "float16", "basis": "int8", "scores": "int8"}, "codec": "lzma"},
+    "tiered + lzma": {
+        "quantization": {
+            "mean": "float16",
+            "basis": [("int16", 8), ("int8", None)],
+            "scores": [("int16", 8), ("int8", None)],
+        },
+        "codec": "lzma",
+    },
+}
+
+
+class PCAContainer:
+    """Decoded contents of a .pcaz file: per-channel means, bases and scores"""
+
+    def __init__(self, height, width, means, bases, scores):
+        self.height = height
+        self.width = width
+        self.means = means      # per channel: (width,)
+        self.bases = bases      # per channel: (rank, width)
+        self.scores = scores    # per channel: (rank, height)
+
+    @property
+    def num_channels(self):
+        return len(self.means)
+
+    @property
+    def rank(self):
+        return min(basis.shape[0] for basis in self.bases)
+
+    def reconstruct_channel(self, index, num_components=None):
+        """Reconstruct one channel as float32 with the first num_components components"""
+        k = self.rank if num_components is None else int(min(max(num_components, 1), self.rank))
+        scores = np.asarray(self.scores[index][:k], dtype=np.float32)
+        basis = np.asarray(self.bases[index][:k], dtype=np.float32)
+        return np.matmul(scores.T, basis) + np.asarray(self.means[index], dtype=np.float32)
+
+    def reconstruct(self, num_components=None):
+        """Reconstruct the (height, width, channels) uint8 image with up to the stored rank"""
+        channels = np.stack([
+            self.reconstruct_channel(index, num_components) for index in range(self.num_channels)
+        ])
+        return pca_engine.merge_channels(pca_engine.clip_to_uint8(channels))
+
+
+def _tiers(spec, rows):
+    """Normalise a quantization spec into [(dtype, start, stop)] row ranges"""
+    if isinstance(spec, str):
+        spec = [(spec, None)]
+    tiers = []
+    start = 0
+    for dtype, count in spec:
+        if dtype not in QUANTIZATION_DTYPES:
+            raise ValueError(f"Unknown quantization dtype: {dtype}")
+        stop = rows if count is None else min(start + count, rows)
+        if stop > start:
+            tiers.append((dtype, start, stop))
+        start = stop
+    if start < rows:
+        # Components not covered by the tiers keep the last dtype
+        tiers.append((spec[-1][0], start, rows))
+    return tiers
+
+
+def _quantize(array, dtype):
+    """Quantize a (components, n) array, returns (stored array, per-component scales or None)"""
+    if dtype.startswith("float"):
+        return array.astype(dtype), None
+    qmax = np.iinfo(dtype).max
+    peak = np.abs(array).max(axis=1)
+    scales = np.where(peak > 0, peak / qmax, 1.0).astype(np.float32)
+    return np.rint(array / scales[:, None]).astype(dtype), scales
+
+
+def _compress(data, codec, level):
+    if codec == "zlib":
+        return zlib.compress(data, 6 if level is None else level)
+    if codec == "lzma":
+        return lzma.compress(data, preset=6 if level is None else level)
+    return data
+
+
+def _decompress(data, codec, max_length):
+    # Never inflate past max_length, the size the segment's shape allows (0 would mean no limit to zlib)
+    if codec == "none":
+        return data
+    decompressor = zlib.decompressobj() if codec == "zlib" else lzma.LZMADecompressor()
+    inflated = decompressor.decompress(data, max(max_length, 1))
+    if not decompressor.eof:
+        raise ValueError("Malformed PCAZ container: segment does not match its shape")
+    return inflated
+
+
+class _PayloadWriter:
+    def __init__(self):
+        self.chunks = []
+        self.offset = 0
+
+    def add(self, data):
+        spec = {"offset": self.offset, "nbytes": len(data)}
+        self.chunks.append(data)
+        self.offset += len(data)
+        return spec
+
+    def getvalue(self):
+        return b"".join(self.chunks)
+
+
+def _channel_quantization(quantization, index):
+    # One dict for every channel, or a list with one dict per channel
+    if quantization is None:
+        return DEFAULT_QUANTIZATION
+    if isinstance(quantization, (list, tuple)):
+        quantization = quantization[index]
+    return {**DEFAULT_QUANTIZATION, **quantization}
+
+
+def encode_pcaz(decomposition, channels, num_components, quantization=None, codec="none", level=None):
+    """Serialize the top num_components of a decomposition of channels to .pcaz bytes.
+
+    quantization maps "mean", "basis" and "scores" to a storage dtype (or a
+    list of per-component tiers, see DEFAULT_QUANTIZATION), either for every
+    channel or as a list with one mapping per channel. codec is applied
+    losslessly to every stored segment.
+    """
+    if codec not in CODECS:
+        raise ValueError(f"Unknown codec: {codec}")
+    channels = pca_engine.as_channel_stack(channels)
+    k = decomposition.clamp_components(num_components)
+    n_channels, height, width = channels.shape
+
+    header = {"height": height, "width": width, "channels": []}
+    writer = _PayloadWriter()
+
+    for index in range(n_channels):
+        single = decomposition.channel(index)
+        basis = single.eig_vecs[0, :, :k]
+        centered_data = channels[index] - single.means[0]
+        arrays = {
+            "mean": single.means[0][np.newaxis],
+            "basis": basis.T,
+            "scores": np.matmul(centered_data, basis).T,
+        }
+        channel_quantization = _channel_quantization(quantization, index)
+
+        entry = {"height": height, "width": width, "rank": k, "arrays": {}}
+        for name, array in arrays.items():
+            segments = []
+            for dtype, start, stop in _tiers(channel_quantization[name], array.shape[0]):
+                stored, scales = _quantize(array[start:stop], dtype)
+                segment = {
+                    "dtype": dtype,
+                    "shape": list(stored.shape),
+                    "codec": codec,
+                    **writer.add(_compress(np.ascontiguousarray(stored).tobytes(), codec, level)),
+                }
+                if scales is not None:
+                    segment["scales"] = writer.add(scales.tobytes())
+                segments.append(segment)
+            entry["arrays"][name] = {"shape": list(array.shape), "segments": segments}
+        header["channels"].append(entry)
+
+    header_bytes = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    return _PREAMBLE.pack(MAGIC, VERSION, len(header_bytes)) + header_bytes + writer.getvalue()
+
+
+def size_model(height, width, num_channels, quantization=None):
+    """Linear model of the uncompressed .pcaz size, returns (fixed_bytes, bytes_per_component).
+
+    Lossless codecs only shrink the payload, so this is an upper bound for
+    them. Tiered quantizations are costed at their widest dtype.
+    """
+    fixed_bytes = _PREAMBLE.size + HEADER_BASE_BYTES
+    bytes_per_component = 0
+    for index in range(num_channels):
+        channel_quantization = _channel_quantization(quantization, index)
+        for name in ("mean", "basis", "scores"):
+            spec = channel_quantization[name]
+            dtypes = [spec] if isinstance(spec, str) else [dtype for dtype, _ in spec]
+            itemsize = max(np.dtype(dtype).itemsize for dtype in dtypes)
+            scale_bytes = 4 if any(dtype.startswith("int") for dtype in dtypes) else 0
+            fixed_bytes += HEADER_SEGMENT_BYTES * len(dtypes)
+
+            if name == "mean":
+                fixed_bytes += width * itemsize + scale_bytes
+            else:
+                bytes_per_component += (width if name == "basis" else height) * itemsize + scale_bytes
+    return fixed_bytes, bytes_per_component
+
+
+def encode_image(image_array, num_components, quantization=None, codec="none", level=None, **decompose_options):
+    """Decompose an (height, width, 3) image and serialize it to .pcaz bytes"""
+    channels = pca_engine.split_channels(np.asarray(image_array)[:, :, :3])
+    decomposition = pca_engine.decompose(channels, num_components, **decompose_options)
+    return encode_pcaz(decomposition, channels, num_components, quantization, codec, level)
+
+
+def _is_count(value):
+    # JSON integers only, bool is an int subclass
+    return type(value) is int and value >= 0
+
+
+def read_pcaz(data, num_components=None, max_pixels=None):
+    """Parse .pcaz bytes into a PCAContainer.
+
+    With num_components, segments holding only later components are skipped.
+    Containers describing more than max_pixels pixels are refused before any
+    segment is inflated. Malformed containers raise ValueError.
+    """
+    if num_components is not None and num_components < 1:
+        raise ValueError("num_components must be at least 1")
+    data = memoryview(data)
+    if len(data) < _PREAMBLE.size:
+        raise ValueError("Not a PCAZ container")
+    magic, version, header_length = _PREAMBLE.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Not a PCAZ container")
+    if version > VERSION:
+        raise ValueError(f"Unsupported PCAZ version: {version}")
+
+    header_end = _PREAMBLE.size + header_length
+    payload = data[header_end:]
+    try:
+        header = json.loads(bytes(data[_PREAMBLE.size:header_end]).decode("utf-8"))
+        height, width = header["height"], header["width"]
+        if not (_is_count(height) and _is_count(width)) or height < 1 or width < 1:
+            raise ValueError("Malformed PCAZ container: bad image size")
+        if max_pixels is not None and height * width > max_pixels:
+            raise ValueError(f"Image has {height * width} pixels, the limit is {max_pixels}")
+        if not 1 <= len(header["channels"]) <= 4:
+            raise ValueError("Malformed PCAZ container: bad channel count")
+
+        def raw(spec):
+            offset, nbytes = spec["offset"], spec["nbytes"]
+            if not (_is_count(offset) and _is_count(nbytes)) or offset + nbytes > len(payload):
+                raise ValueError("Malformed PCAZ container: segment outside the payload")
+            return bytes(payload[offset:offset + nbytes])
+
+        def segments(spec, columns, max_rows):
+            # Version 1 arrays are a single uncompressed float segment, its mean a plain vector
+            segments = spec.get("segments", [spec])
+            rows = 0
+            for segment in segments:
+                shape = segment["shape"]
+                if (
+                    len(shape) not in (1, 2) or not all(_is_count(n) for n in shape) or shape[-1] != columns
+                    or segment["dtype"] not in QUANTIZATION_DTYPES or segment.get("codec", "none") not in CODECS
+                ):
+                    raise ValueError("Malformed PCAZ container: bad segment")
+                rows += shape[0] if len(shape) == 2 else 1
+            if rows > max_rows:
+                raise ValueError("Malformed PCAZ container: more components than the image has")
+            return segments, rows
+
+        def load(segments, rows=None):
+            parts = []
+            start = 0
+            for segment in segments:
+                if rows is not None and start >= rows:
+                    break
+                dtype = np.dtype(segment["dtype"])
+                nbytes = math.prod(segment["shape"]) * dtype.itemsize
+                buffer = _decompress(raw(segment), segment.get("codec", "none"), nbytes)
+                if len(buffer) != nbytes:
+                    raise ValueError("Malformed PCAZ container: segment does not match its shape")
+                array = np.frombuffer(buffer, dtype=dtype).reshape(segment["shape"])
+                if "scales" in segment:
+                    scales = np.frombuffer(raw(segment["scales"]), dtype=np.float32)
+                    if len(scales) != array.shape[0]:
+                        raise ValueError("Malformed PCAZ container: scales do not match their segment")
+                    array = array.astype(np.float32) * scales[:, None]
+                parts.append(array)
+                start += array.shape[0]
+            return np.concatenate(parts) if len(parts) > 1 else parts[0]
+
+        means, bases, scores = [], [], []
+        for entry in header["channels"]:
+            arrays = entry["arrays"]
+            mean_segments, _ = segments(arrays["mean"], width, 1)
+            basis_segments, rank = segments(arrays["basis"], width, min(height, width))
+            score_segments, score_rank = segments(arrays["scores"], height, min(height, width))
+            if score_rank != rank or rank == 0:
+                raise ValueError("Malformed PCAZ container: basis and scores disagree")
+            means.append(load(mean_segments).reshape(-1))
+            bases.append(load(basis_segments, num_components))
+            scores.append(load(score_segments, num_components))
+    except (KeyError, TypeError, AttributeError, UnicodeDecodeError, zlib.error, lzma.LZMAError) as e:
+        raise ValueError(f"Malformed PCAZ container: {type(e).__name__}: {e}") from e
+
+    return PCAContainer(height, width, means, bases, scores)
+
+
+def decode_pcaz(data, num_components=None, max_pixels=None):
+    """Decode .pcaz bytes to a uint8 image, optionally with fewer components than stored"""
+    return read_pcaz(data, num_components, max_pixels).reconstruct(num_components)
+
+
+def psnr(original, reconstructed):
+    """Peak signal-to-noise ratio in dB between two uint8 images"""
+    mse = np.mean((np.asarray(original, dtype=np.float64) - reconstructed) ** 2)
+    return float("inf") if mse == 0 else float(10 * np.log10(255.0 ** 2 / mse))
+
+
+def rate_distortion(image_array, num_components_list, presets=None, decomposition=None, **decompose_options):
+    """Bytes against PSNR for every combination of component count and preset.
+
+    The image is decomposed once for the largest k, unless a decomposition
+    of it covering that k is passed in; returns a list of rows with preset,
+    k, bytes, bits per pixel and PSNR against the original.
+    """
+    image_array = np.asarray(image_array)[:, :, :3]
+    channels = pca_engine.split_channels(image_array)
+    presets = PRESETS if presets is None else presets
+    if decomposition is None:
+        decomposition = pca_engine.decompose(channels, max(num_components_list), **decompose_options)
+    n_pixels = image_array.shape[0] * image_array.shape[1]
+
+    report = []
+    for name, settings in presets.items():
+        for k in sorted(set(num_components_list)):
+            data = encode_pcaz(decomposition, channels, k, settings.get("quantization"), settings.get("codec", "none"))
+            report.append({
+                "preset": name,
+                "components": k,
+                "bytes": len(data),
+                "bpp": 8.0 * len(data) / n_pixels,
+                "psnr": psnr(image_array, decode_pcaz(data)),
+            })
+    return report
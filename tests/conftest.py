@@ -0,0 +1,5 @@
+# The app modules live at the repository root, not in a package
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
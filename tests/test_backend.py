@@ -0,0 +1,269 @@
+import io
+import os
+import shutil
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image
+
+# The FastAPI backend's modules live in pca-web/backend. It goes first on the path: its database.py
+# is not the Streamlit app's, the shared modules (pca_engine, ...) are identical copies.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "pca-web" / "backend"))
+
+fastapi = pytest.importorskip("fastapi")
+from fastapi.testclient import TestClient  # noqa: E402
+
+import admission  # noqa: E402
+import pca_engine  # noqa: E402
+import result_cache  # noqa: E402
+import uploads  # noqa: E402
+from database import JobStorage  # noqa: E402
+from decomposition_store import DecompositionStore  # noqa: E402
+
+
+def random_channels(height, width, seed=0):
+    image = np.random.default_rng(seed).integers(0, 256, (height, width, 3), dtype=np.uint8)
+    return pca_engine.split_channels(image)
+
+
+def png_bytes(height, width, seed=0):
+    image = np.random.default_rng(seed).integers(0, 256, (height, width, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(image).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def bundles(store):
+    return sorted(entry.name for entry in store.directory.iterdir() if entry.is_dir())
+
+
+def test_store_round_trip(tmp_path):
+    store = DecompositionStore(tmp_path)
+    channels = random_channels(30, 40)
+    decomposition = store.get_or_decompose(channels, digest="a")
+
+    stored = store.get("a")
+    assert stored is not None
+    assert isinstance(stored.eig_vecs, np.memmap)
+    assert np.allclose(stored.reconstruct(channels, 10), decomposition.reconstruct(channels, 10))
+    # Exact bundles never serve randomized requests
+    assert store.get("a", 5, solver="randomized") is None
+
+
+def test_store_evicts_least_recently_used(tmp_path):
+    channels = random_channels(30, 40)
+    bundle_bytes = DecompositionStore(tmp_path / "probe").get_or_decompose(channels, digest="x").eig_vecs.nbytes
+    store = DecompositionStore(tmp_path / "store", max_bytes=int(2.5 * bundle_bytes))
+
+    for digest in ("a", "b"):
+        store.get_or_decompose(channels, digest=digest)
+    time.sleep(0.01)
+    store.get("a")  # b is now the least recently used
+    store.get_or_decompose(channels, digest="c")
+
+    assert store.get("a") is not None
+    assert store.get("b") is None
+    assert store.get("c") is not None
+    assert len(bundles(store)) == 2
+
+
+def test_store_recover(tmp_path):
+    store = DecompositionStore(tmp_path)
+    channels = random_channels(30, 40)
+    for digest in ("a", "b"):
+        store.get_or_decompose(channels, digest=digest)
+    # A crashed writer's staging directory, a bundle without meta.json and a lost index
+    stale = tmp_path / ".crashed-staging"
+    stale.mkdir()
+    os.utime(stale, (0, 0))
+    (tmp_path / "damaged").mkdir()
+    for path in tmp_path.glob("index.db*"):
+        path.unlink()
+
+    recovered = DecompositionStore(tmp_path)
+    recovered.recover()
+
+    assert recovered.get("a") is not None
+    assert recovered.get("b") is not None
+    assert not stale.exists()
+    assert not (tmp_path / "damaged").exists()
+
+
+def test_store_recover_drops_missing_bundles(tmp_path):
+    store = DecompositionStore(tmp_path)
+    store.get_or_decompose(random_channels(30, 40), digest="a")
+    for name in bundles(store):
+        shutil.rmtree(tmp_path / name)
+
+    store.recover()
+    assert store.get("a") is None
+    assert bundles(store) == []
+
+
+def test_result_cache_lru_and_disk_tier(tmp_path):
+    cache = result_cache.ResultCache(max_bytes=10, disk_dir=tmp_path)
+    cache.put("a", b"123456", {"engine": "full"})
+    cache.put("b", b"123456", {"engine": "lanczos"})
+
+    # a was evicted from memory but is promoted back from disk
+    assert len(cache) == 1
+    assert cache.get("a") == (b"123456", {"engine": "full"})
+    assert cache.get("missing") is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_result_key_and_etag(tmp_path):
+    path = tmp_path / "upload"
+    path.write_bytes(b"image")
+    key = result_cache.result_key(str(path), {"num_components": 5})
+
+    assert key == result_cache.result_key(b"image", {"num_components": 5})
+    assert key != result_cache.result_key(b"image", {"num_components": 6})
+    etag = result_cache.etag_for(key)
+    assert result_cache.etag_matches(etag, etag)
+    assert result_cache.etag_matches(f'"other", {etag.removeprefix("W/")}', etag)
+    assert result_cache.etag_matches("*", etag)
+    assert not result_cache.etag_matches('"other"', etag)
+    assert not result_cache.etag_matches(None, etag)
+
+
+def upload_app(max_bytes):
+    app = fastapi.FastAPI()
+    app.add_middleware(uploads.UploadLimitMiddleware, max_bytes=max_bytes)
+
+    @app.post("/upload")
+    async def upload(file: fastapi.UploadFile = fastapi.File(...)):
+        path = await uploads.spool_upload(file)
+        try:
+            return {"bytes": os.path.getsize(path)}
+        finally:
+            uploads.remove_spooled(path)
+
+    return app
+
+
+def test_upload_limit():
+    client = TestClient(upload_app(max_bytes=4096))
+
+    response = client.post("/upload", files={"file": ("a", bytes(1024))})
+    assert response.status_code == 200
+    assert response.json() == {"bytes": 1024}
+
+    response = client.post("/upload", files={"file": ("a", bytes(8192))})
+    assert response.status_code == 413
+    assert response.json() == {"detail": "Upload is too large"}
+
+
+def test_upload_limit_without_content_length():
+    # Chunked bodies have no Content-Length, the limit applies while they stream in
+    client = TestClient(upload_app(max_bytes=4096))
+    head = b'--b\r\nContent-Disposition: form-data; name="file"; filename="a"\r\n\r\n'
+    parts = [head] + [bytes(1024)] * 8 + [b"\r\n--b--\r\n"]
+    response = client.post(
+        "/upload", content=iter(parts), headers={"Content-Type": "multipart/form-data; boundary=b"}
+    )
+    assert response.status_code == 413
+
+
+def test_admission():
+    width, height = admission.read_header(png_bytes(30, 40))
+    assert (width, height) == (40, 30)
+    with pytest.raises(admission.AdmissionError) as error:
+        admission.read_header(b"not an image")
+    assert error.value.status_code == 400
+
+    admitted = admission.admit(png_bytes(30, 40), 5)
+    assert admitted["action"] == "run"
+    assert admitted["size"] is None
+    assert admission.describe(admitted) == "accepted"
+
+    preview = admission.admit(png_bytes(64, 80), 5, preview=4)
+    assert preview["size"] == (20, 16)
+    assert admission.describe(preview) == "preview 1/4 20x16"
+
+
+def test_admission_budget(monkeypatch):
+    monkeypatch.setattr(admission, "WORKER_MEMORY_BYTES", 64 * 1024)
+    source = png_bytes(300, 400)
+
+    with pytest.raises(admission.AdmissionError) as error:
+        admission.admit(source, 5, oversize="reject")
+    assert error.value.status_code == 413
+
+    admitted = admission.admit(source, 5, oversize="downscale")
+    assert admitted["downscaled"]
+    assert admitted["size"][0] * admitted["size"][1] < 400 * 300
+    assert admitted["cost"]["peak_bytes"] <= admission.WORKER_MEMORY_BYTES
+
+    compared = admission.admit_comparison(source, source, admission.COMPARE_BYTES_PER_PIXEL["data"])
+    assert compared["downscaled"]
+    assert compared["cost"]["peak_bytes"] <= admission.WORKER_MEMORY_BYTES
+
+
+def test_job_queue(tmp_path):
+    jobs = JobStorage(tmp_path)
+    job_id = jobs.submit("compress", b"image", {"num_components": 5})
+    assert jobs.get(job_id)["status"] == "queued"
+
+    # The first worker dies without unregistering; its job goes back to the queue
+    worker = jobs.register_worker(1)
+    assert jobs.claim(worker)["id"] == job_id
+    jobs.unregister_worker(worker)
+    jobs.requeue_orphaned()
+    assert jobs.get(job_id)["status"] == "queued"
+
+    worker = jobs.register_worker(2)
+    job = jobs.claim(worker)
+    assert (job["id"], job["attempts"]) == (job_id, 2)
+    jobs.complete(job_id, b"result", "image/jpeg", {"engine": "full"})
+
+    job = jobs.get(job_id)
+    assert (job["status"], job["media_type"], job["result_meta"]) == ("done", "image/jpeg", {"engine": "full"})
+    assert jobs.result_path(job_id).read_bytes() == b"result"
+    assert not jobs.input_path(job_id).exists()
+    assert jobs.claim(worker) is None
+
+
+@pytest.fixture(scope="module")
+def client(tmp_path_factory):
+    # main keeps its databases and the decomposition store under the working directory
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.chdir(tmp_path_factory.mktemp("backend"))
+        monkeypatch.setenv("PCA_JOB_WORKER", "0")
+        monkeypatch.setenv("PCA_WORKERS", "1")
+        import main
+
+        with TestClient(main.app) as client:
+            yield client
+
+
+def test_compress_not_modified(client):
+    files = {"image": ("a.png", png_bytes(60, 80))}
+    data = {"num_components": 5, "output_format": "png"}
+
+    first = client.post("/compress", files=files, data=data)
+    assert first.status_code == 200
+    assert first.headers["X-Cache"] == "MISS"
+    etag = first.headers["ETag"]
+    assert etag.startswith('W/"')
+
+    revalidated = client.post("/compress", files=files, data=data, headers={"If-None-Match": etag})
+    assert revalidated.status_code == 304
+    assert revalidated.headers["ETag"] == etag
+    assert revalidated.content == b""
+
+    repeated = client.post("/compress", files=files, data=data)
+    assert repeated.headers["X-Cache"] == "HIT"
+    assert repeated.content == first.content
+
+    changed = client.post("/compress", files=files, data={**data, "num_components": 6}, headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+
+
+def test_decompress_malformed_container(client):
+    response = client.post("/decompress", files={"container": ("a.pcaz", b"PCAZ\x02\x05\x00\x00\x00{bad}")})
+    assert response.status_code == 400
@@ -0,0 +1,113 @@
+import json
+import lzma
+import zlib
+
+import numpy as np
+import pytest
+
+import pca_container
+
+
+def random_image(height, width, seed=0):
+    return np.random.default_rng(seed).integers(0, 256, (height, width, 3), dtype=np.uint8)
+
+
+def split(data):
+    # (header dict, payload bytes) of a .pcaz file
+    _, _, header_length = pca_container._PREAMBLE.unpack_from(data)
+    header_end = pca_container._PREAMBLE.size + header_length
+    return json.loads(data[pca_container._PREAMBLE.size:header_end]), data[header_end:]
+
+
+def join(header, payload):
+    header_bytes = json.dumps(header).encode("utf-8")
+    return pca_container._PREAMBLE.pack(pca_container.MAGIC, pca_container.VERSION, len(header_bytes)) + \
+        header_bytes + payload
+
+
+@pytest.mark.parametrize("preset", list(pca_container.PRESETS))
+def test_round_trip(preset):
+    image = random_image(40, 60)
+    settings = pca_container.PRESETS[preset]
+    data = pca_container.encode_image(image, 10, settings["quantization"], settings["codec"])
+    container = pca_container.read_pcaz(data)
+
+    assert (container.height, container.width, container.num_channels, container.rank) == (40, 60, 3, 10)
+    # Quantization is lossy, but the decoded image must match the float reconstruction closely
+    exact = pca_container.decode_pcaz(pca_container.encode_image(image, 10, {"basis": "float32", "scores": "float32"}))
+    decoded = pca_container.decode_pcaz(data)
+    assert decoded.shape == (40, 60, 3)
+    assert pca_container.psnr(exact, decoded) > 30
+
+
+def test_progressive_decode():
+    # Tiered quantization stores components 0-7 and 8-9 in separate segments; k=3 skips the second
+    quantization = {"basis": [("int16", 8), ("int8", None)], "scores": [("int16", 8), ("int8", None)]}
+    data = pca_container.encode_image(random_image(40, 60), 10, quantization, "zlib")
+    container = pca_container.read_pcaz(data, 3)
+
+    assert container.rank == 8
+    assert np.array_equal(pca_container.decode_pcaz(data, 3), pca_container.read_pcaz(data).reconstruct(3))
+    with pytest.raises(ValueError):
+        pca_container.read_pcaz(data, 0)
+
+
+def test_lossless_at_full_rank():
+    image = random_image(20, 30)
+    data = pca_container.encode_image(image, 20, {"mean": "float32", "basis": "float32", "scores": "float32"})
+    assert pca_container.psnr(image, pca_container.decode_pcaz(data)) > 50
+
+
+def test_max_pixels():
+    data = pca_container.encode_image(random_image(40, 60), 5)
+    assert pca_container.decode_pcaz(data, max_pixels=40 * 60).shape == (40, 60, 3)
+    with pytest.raises(ValueError, match="limit"):
+        pca_container.decode_pcaz(data, max_pixels=40 * 60 - 1)
+
+
+def corrupt_header(change):
+    def corrupt(header, payload):
+        change(header)
+        return join(header, payload)
+    return corrupt
+
+
+def first_segment(header, array="basis"):
+    return header["channels"][0]["arrays"][array]["segments"][0]
+
+
+def inflated_segment(compress):
+    # A tiny segment that inflates far beyond what its shape allows
+    def corrupt(header, payload):
+        bomb = compress(bytes(64 * 1024 * 1024))
+        segment = first_segment(header, "mean")
+        segment.update(codec="zlib" if compress is zlib.compress else "lzma", offset=len(payload), nbytes=len(bomb))
+        return join(header, payload + bomb)
+    return corrupt
+
+
+MALFORMED = {
+    "not a container": lambda header, payload: b"JPEG" + bytes(16),
+    "truncated": lambda header, payload: join(header, payload)[:-100],
+    "bad json": lambda header, payload: join(header, payload).replace(b'"channels"', b'"channels', 1),
+    "missing size": corrupt_header(lambda header: header.pop("height")),
+    "string size": corrupt_header(lambda header: header.update(width="60")),
+    "no channels": corrupt_header(lambda header: header.update(channels=None)),
+    "too many channels": corrupt_header(lambda header: header.update(channels=header["channels"] * 3)),
+    "wrong width": corrupt_header(lambda header: first_segment(header).update(shape=[5, 61])),
+    "rank mismatch": corrupt_header(lambda header: first_segment(header).update(shape=[4, 60])),
+    "rank above image": corrupt_header(lambda header: header.update(height=3)),
+    "unknown dtype": corrupt_header(lambda header: first_segment(header).update(dtype="object")),
+    "unknown codec": corrupt_header(lambda header: first_segment(header).update(codec="gzip")),
+    "offset past payload": corrupt_header(lambda header: first_segment(header).update(offset=10 ** 9)),
+    "negative offset": corrupt_header(lambda header: first_segment(header).update(offset=-1)),
+    "zlib bomb": inflated_segment(zlib.compress),
+    "lzma bomb": inflated_segment(lzma.compress),
+}
+
+
+@pytest.mark.parametrize("name", list(MALFORMED))
+def test_malformed_raises_value_error(name):
+    header, payload = split(pca_container.encode_image(random_image(40, 60), 5, codec="zlib"))
+    with pytest.raises(ValueError):
+        pca_container.decode_pcaz(MALFORMED[name](header, payload), max_pixels=10_000)
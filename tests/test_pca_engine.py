@@ -0,0 +1,143 @@
+import numpy as np
+import pytest
+
+import pca_engine
+
+
+def random_image(height, width, seed=0):
+    return np.random.default_rng(seed).integers(0, 256, (height, width, 3), dtype=np.uint8)
+
+
+@pytest.mark.parametrize("value", [0, 255])
+@pytest.mark.parametrize("shape", [(400, 300), (300, 400)])
+def test_lanczos_constant_channel(value, shape):
+    # A zero covariance / Gram matrix used to crash ARPACK ("starting vector is zero")
+    image = random_image(*shape)
+    image[:, :, 2] = value
+    reconstructed, decomposition = pca_engine.compress_image_array(image, 10, solver="lanczos")
+
+    assert decomposition.solver == "lanczos"
+    assert np.all(decomposition.eig_vals[2] == 0)
+    assert np.all(reconstructed[:, :, 2] == value)
+    assert np.isfinite(decomposition.eig_vecs).all()
+
+
+def test_auto_solver_solid_image():
+    # auto picks Lanczos for k / width <= 0.05
+    image = np.full((600, 800, 3), 77, dtype=np.uint8)
+    reconstructed, decomposition = pca_engine.compress_image_array(image, 20)
+
+    assert decomposition.solver == "lanczos"
+    assert np.array_equal(reconstructed, image)
+
+
+@pytest.mark.parametrize("subsample_chroma", [False, True])
+def test_ycbcr_grayscale(subsample_chroma):
+    # Cb and Cr of a gray image are constant 128, which auto sends to Lanczos
+    gray = np.random.default_rng(0).integers(0, 256, (600, 800), dtype=np.uint8)
+    image = np.dstack([gray] * 3)
+    reconstructed, (luma, chroma) = pca_engine.compress_image_ycbcr(image, 20, subsample_chroma=subsample_chroma)
+
+    assert chroma.solver == "lanczos"
+    assert np.all(chroma.eig_vals == 0)
+    # Still gray, and the same as compressing the luma alone
+    assert np.all(np.ptp(reconstructed, axis=2) == 0)
+    expected, _ = pca_engine.compress_image_array(image, 20)
+    assert np.array_equal(reconstructed, expected)
+
+
+def test_covers_keeps_randomized_separate():
+    channels = pca_engine.split_channels(random_image(200, 300))
+    full = pca_engine.decompose(channels, 10, solver="full")
+    randomized = pca_engine.decompose(channels, 10, solver="randomized", oversampling=0)
+
+    # Exact solvers serve each other, randomized only serves randomized with the same sketch settings
+    assert full.covers(10, "lanczos")
+    assert not full.covers(10, "randomized")
+    assert not randomized.covers(10, "full")
+    assert randomized.covers(10, "randomized", oversampling=0)
+    assert not randomized.covers(10, "randomized", oversampling=6)
+    assert not randomized.covers(10, "randomized")
+
+
+def structured_image(height, width, rank=12, seed=0):
+    # Decaying spectrum plus a little noise, so the leading subspaces are well separated
+    rng = np.random.default_rng(seed)
+    channels = []
+    for _ in range(3):
+        weights = 200.0 * 0.6 ** np.arange(rank)
+        plane = (rng.random((height, rank)) * weights) @ rng.random((rank, width)) / rank
+        channels.append(plane + rng.normal(0, 2, (height, width)))
+    image = np.stack(channels, axis=-1)
+    image = 255 * (image - image.min()) / np.ptp(image)
+    return image.astype(np.uint8)
+
+
+@pytest.mark.parametrize("shape", [(300, 200), (200, 300)])
+@pytest.mark.parametrize("solver", ["full", "subset", "lanczos", "randomized"])
+def test_float32_matches_float64(shape, solver):
+    image = structured_image(*shape)
+    expected, reference = pca_engine.compress_image_array(image, 8, solver=solver)
+    reconstructed, decomposition = pca_engine.compress_image_array(image, 8, solver=solver, dtype=np.float32)
+
+    assert decomposition.dtype == np.float32
+    assert decomposition.solver == reference.solver
+    np.testing.assert_allclose(decomposition.eig_vals[:, :8], reference.eig_vals[:, :8], rtol=1e-4)
+    # Rounding only moves pixels that sit right at a uint8 boundary, by one level
+    difference = np.abs(reconstructed.astype(int) - expected)
+    assert difference.max() <= 1
+    assert np.mean(difference) < 0.01
+
+
+@pytest.mark.parametrize("shape", [(300, 200), (200, 300)])
+@pytest.mark.parametrize("solver", ["subset", "lanczos"])
+def test_solver_parity(shape, solver):
+    channels = pca_engine.split_channels(structured_image(*shape))
+    reference = pca_engine.decompose(channels, 8, solver="full")
+    decomposition = pca_engine.decompose(channels, 8, solver=solver)
+
+    assert decomposition.solver == solver
+    assert decomposition.gram == reference.gram == (shape[0] < shape[1])
+    np.testing.assert_allclose(decomposition.eig_vals[:, :8], reference.eig_vals[:, :8], rtol=1e-6)
+    np.testing.assert_allclose(
+        decomposition.reconstruct_float(channels, 8), reference.reconstruct_float(channels, 8), atol=1e-6
+    )
+    np.testing.assert_allclose(decomposition.total_variance, reference.total_variance, rtol=1e-10)
+
+
+@pytest.mark.parametrize("solver", ["full", "subset", "lanczos"])
+def test_gram_matches_covariance(solver):
+    # Wide images decompose the smaller Gram matrix; keep_covariance forces the covariance
+    channels = pca_engine.split_channels(structured_image(150, 400))
+    gram = pca_engine.decompose(channels, 8, solver=solver)
+    covariance = pca_engine.decompose(channels, 8, solver=solver, keep_covariance=True)
+
+    assert gram.gram and not covariance.gram
+    np.testing.assert_allclose(gram.eig_vals[:, :8], covariance.eig_vals[:, :8], rtol=1e-8)
+    np.testing.assert_allclose(
+        gram.reconstruct_float(channels, 8), covariance.reconstruct_float(channels, 8), atol=1e-6
+    )
+
+
+@pytest.mark.parametrize("shape", [(300, 200), (200, 300)])
+def test_randomized_close_to_exact(shape):
+    # Approximate: the leading eigenvalues and the reconstruction error stay within 1% of the exact solver
+    channels = pca_engine.split_channels(structured_image(*shape))
+    reference = pca_engine.decompose(channels, 8, solver="full")
+    decomposition = pca_engine.decompose(channels, 8, solver="randomized")
+
+    assert decomposition.solver == "randomized"
+    np.testing.assert_allclose(decomposition.eig_vals[:, :3], reference.eig_vals[:, :3], rtol=1e-2)
+    approximate_error = np.linalg.norm(decomposition.reconstruct_float(channels, 8) - channels)
+    exact_error = np.linalg.norm(reference.reconstruct_float(channels, 8) - channels)
+    assert exact_error <= approximate_error * (1 + 1e-12)
+    assert approximate_error <= 1.01 * exact_error
+
+
+def test_randomized_error_estimate():
+    channels = pca_engine.split_channels(structured_image(300, 200))
+    decomposition = pca_engine.decompose(channels, 8, solver="randomized")
+    residual = decomposition.reconstruct_float(channels, 8) - channels
+    centered = channels - decomposition.means[:, None, :]
+    actual = np.linalg.norm(residual, axis=(1, 2)) / np.linalg.norm(centered, axis=(1, 2))
+    np.testing.assert_allclose(decomposition.error_estimate, actual, rtol=1e-6)
@@ -2,71 +2,167 @@ import streamlit as st
 from PIL import Image
 import numpy as np
 from io import BytesIO
+import pca_engine
+import pca_container
+import pca_encoders
+
+# Decompositions are cached per image content, so a new slider value only
+# costs a projection and not a new eigendecomposition
+DECOMPOSITION_CACHE_BYTES = 512 * 1024 * 1024
+
+@st.cache_resource
+def get_decomposition_cache():
+    # Shared by all sessions of this server process
+    return pca_engine.DecompositionCache(max_bytes=DECOMPOSITION_CACHE_BYTES)
+
+def get_decomposition(channels, num_components, engine="auto", oversampling=10, power_iterations=2, digest=None,
+                      precision="float64"):
+    # Exact engines decompose the full spectrum once so any later k is served from the cache.
+    # The randomized engine (chosen explicitly or by "auto" for very wide images) only computes k.
+    dim = min(channels.shape[-2:])
+    solver = engine if engine != "auto" else pca_engine.choose_solver(dim, num_components)
+    target = num_components if solver == "randomized" else None
+    return get_decomposition_cache().get_or_decompose(
+        channels, target, solver=solver, digest=digest, dtype=pca_engine.PRECISIONS[precision],
+        oversampling=oversampling, power_iterations=power_iterations
+    )
 
 # Function to apply PCA on image
-@st.cache_data
-def apply_pca(image_array, num_components):
+def apply_pca(image_array, num_components, engine="auto", oversampling=10, power_iterations=2, precision="float64",
+              color_space="rgb", chroma_components=None, subsample_chroma=False, output_format="jpeg"):
     # Convert image to numpy array
     # img_array = np.array(img) -> Pre-converted
-    
-    # Splitting RGB channels
-    red_channel = image_array[:, :, 0]
-    green_channel = image_array[:, :, 1]
-    blue_channel = image_array[:, :, 2]
-
-    # Apply PCA on each channel
-    red_compressed = pca_compress(red_channel, num_components)
-    green_compressed = pca_compress(green_channel, num_components)
-    blue_compressed = pca_compress(blue_channel, num_components)
-
-    # Combine compressed channels into one image
-    compressed_img_array = np.stack((red_compressed, green_compressed, blue_compressed), axis=2)
-
-    # Convert back to image
-    compressed_img = Image.fromarray(np.uint8(compressed_img_array))
-
-    # Convert compressed image to BytesIO for storage
-    compressed_img_bytes = BytesIO()
-    compressed_img.save(compressed_img_bytes, format='JPEG')
-    compressed_img_bytes.seek(0) 
+    image_array = np.ascontiguousarray(image_array[:, :, :3])
+    digest = pca_engine.image_digest(image_array)
+
+    if color_space == "ycbcr":
+        # Luma keeps num_components, chroma gets its own (smaller) budget
+        if chroma_components is None:
+            chroma_components = max(1, num_components // 2)
+        luma, chroma = pca_engine.ycbcr_planes(image_array, subsample_chroma, pca_engine.PRECISIONS[precision])
+        luma_decomposition = get_decomposition(
+            luma, num_components, engine, oversampling, power_iterations,
+            digest=f"{digest}:luma", precision=precision
+        )
+        chroma_decomposition = get_decomposition(
+            chroma, chroma_components, engine, oversampling, power_iterations,
+            digest=f"{digest}:chroma{'420' if subsample_chroma else ''}", precision=precision
+        )
+        compressed_img_array = pca_engine.merge_ycbcr_planes(
+            luma_decomposition.reconstruct_float(luma, num_components),
+            chroma_decomposition.reconstruct_float(chroma, chroma_components)
+        )
+    else:
+        # Apply PCA on all RGB channels in one batched decomposition
+        # engine is a pca_engine solver name ("auto", "full", "subset", "lanczos" or "randomized")
+        channels = pca_engine.split_channels(image_array)
+        # precision="float32" halves the memory of every intermediate buffer
+        decomposition = get_decomposition(
+            channels, num_components, engine, oversampling, power_iterations,
+            digest=digest, precision=precision
+        )
+        compressed_img_array = pca_engine.merge_channels(decomposition.reconstruct(channels, num_components))
+
+    # Encode with any pca_encoders format (jpeg, jpeg-optimized, jpeg-progressive, webp, png)
+    compressed_img_bytes = BytesIO(pca_encoders.encode(np.uint8(compressed_img_array), output_format))
     return compressed_img_bytes
     
-# Function to perform PCA compression on a single channel
-@st.cache_data
-def pca_compress(channel, num_components):
-    # Subtract the mean from the data
-    mean = np.mean(channel, axis=0)
-    centered_data = channel - mean
+# Function to store the PCA representation itself (.pcaz) instead of a re-encoded JPEG
+def apply_pca_container(image_array, num_components, engine="auto", oversampling=10, power_iterations=2,
+                        precision="float64", preset="float16"):
+    image_array = np.ascontiguousarray(image_array[:, :, :3])
+    channels = pca_engine.split_channels(image_array)
+    decomposition = get_decomposition(
+        channels, num_components, engine, oversampling, power_iterations,
+        digest=pca_engine.image_digest(image_array), precision=precision
+    )
+    # preset picks the quantization and lossless codec, see pca_container.PRESETS
+    return pca_encoders.encode_pcaz(decomposition, channels, num_components, preset)
+
+# Bytes against PSNR of the .pcaz container, from the cached decomposition
+def container_rate_distortion(image_array, num_components_list, engine="auto", precision="float64"):
+    image_array = np.ascontiguousarray(image_array[:, :, :3])
+    channels = pca_engine.split_channels(image_array)
+    decomposition = get_decomposition(
+        channels, max(num_components_list), engine, digest=pca_engine.image_digest(image_array), precision=precision
+    )
+    return pca_container.rate_distortion(image_array, num_components_list, decomposition=decomposition)
 
-    # Compute the covariance matrix
-    cov_matrix = np.cov(centered_data, rowvar=False)
+# Ways to pick the number of principal components
+SELECTION_MODES = ["Manual", "Retained variance", "Target PSNR", "Size budget"]
 
-    # Compute the eigenvalues and eigenvectors of the covariance matrix
-    eig_vals, eig_vecs = np.linalg.eigh(cov_matrix)
+def show_error_curve(decomposition):
+    import pandas as pd
 
-    # Sort eigenvalues and eigenvectors in descending order
-    sorted_indices = np.argsort(eig_vals)[::-1]
-    sorted_eig_vals = eig_vals[sorted_indices]
-    sorted_eig_vecs = eig_vecs[:, sorted_indices]
+    # Whole error-vs-k curve from the eigenvalues, no extra compressions needed
+    curve = pca_engine.error_curve(decomposition)
+    index = pd.Index(curve["components"], name="Principal components")
+    col1, col2 = st.columns(2)
+    with col1:
+        st.markdown("**Retained variance (%)**")
+        st.line_chart(pd.DataFrame({"Retained variance (%)": 100 * curve["retained_variance"]}, index=index))
+    with col2:
+        st.markdown("**Predicted PSNR (dB)**")
+        st.line_chart(pd.DataFrame({"PSNR (dB)": curve["psnr"]}, index=index))
 
-    # Choose the number of principal components
-    if num_components > len(sorted_eig_vals):
-        num_components = len(sorted_eig_vals)
-    elif num_components < 1:
-        num_components = 1
+# Function to choose the number of components manually or from a quality / size target
+def component_selector(img_array, max_components, default=10, key="components", preset="float16"):
+    mode = st.radio("Choose the number of principal components by", SELECTION_MODES, horizontal=True, key=f"{key}_mode")
 
-    # Project the data onto the selected principal components
-    projection_matrix = sorted_eig_vecs[:, :num_components]
-    compressed_data = np.dot(centered_data, projection_matrix)
+    decomposition = None
+    if mode != "Manual" or st.checkbox("Show error vs. number of components", key=f"{key}_curve"):
+        # Full spectrum, cached per image, so every target is answered from the eigenvalues
+        image_array = np.ascontiguousarray(img_array[:, :, :3])
+        decomposition = get_decomposition(
+            pca_engine.split_channels(image_array), None, digest=pca_engine.image_digest(image_array)
+        )
+
+    if mode == "Manual":
+        num_components = st.slider(
+            "Number of Principal Components", min_value=1, max_value=max_components,
+            value=min(default, max_components), key=f"{key}_slider"
+        )
+    else:
+        if mode == "Retained variance":
+            target = st.slider("Retained variance (%)", min_value=50.0, max_value=99.99, value=99.0, key=f"{key}_variance")
+            num_components = pca_engine.select_components(decomposition, target_variance=target / 100)
+        elif mode == "Target PSNR":
+            target = st.number_input("Target PSNR (dB)", min_value=10.0, max_value=80.0, value=35.0, key=f"{key}_psnr")
+            num_components = pca_engine.select_components(decomposition, target_psnr=target)
+        else:
+            budget_kb = st.number_input("PCA container size budget (KB)", min_value=1.0, value=100.0, key=f"{key}_budget")
+            height, width = img_array.shape[:2]
+            fixed_bytes, bytes_per_component = pca_container.size_model(
+                height, width, 3, pca_container.PRESETS[preset]["quantization"]
+            )
+            num_components = pca_engine.select_components(
+                decomposition, max_bytes=budget_kb * 1024,
+                fixed_bytes=fixed_bytes, bytes_per_component=bytes_per_component
+            )
+        num_components = min(num_components, max_components)
+        st.markdown(f"Selected **{num_components}** principal components")
 
-    # Reconstruct the data
-    reconstructed_data = np.dot(compressed_data, projection_matrix.T) + mean
+    if decomposition is not None:
+        show_error_curve(decomposition)
 
-    # Clip the values to [0, 255]
-    reconstructed_data = np.clip(reconstructed_data, 0, 255)
+    return num_components
 
-    return reconstructed_data.astype(np.uint8)
+# Reduced decodes for the live preview, label -> factor
+PREVIEW_SCALES = {"Off": 1, "1/2": 2, "1/4": 4, "1/8": 8}
 
+# Function to decode an upload at 1/scale of its size for previews
+def load_preview(uploaded_file, scale):
+    uploaded_file.seek(0)
+    img = Image.open(uploaded_file)
+    size = (max(1, img.width // scale), max(1, img.height // scale))
+    # JPEGs are decoded straight at 1/2, 1/4 or 1/8 scale (draft mode), other formats are a no-op here
+    img.draft('RGB', size)
+    img = img.convert('RGB')
+    factor = img.width // size[0]
+    if factor > 1:
+        # Box-average whatever draft mode didn't reduce
+        img = img.reduce(factor)
+    return np.array(img)
 
 # Function to validate image format
 def validate_image(uploaded_file):